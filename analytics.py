@@ -0,0 +1,279 @@
+"""Optional local analytical copy of scraped_results (Parquet + DuckDB).
+
+The first sync copies every row into a Parquet part file; after that,
+inserts, deletes and updates arrive from the change log as tombstones plus
+a part with the rows' current state. The explorer's metrics, breakdowns
+and table pages can then be answered by an embedded DuckDB instead of the
+shared database. The sync watermark (change-log position) and sync time
+live in state.json.
+
+    python analytics.py            # pull what changed
+    python analytics.py --full     # rebuild the snapshot from scratch
+
+Needs the optional `duckdb` and `pyarrow` packages.
+"""
+import os
+import re
+import json
+import time
+import uuid
+import argparse
+import threading
+
+import db
+import exports
+
+ANALYTICS_DIR = os.environ.get("ANALYTICS_DIR", os.path.join(db.APP_ROOT, "analytics_cache"))
+
+# Snapshots older than this are flagged as stale in the explorer
+ANALYTICS_MAX_AGE_SECONDS = 15 * 60
+
+# Small parts are merged once there are more than this many
+COMPACT_AFTER_PARTS = 20
+
+DIMENSION_SQL = {"provinsi": "Provinsi", "kabupaten": "Kabupaten", "kbli": "SUBSTR(KBLI, 1, 2)"}
+
+_sync_lock = threading.Lock()
+
+
+def available():
+    try:
+        import duckdb  # noqa: F401
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class AnalyticsStore:
+    """Parquet snapshot in `path`, synced from the database's change log."""
+
+    def __init__(self, path=ANALYTICS_DIR, engine=None):
+        self.path = path
+        self.engine = engine
+        self.state_path = os.path.join(path, "state.json")
+
+    # --- state ---
+
+    def state(self):
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                return json.load(f)
+        return {"rows": 0, "parts": [], "tombs": [], "sync_no": 0, "change_seq": 0, "synced_at": None}
+
+    def _save_state(self, state):
+        os.makedirs(self.path, exist_ok=True)
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp, self.state_path)
+
+    def age_seconds(self):
+        synced_at = self.state()["synced_at"]
+        return None if synced_at is None else time.time() - synced_at
+
+    def is_stale(self):
+        age = self.age_seconds()
+        return age is None or age > ANALYTICS_MAX_AGE_SECONDS
+
+    # --- sync ---
+
+    def _write_part(self, chunks):
+        """Write `chunks` to a new part file. Returns (file name, rows) or None when empty."""
+        rows = 0
+
+        def counted():
+            nonlocal rows
+            for chunk in chunks:
+                if chunk.empty:
+                    continue
+                rows += len(chunk)
+                yield chunk
+
+        name = f"part-{uuid.uuid4().hex[:12]}.parquet"
+        tmp = os.path.join(self.path, name + ".tmp")
+        with open(tmp, "wb") as f:
+            exports.write_parquet(counted(), f, table=db.results_table)
+        if rows == 0:
+            os.remove(tmp)
+            return None
+        os.replace(tmp, os.path.join(self.path, name))
+        return name, rows
+
+    def _write_tombstones(self, ids):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        name = f"tomb-{uuid.uuid4().hex[:12]}.parquet"
+        pq.write_table(pa.table({"id": pa.array(sorted(ids), pa.int64())}), os.path.join(self.path, name))
+        return name
+
+    def sync(self, full=False):
+        """Bring the snapshot up to date and return the number of rows copied.
+
+        After the first sync everything comes from db's change log: rows
+        inserted, deleted or updated since the last sync get a tombstone, and
+        those still there are copied again. There is no id watermark, as
+        TiDB's AUTO_INCREMENT is not monotonic. Without a change log every
+        sync is a full rebuild.
+        """
+        with _sync_lock:
+            os.makedirs(self.path, exist_ok=True)
+            state = self.state()
+            # Snapshots from before the change-log sync kept bare file names or an id watermark
+            legacy = "watermark" in state or any(isinstance(p, str) for p in state["parts"])
+            with (self.engine or db.get_engine()).connect() as connection:
+                change_log = db.has_change_log(connection)
+            full = full or legacy or not change_log or state["synced_at"] is None
+            if full:
+                old_files = [p if isinstance(p, str) else p["file"] for p in state["parts"] + state.get("tombs", [])]
+                state = {"rows": 0, "parts": [], "tombs": [], "sync_no": 0, "synced_at": None}
+                # Taken before copying: rows changed during the copy come again with the next sync
+                changed, last_seq = set(), db.change_version(engine=self.engine)[0]
+                rows = self._pages()
+            else:
+                old_files = []
+                changed, last_seq = db.fetch_changed_ids(state.get("change_seq", 0), engine=self.engine)
+                rows = db.fetch_rows(changed, engine=self.engine)
+            sync_no = state.get("sync_no", 0) + 1
+
+            part = self._write_part(rows)
+            if part:
+                state["parts"].append({"file": part[0], "sync": sync_no})
+            if changed:
+                state.setdefault("tombs", []).append({"file": self._write_tombstones(changed), "sync": sync_no})
+            state.update(sync_no=sync_no, change_seq=last_seq, synced_at=time.time())
+
+            if len(state["parts"]) > COMPACT_AFTER_PARTS:
+                old_files += [p["file"] for p in state["parts"] + state["tombs"]]
+                state["parts"] = [{"file": self._compact(state), "sync": sync_no}]
+                state["tombs"] = []
+            with self.connect(state) as con:
+                state["rows"] = con.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            self._save_state(state)
+            for name in old_files:
+                if os.path.exists(os.path.join(self.path, name)):
+                    os.remove(os.path.join(self.path, name))
+            return part[1] if part else 0
+
+    def _pages(self):
+        cursor = None
+        while True:
+            page, next_cursor = db.fetch_results_page(sort="id", descending=False, after=cursor,
+                                                      limit=db.EXPORT_CHUNK_SIZE, engine=self.engine)
+            if not page.empty:
+                yield page
+            if next_cursor is None:
+                return
+            cursor = next_cursor
+
+    def _compact(self, state):
+        name = f"part-{uuid.uuid4().hex[:12]}.parquet"
+        with self.connect(state) as con:
+            con.execute(f"COPY (SELECT * FROM results ORDER BY id) TO '{os.path.join(self.path, name)}' "
+                        "(FORMAT PARQUET, COMPRESSION ZSTD)")
+        return name
+
+    # --- queries ---
+
+    def connect(self, state=None):
+        """In-memory DuckDB connection with a `results` view over the snapshot.
+
+        A row is hidden when a tombstone from a later sync names its id.
+        """
+        import duckdb
+
+        state = self.state() if state is None else state
+        parts = [p for p in state["parts"] if not isinstance(p, str)]
+        con = duckdb.connect()
+        if not parts:
+            columns = ", ".join(f'NULL AS "{c.name}"' for c in db.results_table.columns)
+            con.execute(f"CREATE VIEW results AS SELECT {columns} WHERE FALSE")
+            return con
+
+        def union(entries, columns):
+            return " UNION ALL BY NAME ".join(
+                f"SELECT {columns}, {e['sync']} AS _sync FROM read_parquet('{os.path.join(self.path, e['file'])}')"
+                for e in entries
+            )
+
+        rows = union(parts, "*")
+        tombs = state.get("tombs") or []
+        if tombs:
+            con.execute(f"""
+                CREATE VIEW results AS SELECT * EXCLUDE (_sync) FROM ({rows}) p
+                WHERE NOT EXISTS (SELECT 1 FROM ({union(tombs, "id")}) t WHERE t.id = p.id AND t._sync > p._sync)
+            """)
+        else:
+            con.execute(f"CREATE VIEW results AS SELECT * EXCLUDE (_sync) FROM ({rows}) p")
+        return con
+
+    def query(self, sql, params=None):
+        """Run SQL written with db.build_filters' :name placeholders against the snapshot."""
+        params = params or {}
+        for name in params:
+            sql = re.sub(rf":{name}\b", f"${name}", sql)
+        with self.connect() as con:
+            return con.execute(sql, params).df()
+
+    def summarize(self, username=None, filters=None):
+        where, params = db.build_filters(username, filters)
+        row = self.query(f"""
+            SELECT COUNT(*) AS total, COUNT(DISTINCT NULLIF(Kabupaten, '')) AS kabupaten,
+                   COUNT(DISTINCT NULLIF(Provinsi, '')) AS provinsi,
+                   COUNT(DISTINCT NULLIF(SUBSTR(KBLI, 1, 2), '')) AS kbli
+            FROM results {where}
+        """, params).iloc[0]
+        return {k: int(v) for k, v in row.items()}
+
+    def breakdown(self, dimension, username=None, filters=None, limit=15):
+        if dimension not in DIMENSION_SQL:
+            raise ValueError(f"Cannot break down by {dimension}")
+        where, params = db.build_filters(username, filters)
+        expr = DIMENSION_SQL[dimension]
+        where = f"{where} AND NULLIF({expr}, '') IS NOT NULL" if where else f"WHERE NULLIF({expr}, '') IS NOT NULL"
+        return self.query(f"""
+            SELECT {expr} AS {dimension}, COUNT(*) AS total FROM results {where}
+            GROUP BY 1 ORDER BY total DESC LIMIT {int(limit)}
+        """, params)
+
+    def fetch_page(self, username=None, filters=None, columns=None, sort="scraped_at", descending=True,
+                   after=None, limit=db.PAGE_SIZE):
+        """Same contract as db.fetch_results_page, answered from the snapshot."""
+        if sort not in db.SORTABLE_COLUMNS:
+            raise ValueError(f"Cannot sort by {sort}")
+        known = {c.name for c in db.results_table.columns}
+        if columns and set(columns) - known:
+            raise ValueError(f"Unknown columns: {sorted(set(columns) - known)}")
+        projection = ", ".join(f'"{c}"' for c in dict.fromkeys(["id", sort, *columns])) if columns else "*"
+        where, params = db.build_filters(username, filters)
+
+        null_as = db.SORTABLE_COLUMNS[sort]
+        if sort == "scraped_at":
+            null_as = f"TIMESTAMP {null_as}"
+        sort_expr = f'COALESCE("{sort}", {null_as})' if null_as else f'"{sort}"'
+        direction, op = ("DESC", "<") if descending else ("ASC", ">")
+        if after is not None:
+            keyset = f"({sort_expr} {op} :after_key OR ({sort_expr} = :after_key AND id {op} :after_id))"
+            where = f"{where} AND {keyset}" if where else f"WHERE {keyset}"
+            params.update(after_key=after[0], after_id=after[1])
+        page = self.query(f"SELECT {projection}, {sort_expr} AS _sort_key FROM results {where} "
+                          f"ORDER BY {sort_expr} {direction}, id {direction} LIMIT {int(limit)}", params)
+
+        cursor = None
+        if len(page) == limit:
+            last = page.iloc[-1]
+            cursor = (db.db_value(last["_sort_key"]), int(last["id"]))
+        return page.drop(columns=["_sort_key"]), cursor
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sync the local analytical snapshot of scraped_results")
+    parser.add_argument("--full", action="store_true", help="Rebuild the snapshot instead of pulling what changed")
+    parser.add_argument("--path", type=str, default=ANALYTICS_DIR)
+    args = parser.parse_args()
+
+    store = AnalyticsStore(args.path)
+    copied = store.sync(full=args.full)
+    state = store.state()
+    print(f"Copied {copied} rows; snapshot has {state['rows']} rows up to change {state['change_seq']}")
@@ -1,23 +1,25 @@
+import startup
 import streamlit as st
 import pandas as pd
-from scraper import GoogleMapsScraper
-import io
-import requests
-import os
 import asyncio
 import sys
 import time
-from streamlit_js_eval import streamlit_js_eval
-import folium
-from streamlit_folium import st_folium
-import json
-from sqlalchemy import text 
 import base64
+import db
+import normalize
+
+# scraper (Playwright, OpenAI), maps (folium), streamlit_folium, requests and
+# exports are imported by the code paths that use them, so the login page and
+# the Database Explorer don't pay for them
+startup.mark("imports")
 
 # Fix for Windows asyncio loop policy
 if sys.platform == 'win32':
     asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
 
+# Radius checked for already stored places before a "near me" scrape
+NEARBY_RADIUS_M = 2000
+
 # --- 1. PAGE CONFIG & SESSION SETUP ---
 st.set_page_config(page_title="NoSBRGo", page_icon="favicon.svg", layout="wide")
 
@@ -45,16 +47,8 @@ def decode_auth(token):
 
 def check_login(username, password):
     """Verify credentials against TiDB."""
-    cert_path = os.path.abspath("isrgrootx1.pem")
     try:
-        conn = st.connection('tidb', type='sql', connect_args={"ssl": {"ca": cert_path}})
-        with conn.session as session:
-            result = session.execute(
-                text("SELECT username, is_superuser FROM users WHERE username = :u AND password = :p"),
-                {"u": username, "p": password}
-            ).fetchone()
-            if result:
-                return True, result[0], bool(result[1])
+        return db.authenticate(username, password)
     except Exception as e:
         st.error(f"Login error: {e}")
     return False, None, False
@@ -150,19 +144,14 @@ def show_login_page():
                     st.error("Authentication failed. Please check your credentials.")
 
 # --- 3. HELPER FUNCTIONS ---
-@st.cache_resource
-def install_playwright():
-    try:
-        os.system("playwright install chromium")
-    except:
-        pass
-
-install_playwright()
+# Directory check only; a missing browser is installed in a background thread
+startup.ensure_browser()
 
 @st.cache_data(show_spinner=False)
 def get_location_description(lat, lng):
     """Mengambil data alamat lengkap & administratif Indonesia (Hierarkis)."""
     if not lat or not lng: return None
+    import requests
     
     headers = {'User-Agent': 'NoSBRGo-App/1.1'}
     url = f"https://nominatim.openstreetmap.org/reverse?format=json&lat={lat}&lon={lng}&zoom=18&addressdetails=1"
@@ -211,35 +200,57 @@ def get_location_description(lat, lng):
         pass
     return f"{lat}, {lng}"
 
-def format_wa_link(phone):
-    if pd.isna(phone): return None
-    clean_phone = "".join(filter(str.isdigit, str(phone)))
-    if not clean_phone: return None
-    if clean_phone.startswith('08'): return f"https://wa.me/62{clean_phone[1:]}"
-    elif clean_phone.startswith('62'): return f"https://wa.me/{clean_phone}"
-    elif clean_phone.startswith('8'): return f"https://wa.me/62{clean_phone}"
-    return None
-
 def save_to_tidb(df):
     if df is None or df.empty:
         st.warning("No data to save.")
         return
-    cert_path = os.path.abspath("isrgrootx1.pem")
     try:
-        conn = st.connection('tidb', type='sql', connect_args={"ssl": {"ca": cert_path}})
         with st.status("Saving data to TiDB...", expanded=False) as status:
             df_to_save = df.copy()
             if 'Select' in df_to_save.columns: df_to_save = df_to_save.drop(columns=['Select'])
             df_to_save['scraped_at'] = pd.Timestamp.now()
             df_to_save['username'] = st.session_state.get('username', 'system')
-            df_to_save.to_sql('scraped_results', con=conn.engine, if_exists='append', index=False)
-            st.cache_data.clear()
-            st.session_state.refresh_needed = True
+            # One transaction, chunked multi-row INSERTs: all rows land or none do
+            db.bulk_insert(df_to_save)
             status.update(label="✅ Saved successfully!", state="complete")
         st.success(f"Saved {len(df)} records.")
     except Exception as e:
         st.error(f"Error saving: {e}")
 
+def publish_metrics(job):
+    import metrics
+    try:
+        metrics.publish(job)
+    except OSError as e:
+        print(f"Could not write metrics: {e}")
+
+def show_job_metrics(job):
+    """Per-stage timing table and counters of the last scrape job."""
+    with st.expander(f"⏱️ Rincian Waktu Job ({job.elapsed():.1f} detik)", expanded=False):
+        st.dataframe(pd.DataFrame(job.summary()), hide_index=True, use_container_width=True,
+                     column_config={"stage": "Tahap", "calls": "Jumlah", "errors": "Error"})
+        counters = job.counter_rows()
+        if counters:
+            st.dataframe(pd.DataFrame(counters).fillna(""), hide_index=True, use_container_width=True)
+        gauges = job.gauge_rows()
+        if gauges:
+            st.caption("Batas paralel akhir per tahap")
+            st.dataframe(pd.DataFrame(gauges).fillna(""), hide_index=True, use_container_width=True)
+        d1, d2 = st.columns(2)
+        d1.download_button("⬇️ JSONL", job.to_jsonl(), f"job_{job.job_id}.jsonl", mime="application/jsonl",
+                           use_container_width=True)
+        d2.download_button("⬇️ Prometheus", job.prometheus_text(), f"job_{job.job_id}.prom", mime="text/plain",
+                           use_container_width=True)
+
+@st.cache_data(ttl=60, show_spinner=False)
+def find_stored_nearby(lat, lng, search_term, username, radius_m=NEARBY_RADIUS_M):
+    """Stored places matching `search_term` around (lat, lng), or None when the database is unreachable."""
+    try:
+        return db.fetch_nearby(lat, lng, radius_m, username=username, filters={"name": search_term},
+                               columns=["Name", "Address", "KBLI", "URL"]).drop(columns=["id", "Latitude", "Longitude"])
+    except Exception:
+        return None
+
 def apply_global_styles():
     st.markdown("""
     <style>
@@ -260,6 +271,11 @@ def apply_global_styles():
 
 # --- 4. SCRAPER UI FUNCTION ---
 def show_scraper_page():
+    import maps
+    import exports
+    from streamlit_folium import st_folium
+    from streamlit_js_eval import streamlit_js_eval
+
     st.markdown('<div class="logo-container"><p class="main-title"><span class="title-no">No</span><span class="title-sbr">SBR</span><span class="title-go">Go</span></p></div>', unsafe_allow_html=True)
     st.markdown('<p class="subtitle">Scrape business data from Google Maps in seconds.</p>', unsafe_allow_html=True)
 
@@ -268,6 +284,7 @@ def show_scraper_page():
     if 'use_location_toggle' not in st.session_state: st.session_state.use_location_toggle = False
     if 'resolved_address' not in st.session_state: st.session_state.resolved_address = None
     if 'last_results' not in st.session_state: st.session_state.last_results = None
+    if 'results_version' not in st.session_state: st.session_state.results_version = 0
 
     query_params = st.query_params
     if "lat" in query_params and "lng" in query_params:
@@ -331,11 +348,31 @@ def show_scraper_page():
     if search_term and target_loc:
         st.markdown(f'<div style="background: rgba(99,102,241,0.1); border-left: 5px solid #6366f1; padding: 15px; border-radius: 12px; border: 1px solid rgba(99,102,241,0.1);"><p style="color:#4338ca; font-size:0.7rem; font-weight:800; text-transform:uppercase; margin:0;">🎯 Targeting Keyword:</p><p style="color:#1e293b; font-size:1.1rem; font-weight:600; margin:0;">"{final_query}"</p></div>', unsafe_allow_html=True)
 
+    # Places we already stored around the user, so a re-scrape can be skipped
+    if use_location and search_term and st.session_state.user_lat and st.session_state.user_lng:
+        stored = find_stored_nearby(float(st.session_state.user_lat), float(st.session_state.user_lng), search_term,
+                                    None if st.session_state.is_superuser else st.session_state.username)
+        if stored is not None and not stored.empty:
+            st.info(f"📦 {len(stored)} tempat \"{search_term}\" sudah tersimpan dalam radius "
+                    f"{NEARBY_RADIUS_M / 1000:g} km dari lokasi Anda.")
+            with st.expander("Lihat data tersimpan"):
+                st.dataframe(stored, column_config={"URL": st.column_config.LinkColumn("G-Maps"),
+                                                    "distance_m": st.column_config.NumberColumn("Jarak (m)", format="%.0f")},
+                             hide_index=True, use_container_width=True)
+
     is_detecting = use_location and not st.session_state.resolved_address
-    start_btn = st.button("🚀 Start Extraction" if not is_detecting else "⏳ Sedang Mencari Lokasi...", use_container_width=True, disabled=is_detecting or not search_term)
+    browser = startup.browser_status()
+    if browser == "installing":
+        st.caption("⏳ Browser Chromium sedang dipasang di latar belakang, tombol aktif setelah selesai.")
+    elif browser == "failed":
+        st.warning(f"Browser Chromium gagal dipasang otomatis: {startup.browser_error()}")
+    start_btn = st.button("🚀 Start Extraction" if not is_detecting else "⏳ Sedang Mencari Lokasi...", use_container_width=True,
+                          disabled=is_detecting or not search_term or browser == "installing")
 
     if start_btn:
+        scraper = None
         try:
+            from scraper import GoogleMapsScraper
             scraper = GoogleMapsScraper(api_key=api_key if use_gpt else None)
             pbar = st.progress(0); status_txt = st.empty()
             def update_p(curr, tot, msg): pbar.progress(curr/tot); status_txt.text(msg)
@@ -348,29 +385,46 @@ def show_scraper_page():
                 scraper.enrich_results(progress_callback=update_p)
                 if use_gpt: scraper.process_with_gpt(progress_callback=update_p)
                 st.session_state.last_results = scraper.results
+                st.session_state.results_version += 1
+                st.session_state.kbli_local_ratio = scraper.kbli_local_ratio if use_gpt else None
+                st.session_state.gpt_usage = scraper.gpt_usage if use_gpt else None
+                st.session_state.job_metrics = scraper.metrics
                 st.success("Complete!"); time.sleep(1); st.rerun()
         except Exception as e:
             st.error(f"Error: {e}")
+        finally:
+            # Failed jobs are the ones worth looking at, so they are published too
+            if scraper is not None:
+                publish_metrics(scraper.metrics)
 
     if st.session_state.last_results:
-        df = pd.DataFrame(st.session_state.last_results)
+        # Built per render from the buffer, so the session holds one copy of the results, not two
+        df = normalize.normalize_frame(st.session_state.last_results.to_frame())
+        if st.session_state.get('kbli_local_ratio') is not None:
+            st.caption(f"🧠 KBLI terklasifikasi lokal: {st.session_state.kbli_local_ratio:.0%} (sisanya via GPT)")
+        usage = st.session_state.get('gpt_usage')
+        if usage and usage['calls']:
+            st.caption(f"🔢 GPT: {usage['calls']} panggilan · {usage['prompt_tokens']:,} token prompt · "
+                       f"{usage['completion_tokens']:,} token output · {usage['latency_s']:.1f} detik")
+        if st.session_state.get('job_metrics') is not None:
+            show_job_metrics(st.session_state.job_metrics)
         if show_map:
             st.markdown("---")
             st.markdown('<p style="font-size:1.3rem; font-weight:600; color:#1e293b;">🗺️ Interactive Competitor Map</p>', unsafe_allow_html=True)
-            map_df = df.copy(); map_df['lat'] = pd.to_numeric(map_df['Latitude'], errors='coerce'); map_df['lng'] = pd.to_numeric(map_df['Longitude'], errors='coerce')
-            map_df = map_df.dropna(subset=['lat', 'lng'])
+            map_df = maps.coordinate_frame(df.reset_index(drop=True).rename_axis("id").reset_index())
             if not map_df.empty:
-                m = folium.Map(location=[map_df['lat'].mean(), map_df['lng'].mean()], zoom_start=13)
-                for _, row in map_df.iterrows():
-                    wa_link = format_wa_link(row['Phone']) if 'Phone' in row else None
-                    wa_html = f'<br><a href="{wa_link}" target="_blank">💬 WhatsApp</a>' if wa_link else ""
-                    gmap_html = f'<br><a href="{row["URL"]}" target="_blank">📍 Google Maps</a>' if 'URL' in row else ""
-                    popup_html = f"<b>{row['Name']}</b>{wa_html}{gmap_html}"
-                    folium.Marker([row['lat'], row['lng']], popup=popup_html, icon=folium.Icon(color="indigo")).add_to(m)
-                st_folium(m, width="100%", height=500, returned_objects=[], key="results_map_v2")
-
-        if 'Phone' in df.columns: df['WhatsApp Link'] = df['Phone'].apply(format_wa_link)
-        
+                m = maps.base_map(maps.frame_bounds(map_df), tiles="OpenStreetMap")
+                maps.point_layer(map_df, color="#6366f1").add_to(m)
+                map_state = st_folium(m, width="100%", height=maps.MAP_HEIGHT,
+                                      returned_objects=["last_active_drawing"], key="results_map_v2")
+                clicked = maps.clicked_id(map_state)
+                if clicked is not None and clicked < len(df):
+                    row = df.iloc[clicked]
+                    wa_link = row.get('WhatsApp Link')
+                    wa_link = None if pd.isna(wa_link) else wa_link
+                    st.markdown(maps.detail_html(row.get('Name'), row.get('Address'), wa_link, row.get('URL')),
+                                unsafe_allow_html=True)
+
         # Display Dataframe
         ordered_cols = ["Name", "Kategori OSM", "WhatsApp Link", "Phone", "Negara", "Provinsi", "Kabupaten", "Kecamatan", "Kelurahan", "Hamlet/Quarter", "Kode Pos", "Jalan", "Nomor", "Address", "Latitude", "Longitude", "URL", "KBLI", "Nama Resmi KBLI", "Keterangan KBLI", "Rating", "Reviews", "Operation Hours", "Latest Review", "Website"]
         final_cols = [c for c in ordered_cols if c in df.columns]
@@ -378,12 +432,21 @@ def show_scraper_page():
                      column_config={"URL": st.column_config.LinkColumn("G-Maps"), "WhatsApp Link": st.column_config.LinkColumn("Chat WA"), "Website": st.column_config.LinkColumn("Website")}, 
                      use_container_width=True)
         
-        c1, c2, c3 = st.columns(3)
-        c1.download_button("Download CSV", df.to_csv(index=False).encode('utf-8'), "data.csv", use_container_width=True)
-        buf = io.BytesIO(); 
-        with pd.ExcelWriter(buf, engine='openpyxl') as wr: df.to_excel(wr, index=False)
-        c2.download_button("Download Excel", buf.getvalue(), "data.xlsx", use_container_width=True)
-        if c3.button("💾 Save to DB", use_container_width=True): save_to_tidb(df)
+        c1, c2 = st.columns(2)
+        with c1.popover("📥 Download", use_container_width=True):
+            fmt = st.radio("Format", exports.available_formats(), horizontal=True,
+                           format_func=lambda f: exports.EXPORT_FORMATS[f][0], key="results_export_fmt")
+            # Serialized only on request, once per result set and format
+            export_key = (fmt, st.session_state.results_version)
+            export = st.session_state.get('results_export')
+            if not (export and export[0] == export_key) and st.button("📦 Prepare File", use_container_width=True):
+                export = (export_key, exports.export_bytes(fmt, [df]))
+                st.session_state.results_export = export
+            if export and export[0] == export_key:
+                st.download_button(f"Download {exports.EXPORT_FORMATS[fmt][0]}", export[1],
+                                   exports.export_file_name("data", fmt), mime=exports.EXPORT_FORMATS[fmt][2],
+                                   use_container_width=True)
+        if c2.button("💾 Save to DB", use_container_width=True): save_to_tidb(df)
     
     st.markdown("<br><p style='text-align: center; color: #94a3b8; font-size: 0.8rem;'>Created with ❤️ by JJS</p>", unsafe_allow_html=True)
 
@@ -408,6 +471,7 @@ if st.session_state.authenticated and "session" not in st.query_params:
 
 if not st.session_state.authenticated:
     show_login_page()
+    startup.mark("login_page")
 else:
     # Sidebar
     apply_global_styles()
@@ -428,4 +492,7 @@ else:
 
     # Run Navigation
     pg = st.navigation(pages)
-    pg.run()
\ No newline at end of file
+    pg.run()
+    startup.mark("first_page")
+
+startup.report_once()
\ No newline at end of file
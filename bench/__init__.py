@@ -0,0 +1,8 @@
+"""Offline benchmark for GoogleMapsScraper.
+
+A local HTTP server stands in for Google Maps (search feed and place pages
+built from fixtures), Nominatim and the OpenAI chat completions endpoint,
+each with configurable latency. `python -m bench.run` drives the scraper
+against it and reports throughput, per-stage latency percentiles and peak
+RSS, optionally failing when a stage got slower than a saved baseline.
+"""
@@ -0,0 +1,139 @@
+"""Deterministic places and the Google Maps pages the benchmark serves for them.
+
+The pages keep only the markup GoogleMapsScraper reads (the selectors in
+`run` and `extract_details`) plus filler to bring them to a realistic
+size. Places rotate through the three coordinate sources extract_details
+falls back between: the @lat,lng in the URL, the `[null,null,lat,lng]`
+blob in the HTML and the directions link.
+"""
+import html
+import json
+import random
+
+# Search results the feed shows before the first scroll, and per scroll after that
+FEED_FIRST_BATCH = 7
+FEED_SCROLL_BATCH = 10
+
+# Filler per place page; live place pages are several hundred KB of markup and script
+PAGE_PADDING_KB = 200
+
+COORDINATE_SOURCES = ("url", "html", "directions")
+
+# Name prefixes: some resolve to a KBLI code locally, some only via GPT
+NAME_PREFIXES = [
+    "Warung Makan", "Bengkel Mobil", "Toko Kelontong", "Apotek", "Salon Kecantikan", "Laundry Kiloan",
+    "Kopi", "CV Sinar", "Studio", "Rumah Makan Padang", "Cuci Mobil", "PT Karya",
+]
+NAME_SUFFIXES = ["Jaya", "Makmur", "Sejahtera", "Bu Sri", "Pak Budi", "Abadi", "Sentosa", "Barokah", "Mandiri"]
+STREETS = ["Jl. Sudirman", "Jl. Thamrin", "Jl. Gatot Subroto", "Jl. Kebon Sirih", "Gg. Mawar", "Jl. Cikini Raya"]
+
+
+def make_places(count, seed=7):
+    """`count` fake places around central Jakarta, the same every run for a given seed."""
+    rng = random.Random(seed)
+    places = []
+    for i in range(count):
+        name = f"{NAME_PREFIXES[i % len(NAME_PREFIXES)]} {rng.choice(NAME_SUFFIXES)} {i + 1}"
+        places.append({
+            "slug": f"place-{i + 1}",
+            "name": name,
+            "rating": round(rng.uniform(3.0, 5.0), 1),
+            "reviews": rng.randint(0, 5000),
+            "address": f"{rng.choice(STREETS)} No.{rng.randint(1, 200)}, Menteng, Jakarta Pusat 10350",
+            "phone": f"0812-{rng.randint(1000, 9999)}-{rng.randint(1000, 9999)}",
+            "website": f"https://example.com/{i + 1}",
+            # Every fifth place shares its pin with the previous one, like shops in one building
+            "lat": round(-6.19 - rng.random() * 0.02, 7) if i % 5 else None,
+            "lng": round(106.82 + rng.random() * 0.02, 7) if i % 5 else None,
+            "feature_id": f"0x{rng.getrandbits(56):x}:0x{rng.getrandbits(60):x}",
+            "coordinates": COORDINATE_SOURCES[i % len(COORDINATE_SOURCES)],
+        })
+    for i, place in enumerate(places):
+        if place["lat"] is None:
+            source = places[i - 1] if i else {"lat": -6.195, "lng": 106.825}
+            place["lat"], place["lng"] = source["lat"], source["lng"]
+    return places
+
+
+def place_url(maps_url, place):
+    """Link the search feed shows for `place`; only URL-sourced places carry @lat,lng."""
+    data = f"data=!4m6!3m5!1s{place['feature_id']}!8m2"
+    if place["coordinates"] == "url":
+        return f"{maps_url}/place/{place['slug']}/@{place['lat']},{place['lng']},17z/{data}"
+    return f"{maps_url}/place/{place['slug']}/{data}"
+
+
+def padding(kb):
+    return f'<div style="display:none">{"x" * 1023}\n</div>' * kb if kb else ""
+
+
+def maps_home(maps_url):
+    """Landing page: a consent form (dismissed by the click) and the search box."""
+    return f"""<!doctype html><html><body>
+<form action="https://consent.google.com/save"><button type="button" onclick="this.form.remove()">Terima semua</button></form>
+<form action="{maps_url}/search" method="get"><input id="searchboxinput" name="q" autocomplete="off"></form>
+</body></html>"""
+
+
+def search_feed(maps_url, places, scroll_delay_ms=300):
+    """Results feed that appends the next batch of links on each wheel event, like the live feed."""
+    links = json.dumps([{"href": place_url(maps_url, p), "name": p["name"]} for p in places])
+    return f"""<!doctype html><html><body>
+<div role="feed" style="height:600px; overflow-y:scroll"></div>
+<script>
+const links = {links};
+const feed = document.querySelector('div[role="feed"]');
+let shown = 0, loading = false;
+function more(n) {{
+  for (const l of links.slice(shown, shown + n)) {{
+    const a = document.createElement('a');
+    a.href = l.href; a.textContent = l.name; a.style.display = 'block'; a.style.height = '80px';
+    feed.appendChild(a);
+  }}
+  shown = Math.min(links.length, shown + n);
+}}
+more({FEED_FIRST_BATCH});
+feed.addEventListener('wheel', () => {{
+  if (loading || shown >= links.length) return;
+  loading = true;
+  setTimeout(() => {{ more({FEED_SCROLL_BATCH}); loading = false; }}, {int(scroll_delay_ms)});
+}});
+</script>
+</body></html>"""
+
+
+def place_page(maps_url, place, padding_kb=PAGE_PADDING_KB):
+    e = {k: html.escape(str(v), quote=True) for k, v in place.items()}
+    coords = ""
+    if place["coordinates"] == "html":
+        coords = f"<script>window.APP_INITIALIZATION_STATE=[[null,null,{place['lat']},{place['lng']}]];</script>"
+    elif place["coordinates"] == "directions":
+        coords = f'<a href="{maps_url}/dir//{place["lat"]},{place["lng"]}/">Rute</a>'
+    return f"""<!doctype html><html><body>
+<h1 class="DUwDvf">{e['name']}</h1>
+<div class="F7nice">{place['rating']}({place['reviews']:,})</div>
+<button data-item-id="address" aria-label="Address: {e['address']}">{e['address']}</button>
+<button data-item-id="phone:tel:{e['phone']}" aria-label="Phone: {e['phone']}">{e['phone']}</button>
+<a data-item-id="authority" href="{e['website']}">{e['website']}</a>
+<div aria-label="Show open hours for the week">Buka · Tutup pukul 21.00</div>
+<div role="region"><div class="jftiEf"><span class="rS69Wb">2 minggu lalu</span></div></div>
+{coords}
+{padding(padding_kb)}
+</body></html>"""
+
+
+def scraped_records(places):
+    """What `run` collects for `places`, for benchmarking the later stages without a browser."""
+    return [{
+        "Name": p["name"],
+        "Rating": str(p["rating"]),
+        "Reviews": str(p["reviews"]),
+        "Operation Hours": "Buka · Tutup pukul 21.00",
+        "Latest Review": "2 minggu lalu",
+        "Address": p["address"],
+        "Phone": p["phone"],
+        "Website": p["website"],
+        "Latitude": str(p["lat"]),
+        "Longitude": str(p["lng"]),
+        "URL": place_url("https://www.google.com/maps", p),
+    } for p in places]
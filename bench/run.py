@@ -0,0 +1,160 @@
+"""Run the offline scraper benchmark.
+
+    python -m bench.run                          # 30 places, default latencies
+    python -m bench.run --places 100 --openai-ms 800 --save bench/baseline.json
+    python -m bench.run --baseline bench/baseline.json --tolerance 0.2   # exit 1 on regression
+    python -m bench.run --no-browser             # skip `run`, start from fixture records
+
+Stages are timed as wholes (records/s, peak RSS after the stage) and
+through the scraper's own metrics spans (latency percentiles per span).
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+from bench import fixtures
+from bench.server import DEFAULT_LATENCY, MockServices
+
+STAGES = ("run", "enrich_results", "process_with_gpt", "save_data")
+PERCENTILES = (50, 90, 95, 99)
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far (browser processes not included), or None."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def percentile(sorted_values, q):
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100 * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+def span_percentiles(spans):
+    """{span stage: {count, p50_ms, ..., max_ms}} from JobMetrics spans."""
+    by_stage = {}
+    for span in spans:
+        by_stage.setdefault(span["stage"], []).append(span["seconds"] * 1000)
+    out = {}
+    for stage, values in sorted(by_stage.items()):
+        values.sort()
+        out[stage] = {"count": len(values), **{f"p{q}_ms": round(percentile(values, q), 1) for q in PERCENTILES},
+                      "max_ms": round(values[-1], 1)}
+    return out
+
+
+def run_benchmark(places=30, latency=None, wait_scale=0.25, nominatim_delay=0.0, padding_kb=fixtures.PAGE_PADDING_KB,
+                  browser=True, headless=True):
+    """Run every stage against the mock services. Returns the report dict."""
+    import scraper
+
+    place_list = fixtures.make_places(places)
+    server = MockServices(place_list, latency=latency, padding_kb=padding_kb).start()
+    scraper.MAPS_URL = server.maps_url
+    scraper.NOMINATIM_URL = server.base_url
+    scraper.NOMINATIM_DELAY_S = nominatim_delay
+    scraper.WAIT_SCALE = wait_scale
+    os.environ["OPENAI_BASE_URL"] = f"{server.base_url}/v1"
+
+    job = scraper.GoogleMapsScraper(api_key="bench")
+    out_dir = tempfile.mkdtemp(prefix="sbrgo-bench-")
+    steps = {
+        "run": lambda: job.run("bench query", places, headless=headless),
+        "enrich_results": job.enrich_results,
+        "process_with_gpt": job.process_with_gpt,
+        "save_data": lambda: job.save_data(os.path.join(out_dir, "bench")),
+    }
+    if not browser:
+        job.results.extend(fixtures.scraped_records(place_list))
+        del steps["run"]
+
+    stages = {}
+    try:
+        for name, step in steps.items():
+            started = time.perf_counter()
+            step()
+            seconds = time.perf_counter() - started
+            stages[name] = {
+                "seconds": round(seconds, 3),
+                "records": len(job.results),
+                "records_per_s": round(len(job.results) / seconds, 2) if seconds else None,
+                "peak_rss_mb": peak_rss_mb(),
+            }
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    return {
+        "places": places,
+        "latency": {**DEFAULT_LATENCY, **(latency or {})},
+        "wait_scale": wait_scale,
+        "nominatim_delay": nominatim_delay,
+        "stages": stages,
+        "spans": span_percentiles(job.metrics.spans),
+        "counters": job.metrics.counter_rows(),
+        "gauges": job.metrics.gauge_rows(),
+        "requests": dict(server.requests),
+    }
+
+
+def regressions(report, baseline, tolerance):
+    """Stages whose wall time grew by more than `tolerance` (a fraction) over the baseline."""
+    found = []
+    for stage, result in report["stages"].items():
+        before = baseline.get("stages", {}).get(stage)
+        if before and before["seconds"] and result["seconds"] > before["seconds"] * (1 + tolerance):
+            found.append((stage, before["seconds"], result["seconds"]))
+    return found
+
+
+def print_report(report):
+    print(f"\n{'stage':<18}{'seconds':>10}{'records/s':>12}{'peak RSS MB':>14}")
+    for stage, r in report["stages"].items():
+        print(f"{stage:<18}{r['seconds']:>10.2f}{r['records_per_s'] or 0:>12.2f}{r['peak_rss_mb'] or 0:>14.1f}")
+    print(f"\n{'span':<20}{'count':>7}" + "".join(f"{f'p{q} ms':>10}" for q in PERCENTILES) + f"{'max ms':>10}")
+    for stage, p in report["spans"].items():
+        print(f"{stage:<20}{p['count']:>7}" + "".join(f"{p[f'p{q}_ms']:>10.1f}" for q in PERCENTILES)
+              + f"{p['max_ms']:>10.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline GoogleMapsScraper benchmark against local mock services")
+    parser.add_argument("--places", type=int, default=30)
+    parser.add_argument("--maps-ms", type=float, default=DEFAULT_LATENCY["maps"] * 1000, help="Latency per Maps page")
+    parser.add_argument("--nominatim-ms", type=float, default=DEFAULT_LATENCY["nominatim"] * 1000)
+    parser.add_argument("--openai-ms", type=float, default=DEFAULT_LATENCY["openai"] * 1000)
+    parser.add_argument("--wait-scale", type=float, default=0.25, help="Multiplier for the scraper's fixed page waits")
+    parser.add_argument("--nominatim-delay", type=float, default=0.0, help="Seconds between geocoding calls")
+    parser.add_argument("--page-kb", type=int, default=fixtures.PAGE_PADDING_KB, help="Filler per place page")
+    parser.add_argument("--no-browser", action="store_true", help="Skip `run` and start from fixture records")
+    parser.add_argument("--headed", action="store_true", help="Show the browser")
+    parser.add_argument("--save", type=str, help="Write the report as JSON (e.g. a new baseline)")
+    parser.add_argument("--baseline", type=str, help="Compare stage times with a saved report")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown over the baseline (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    report = run_benchmark(
+        places=args.places,
+        latency={"maps": args.maps_ms / 1000, "nominatim": args.nominatim_ms / 1000, "openai": args.openai_ms / 1000},
+        wait_scale=args.wait_scale, nominatim_delay=args.nominatim_delay, padding_kb=args.page_kb,
+        browser=not args.no_browser, headless=not args.headed,
+    )
+    print_report(report)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved report to {args.save}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            slower = regressions(report, json.load(f), args.tolerance)
+        for stage, before, after in slower:
+            print(f"REGRESSION {stage}: {before:.2f}s -> {after:.2f}s")
+        sys.exit(1 if slower else 0)
@@ -0,0 +1,126 @@
+"""Local stand-ins for Google Maps, Nominatim and OpenAI, with configurable latency.
+
+    /maps                       search box
+    /maps/search?q=...          results feed
+    /maps/place/<slug>/...      place page
+    /reverse?lat=..&lon=..      Nominatim reverse geocoding
+    POST /v1/chat/completions   OpenAI chat completion (JSON mode answer)
+"""
+import re
+import json
+import time
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from bench import fixtures
+
+# Seconds added before answering, per service
+DEFAULT_LATENCY = {"maps": 0.05, "nominatim": 0.1, "openai": 0.5}
+
+# KBLI code the mock model answers with, by name keyword
+MOCK_KBLI = {"kopi": "56303", "studio": "74201", "cv": "46900", "pt": "70209"}
+MOCK_KBLI_DEFAULT = "47111"
+
+
+class MockServices(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, places, latency=None, padding_kb=fixtures.PAGE_PADDING_KB, port=0):
+        super().__init__(("127.0.0.1", port), Handler)
+        self.places = {p["slug"]: p for p in places}
+        self.place_list = places
+        self.latency = {**DEFAULT_LATENCY, **(latency or {})}
+        self.padding_kb = padding_kb
+        self.requests = Counter()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    @property
+    def maps_url(self):
+        return f"{self.base_url}/maps"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="bench-mock-services", daemon=True).start()
+        return self
+
+
+class Handler(BaseHTTPRequestHandler):
+    server: MockServices
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, body, content_type="text/html; charset=utf-8"):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def service(self, name):
+        self.server.requests[name] += 1
+        time.sleep(self.server.latency[name])
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        maps_url = self.server.maps_url
+        if url.path == "/maps":
+            self.service("maps")
+            return self.reply(200, fixtures.maps_home(maps_url))
+        if url.path == "/maps/search":
+            self.service("maps")
+            return self.reply(200, fixtures.search_feed(maps_url, self.server.place_list))
+        match = re.match(r"/maps/place/([^/]+)", url.path)
+        if match and match.group(1) in self.server.places:
+            self.service("maps")
+            place = self.server.places[match.group(1)]
+            return self.reply(200, fixtures.place_page(maps_url, place, self.server.padding_kb))
+        if url.path == "/reverse":
+            self.service("nominatim")
+            query = parse_qs(url.query)
+            return self.reply(200, json.dumps(reverse_geocode(query.get("lat", [""])[0], query.get("lon", [""])[0])),
+                              "application/json")
+        self.reply(404, "not found", "text/plain")
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if url.path.endswith("/chat/completions"):
+            self.service("openai")
+            return self.reply(200, json.dumps(chat_completion(json.loads(body or b"{}"))), "application/json")
+        self.reply(404, "not found", "text/plain")
+
+
+def reverse_geocode(lat, lng):
+    """Nominatim-shaped answer. Every fourth location lacks the kelurahan, as real answers often do."""
+    missing_village = int(float(lat or 0) * 1e5) % 4 == 0
+    address = {
+        "country": "Indonesia", "state": "Daerah Khusus Ibukota Jakarta", "city": "Jakarta Pusat",
+        "city_district": "Menteng", "road": "Jalan Sudirman", "house_number": "5", "postcode": "10350",
+    }
+    if not missing_village:
+        address["village"] = "Gondangdia"
+    return {"type": "shop", "address": address, "display_name": f"{lat}, {lng}"}
+
+
+def chat_completion(request):
+    prompt = " ".join(m.get("content", "") for m in request.get("messages", []))
+    name = re.search(r"Business Name: (.*)", prompt)
+    words = (name.group(1) if name else "").lower().split()
+    kbli = next((code for key, code in MOCK_KBLI.items() if key in words), MOCK_KBLI_DEFAULT)
+    answer = {"kbli": kbli, "kelurahan": "Gondangdia", "kecamatan": "Menteng", "kode_pos": "10350"}
+    prompt_tokens = len(prompt) // 4
+    return {
+        "id": "chatcmpl-bench",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.get("model", "bench"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": json.dumps(answer)},
+                     "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 30, "total_tokens": prompt_tokens + 30},
+    }
@@ -0,0 +1,220 @@
+"""Browser lifecycle for long scrape runs.
+
+One Chromium page reused for thousands of navigations keeps growing, and
+one hung page can stall a whole job. BrowserSession owns the browser,
+context and page. It opens a fresh context every RECYCLE_AFTER_NAVIGATIONS
+navigations, relaunches the browser when Chromium's RSS passes
+RECYCLE_RSS_MB, and relaunches it after a crash.
+
+Each record gets a wall-clock Deadline. Every Playwright wait in
+extract_details is capped at the time left. As a backstop, a Watchdog
+thread kills Chromium when a record overruns by WATCHDOG_GRACE_S (a call
+that ignores its timeout). Playwright's sync objects can't be used from
+another thread, so the watchdog kills the processes. The blocked call then
+fails and the run loop relaunches the browser and re-queues the URL.
+
+psutil is optional: without it there is no RSS policy and no hard kill.
+"""
+import os
+import time
+import threading
+
+RECYCLE_AFTER_NAVIGATIONS = int(os.environ.get("BROWSER_RECYCLE_AFTER", 50))
+RECYCLE_RSS_MB = float(os.environ.get("BROWSER_RECYCLE_RSS_MB", 1500))
+RECORD_BUDGET_S = float(os.environ.get("SCRAPER_RECORD_BUDGET_S", 30))
+WATCHDOG_GRACE_S = 15
+WATCHDOG_POLL_S = 0.5
+
+# Attempts per URL, counting the first one
+MAX_ATTEMPTS = 2
+
+CHROMIUM_PROCESS_NAMES = ("chrome", "chromium", "headless_shell")
+
+
+class RecordTimeout(Exception):
+    """A record ran past its wall-clock budget."""
+
+
+class Deadline:
+    def __init__(self, seconds=None):
+        self.seconds = RECORD_BUDGET_S if seconds is None else seconds
+        self.expires = time.monotonic() + self.seconds
+
+    @property
+    def expired(self):
+        return time.monotonic() >= self.expires
+
+    def remaining_ms(self):
+        """Milliseconds left, at least 1 (Playwright reads 0 as 'no timeout')."""
+        return max(1, int((self.expires - time.monotonic()) * 1000))
+
+    def check(self):
+        if self.expired:
+            raise RecordTimeout(f"record took longer than {self.seconds:.0f}s")
+
+
+def _is_chromium(proc):
+    return any(name in proc.name().lower() for name in CHROMIUM_PROCESS_NAMES)
+
+
+def chromium_processes():
+    """Chromium processes started by this process, or [] without psutil."""
+    try:
+        import psutil
+    except ImportError:
+        return []
+    found = []
+    for proc in psutil.Process().children(recursive=True):
+        try:
+            if _is_chromium(proc):
+                found.append(proc)
+        except psutil.Error:
+            pass
+    return found
+
+
+def process_tree(roots):
+    """`roots` and their live descendants."""
+    import psutil
+
+    procs = []
+    for root in roots:
+        try:
+            procs += [root] + root.children(recursive=True)
+        except psutil.Error:
+            pass
+    return procs
+
+
+def rss_mb(procs):
+    import psutil
+
+    total = 0
+    for proc in procs:
+        try:
+            total += proc.memory_info().rss
+        except psutil.Error:
+            pass
+    return total / (1024 * 1024)
+
+
+class BrowserSession:
+    """Chromium browser, context and page with recycling and relaunch policies."""
+
+    def __init__(self, playwright, headless=True, metrics=None, recycle_after=None, recycle_rss_mb=None):
+        self.playwright = playwright
+        self.headless = headless
+        self.metrics = metrics
+        self.recycle_after = RECYCLE_AFTER_NAVIGATIONS if recycle_after is None else recycle_after
+        self.recycle_rss_mb = RECYCLE_RSS_MB if recycle_rss_mb is None else recycle_rss_mb
+        self.browser = self.context = self.page = None
+        self.navigations = 0
+        # Top Chromium processes of this session's browser, so other jobs in the same server are left alone
+        self._roots = []
+
+    def open(self):
+        before = {proc.pid for proc in chromium_processes()}
+        self.browser = self.playwright.chromium.launch(headless=self.headless)
+        started = [proc for proc in chromium_processes() if proc.pid not in before]
+        started_pids = {proc.pid for proc in started}
+        self._roots = [proc for proc in started if proc.ppid() not in started_pids]
+        self._new_page()
+        return self
+
+    def _new_page(self):
+        self.context = self.browser.new_context()
+        self.page = self.context.new_page()
+        self.navigations = 0
+
+    def healthy(self):
+        return (self.browser is not None and self.browser.is_connected()
+                and self.page is not None and not self.page.is_closed())
+
+    def navigated(self):
+        self.navigations += 1
+
+    def check(self):
+        """Apply the recycling policies before the next navigation."""
+        if self.recycle_after and self.navigations >= self.recycle_after:
+            self.recycle("navigations")
+        elif self.recycle_rss_mb and self.navigations:
+            rss = self.rss_mb()
+            if rss is not None and rss > self.recycle_rss_mb:
+                # A new context doesn't give back the browser process's own growth
+                self.relaunch("rss")
+
+    def recycle(self, reason):
+        """Replace the context and page."""
+        try:
+            self.context.close()
+        except Exception:
+            pass
+        self._new_page()
+        self._count("recycle", reason)
+
+    def relaunch(self, reason):
+        """Replace the whole browser."""
+        self.close()
+        self.open()
+        self._count("relaunch", reason)
+
+    def rss_mb(self):
+        """Resident memory of this session's Chromium processes in MB, or None without psutil."""
+        return rss_mb(process_tree(self._roots)) if self._roots else None
+
+    def kill(self):
+        """Kill this session's Chromium processes; safe to call from another thread."""
+        for proc in process_tree(self._roots):
+            try:
+                proc.kill()
+            except Exception:
+                pass
+
+    def close(self):
+        try:
+            if self.browser is not None:
+                self.browser.close()
+        except Exception:
+            pass
+        self.browser = self.context = self.page = None
+        self._roots = []
+
+    def _count(self, name, reason):
+        print(f"Browser {name} ({reason})")
+        if self.metrics is not None:
+            self.metrics.count(name, reason=reason)
+
+
+class Watchdog:
+    """Background thread that kills the session's browser when the armed deadline is overrun by `grace` seconds."""
+
+    def __init__(self, session, grace=None):
+        self.session = session
+        self.grace = WATCHDOG_GRACE_S if grace is None else grace
+        self.fired = 0
+        self._deadline = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="scraper-watchdog", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def arm(self, deadline):
+        self._deadline = deadline
+
+    def disarm(self):
+        self._deadline = None
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _loop(self):
+        while not self._stop.wait(WATCHDOG_POLL_S):
+            deadline = self._deadline
+            if deadline is not None and time.monotonic() > deadline.expires + self.grace:
+                self._deadline = None
+                self.fired += 1
+                print("Watchdog: record stuck past its budget, killing the browser")
+                self.session.kill()
@@ -0,0 +1,162 @@
+"""Adaptive limits on in-flight work per scrape stage.
+
+AdaptiveLimiter is an AIMD controller, as in TCP congestion control. After
+each window of completed calls where the error rate stays below
+`max_error_rate` and the rolling p95 latency stays below
+`latency_factor` times the best p95 seen so far, the limit grows by one.
+Otherwise it is cut in half. A throttle signal (HTTP 429, a CAPTCHA page)
+cuts the limit at once. At the minimum, each further signal also doubles a
+cooldown before the next call, and healthy windows halve it again. Calls
+that started before a decrease don't count toward the next one, so one
+burst of slow calls or 429s cuts the limit once.
+
+The best p95 is learned from the service itself, so no per-environment
+latency target has to be set. Limits are reported to the job's metrics as
+`concurrency_limit` gauges.
+"""
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+LATENCY_FACTOR = 2.0
+MAX_ERROR_RATE = 0.1
+WINDOW = 20
+MAX_COOLDOWN_S = 60.0
+
+_DONE = object()
+
+
+class Throttled(Exception):
+    """The remote side asked us to slow down (HTTP 429, CAPTCHA, ...)."""
+
+
+class Outcome:
+    """Set `error` / `throttled` on it inside AdaptiveLimiter.slot() to report a failure that wasn't raised."""
+
+    def __init__(self):
+        self.error = False
+        self.throttled = False
+
+
+class AdaptiveLimiter:
+    """AIMD limit on concurrent calls of one stage."""
+
+    def __init__(self, stage, initial=2, minimum=1, maximum=8, window=WINDOW, latency_factor=LATENCY_FACTOR,
+                 max_error_rate=MAX_ERROR_RATE, metrics=None):
+        self.stage = stage
+        self.minimum = minimum
+        self.maximum = max(minimum, maximum)
+        self.limit = min(max(initial, minimum), self.maximum)
+        self.window = window
+        self.latency_factor = latency_factor
+        self.max_error_rate = max_error_rate
+        self.metrics = metrics
+        self.best_p95 = None
+        self.cooldown_s = 0.0
+        self.in_flight = 0
+        self._samples = deque(maxlen=window)
+        self._resume_at = 0.0
+        # Bumped on every decrease; results of calls started in an older epoch are ignored
+        self._epoch = 0
+        self._cond = threading.Condition()
+        self._report()
+
+    def acquire(self):
+        """Wait for a free slot (and any cooldown). Returns the epoch to hand back to release()."""
+        with self._cond:
+            while self.in_flight >= self.limit:
+                self._cond.wait()
+            self.in_flight += 1
+            epoch = self._epoch
+            delay = self._resume_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        return epoch
+
+    def release(self, seconds, error=False, throttled=False, epoch=None):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+            if epoch is not None and epoch != self._epoch:
+                return
+            self._samples.append((seconds, error))
+            if throttled:
+                self._decrease(throttled=True)
+            elif len(self._samples) >= self.window:
+                self._adjust()
+
+    @contextmanager
+    def slot(self):
+        """Hold one of the `limit` slots for the block; its latency and outcome feed the controller."""
+        epoch = self.acquire()
+        outcome = Outcome()
+        start = time.perf_counter()
+        try:
+            yield outcome
+        except Throttled:
+            outcome.throttled = True
+            raise
+        except Exception:
+            outcome.error = True
+            raise
+        finally:
+            self.release(time.perf_counter() - start, outcome.error or outcome.throttled, outcome.throttled, epoch)
+
+    def _adjust(self):
+        seconds = sorted(s for s, _ in self._samples)
+        p95 = seconds[min(len(seconds) - 1, int(0.95 * len(seconds)))]
+        error_rate = sum(e for _, e in self._samples) / len(self._samples)
+        slow = self.best_p95 is not None and p95 > self.best_p95 * self.latency_factor
+        if error_rate <= self.max_error_rate:
+            self.best_p95 = p95 if self.best_p95 is None else min(self.best_p95, p95)
+        if error_rate > self.max_error_rate or slow:
+            self._decrease()
+        else:
+            self.cooldown_s /= 2
+            if self.cooldown_s < 0.5:
+                self.cooldown_s = 0.0
+            self.limit = min(self.maximum, self.limit + 1)
+            self._samples.clear()
+            self._report()
+
+    def _decrease(self, throttled=False):
+        if throttled and self.limit == self.minimum:
+            self.cooldown_s = min(MAX_COOLDOWN_S, max(1.0, self.cooldown_s * 2))
+            self._resume_at = time.monotonic() + self.cooldown_s
+        self.limit = max(self.minimum, self.limit // 2)
+        self._epoch += 1
+        self._samples.clear()
+        self._report()
+
+    def _report(self):
+        if self.metrics is not None:
+            self.metrics.gauge("concurrency_limit", self.limit, stage=self.stage)
+            self.metrics.gauge("cooldown_seconds", self.cooldown_s, stage=self.stage)
+
+
+def imap_unordered(func, items, workers, name="worker"):
+    """Yield (item, result, exception) for func(item) on `workers` threads, in completion order.
+
+    At most 2 * workers items are submitted ahead, so `items` can be a long lazy iterable.
+    """
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name) as pool:
+        pending = {}
+
+        def fill():
+            while len(pending) < 2 * workers:
+                item = next(items, _DONE)
+                if item is _DONE:
+                    return
+                pending[pool.submit(func, item)] = item
+
+        fill()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = pending.pop(future)
+                error = future.exception()
+                yield item, None if error else future.result(), error
+            fill()
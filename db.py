@@ -0,0 +1,1161 @@
+"""Data access for the app: one pooled engine per process plus typed queries.
+
+Every page, the login form and migrate.py go through `get_engine()`, so TLS
+is configured in one place and connections are reused instead of opening a
+new handshake per Streamlit connection object.
+"""
+import os
+import hashlib
+import threading
+
+import pandas as pd
+from sqlalchemy import (
+    BigInteger, Column, DateTime, Double, Index, Integer, MetaData, Numeric, String, Table, Text,
+    create_engine, inspect, text,
+)
+from sqlalchemy.engine import URL, make_url
+
+import dedup
+import geo
+import normalize
+import search
+
+APP_ROOT = os.path.dirname(os.path.abspath(__file__))
+RESULTS_TABLE = "scraped_results"
+ROLLUP_TABLE = "results_rollup"
+CHANGES_TABLE = "results_changes"
+TERMS_TABLE = "results_terms"
+
+# Rows handed to the driver per executemany() call
+BULK_CHUNK_SIZE = int(os.environ.get("DB_BULK_CHUNK_SIZE", 1000))
+
+# Values per IN (...) list for batched deletes
+MUTATION_CHUNK_SIZE = 500
+
+# Rows per Database Explorer page
+PAGE_SIZE = 200
+
+# Rows read per round trip when streaming an export
+EXPORT_CHUNK_SIZE = 5000
+
+# Ranked search hits per page
+SEARCH_PAGE_SIZE = 50
+
+# Points sent to the map per viewport
+MAP_POINT_LIMIT = 5000
+
+# Keyset-sortable columns. The database sorts on the column itself (so its index
+# can serve the ORDER BY), with NULLs lowest as in MySQL and SQLite. The value is
+# the NULL stand-in for engines that order NULLs differently (DuckDB); None: never NULL.
+SORTABLE_COLUMNS = {
+    "scraped_at": "'1970-01-01 00:00:00'",
+    "id": None,
+    "Name": "''",
+    "Rating": "-1",
+    "Reviews": "-1",
+}
+
+# Serverless TiDB drops idle connections, recycle well before that
+POOL_RECYCLE_SECONDS = 1800
+POOL_SIZE = 5
+POOL_MAX_OVERFLOW = 10
+
+# Rows sharing these columns are the same place (legacy tables without place_key)
+LEGACY_DEDUP_KEY = ("Name", "Latitude", "Longitude")
+DEDUP_KEY = ("place_key",)
+
+# Google's feature id inside a /maps/place/ URL, stable across name/coordinate edits
+PLACE_ID_PATTERN = dedup.PLACE_ID_PATTERN
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+# --- ENGINE ---
+
+def load_db_config():
+    """The [connections.tidb] section of the Streamlit secrets."""
+    import streamlit as st
+    return dict(st.secrets["connections"]["tidb"])
+
+
+def engine_url(config):
+    if config.get("url"):
+        return make_url(config["url"])
+    return URL.create(
+        drivername=f"{config.get('dialect', 'mysql')}+{config.get('driver', 'pymysql')}",
+        username=config.get("username"),
+        password=config.get("password"),
+        host=config.get("host"),
+        port=config.get("port"),
+        database=config.get("database"),
+        query=config.get("query", {}),
+    )
+
+
+def build_engine(config):
+    url = engine_url(config)
+    if url.get_backend_name() == "sqlite":
+        return create_engine(url)
+
+    connect_args = {}
+    ssl_ca = os.path.join(APP_ROOT, config.get("ssl_ca", "isrgrootx1.pem"))
+    if os.path.exists(ssl_ca):
+        connect_args["ssl"] = {"ca": ssl_ca}
+    return create_engine(
+        url,
+        connect_args=connect_args,
+        pool_pre_ping=True,
+        pool_recycle=POOL_RECYCLE_SECONDS,
+        pool_size=POOL_SIZE,
+        max_overflow=POOL_MAX_OVERFLOW,
+    )
+
+
+def get_engine():
+    """Process-wide pooled engine. DATABASE_URL overrides the secrets (e.g. SQLite for local runs)."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                url = os.environ.get("DATABASE_URL")
+                _engine = build_engine({"url": url} if url else load_db_config())
+    return _engine
+
+
+def chunked(values, size=MUTATION_CHUNK_SIZE):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+MIGRATION_HINT = "scraped_results has not been migrated to the typed schema; run `python migrate.py`"
+
+
+def needs_migration(engine=None):
+    """True when scraped_results exists but predates the typed schema (no id column)."""
+    with (engine or get_engine()).connect() as connection:
+        return inspect(connection).has_table(RESULTS_TABLE) and "id" not in table_columns(connection)
+
+
+def table_columns(connection, table=RESULTS_TABLE):
+    return [c["name"] for c in inspect(connection).get_columns(table)]
+
+
+# --- USERS ---
+
+def authenticate(username, password):
+    """Returns (ok, username, is_superuser)."""
+    with get_engine().connect() as connection:
+        row = connection.execute(
+            text("SELECT username, is_superuser FROM users WHERE username = :u AND password = :p"),
+            {"u": username, "p": password},
+        ).fetchone()
+    if row:
+        return True, row[0], bool(row[1])
+    return False, None, False
+
+
+def list_users():
+    with get_engine().connect() as connection:
+        return pd.read_sql(text("SELECT username, is_superuser, created_at FROM users"), connection)
+
+
+def add_user(username, password, is_superuser):
+    with get_engine().begin() as connection:
+        connection.execute(
+            text("INSERT INTO users (username, password, is_superuser) VALUES (:u, :p, :is_a)"),
+            {"u": username, "p": password, "is_a": is_superuser},
+        )
+
+
+def delete_user(username):
+    with get_engine().begin() as connection:
+        connection.execute(text("DELETE FROM users WHERE username = :u"), {"u": username})
+
+
+# --- SCRAPED RESULTS SCHEMA ---
+
+def build_results_table(metadata, name=RESULTS_TABLE):
+    """Typed, indexed definition of scraped_results. Migrations and inserts share it."""
+    return Table(
+        name, metadata,
+        Column("id", BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True),
+        Column("place_key", String(64)),
+        Column("geohash", String(12)),
+        Column("Name", String(512)),
+        Column("Rating", Numeric(2, 1)),
+        Column("Reviews", Integer),
+        Column("Operation Hours", Text),
+        Column("Latest Review", String(255)),
+        Column("Address", Text),
+        Column("Phone", String(64)),
+        Column("WhatsApp Link", String(255)),
+        Column("Website", Text),
+        Column("Latitude", Double),
+        Column("Longitude", Double),
+        Column("URL", Text),
+        Column("Negara", String(128)),
+        Column("Provinsi", String(128)),
+        Column("Kabupaten", String(128)),
+        Column("Kecamatan", String(128)),
+        Column("Kelurahan", String(128)),
+        Column("Hamlet/Quarter", String(255)),
+        Column("Jalan", String(255)),
+        Column("Nomor", String(64)),
+        Column("Kode Pos", String(16)),
+        Column("Kategori OSM", String(128)),
+        Column("KBLI", String(255)),
+        Column("Nama Resmi KBLI", Text),
+        Column("Keterangan KBLI", Text),
+        Column("scraped_at", DateTime),
+        Column("username", String(255)),
+        Index(f"ix_{name}_username", "username", "scraped_at"),
+        Index(f"ix_{name}_scraped_at", "scraped_at"),
+        Index(f"ix_{name}_place_key", "place_key"),
+        Index(f"ix_{name}_geohash", "geohash"),
+        Index(f"ix_{name}_kabupaten", "Kabupaten"),
+        Index(f"ix_{name}_kbli", "KBLI"),
+    )
+
+
+metadata = MetaData()
+results_table = build_results_table(metadata)
+
+# Data columns users can project in the explorer (id is always fetched)
+RESULTS_COLUMNS = [c.name for c in results_table.columns if c.name not in ("id", "place_key", "geohash")]
+
+# Per user x region x KBLI division row counts behind the dashboard metrics.
+# Missing values are stored as '' because they are part of the primary key.
+rollup_table = Table(
+    ROLLUP_TABLE, metadata,
+    Column("username", String(255), primary_key=True),
+    Column("provinsi", String(128), primary_key=True),
+    Column("kabupaten", String(128), primary_key=True),
+    Column("kbli", String(2), primary_key=True),
+    Column("n", BigInteger, nullable=False),
+)
+ROLLUP_DIMENSIONS = ("provinsi", "kabupaten", "kbli")
+
+# Append-only log of inserted ('I'), deleted ('D') and updated ('U') rows.
+# Inserts are logged too: TiDB's AUTO_INCREMENT is unique but not monotonic,
+# so new rows can't be found by id above a watermark.
+changes_table = Table(
+    CHANGES_TABLE, metadata,
+    Column("seq", BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True),
+    Column("row_id", BigInteger, nullable=False),
+    Column("username", String(255)),
+    Column("op", String(1), nullable=False),
+    Column("changed_at", DateTime),
+    Index(f"ix_{CHANGES_TABLE}_username", "username", "seq"),
+)
+
+# Inverted index for full-text search on every database: one row per
+# (term, place) with the summed column weights.
+terms_table = Table(
+    TERMS_TABLE, metadata,
+    Column("term", String(search.MAX_TERM_LENGTH), primary_key=True),
+    Column("row_id", BigInteger, primary_key=True),
+    Column("weight", Integer, nullable=False),
+    Index(f"ix_{TERMS_TABLE}_row_id", "row_id"),
+)
+
+# The rollup key of a scraped_results row, in rollup column order
+ROLLUP_KEY_SQL = ("COALESCE(username, '') AS username, COALESCE(Provinsi, '') AS provinsi, "
+                  "COALESCE(Kabupaten, '') AS kabupaten, COALESCE(SUBSTR(KBLI, 1, 2), '') AS kbli")
+
+
+def place_keys(df):
+    """Stable per-place key: Google's feature id from the URL, else a hash of name + coordinates."""
+    url = df["URL"] if "URL" in df.columns else pd.Series(None, index=df.index, dtype=object)
+    keys = url.astype(str).str.extract(PLACE_ID_PATTERN, expand=False)
+    missing = keys.isna()
+    if missing.any():
+        def column_text(name, numeric=False):
+            if name not in df.columns:
+                return pd.Series("", index=df.index)
+            if numeric:
+                values = pd.to_numeric(df[name], errors="coerce").round(6)
+                return values.map(lambda v: "" if pd.isna(v) else f"{v:.6f}")
+            return df[name].fillna("").astype(str).str.strip().str.lower()
+
+        raw = column_text("Name") + "|" + column_text("Latitude", True) + "|" + column_text("Longitude", True)
+        keys[missing] = raw[missing].map(lambda v: hashlib.sha1(v.encode("utf-8")).hexdigest())
+    return keys
+
+
+def parse_numeric(series, integer=False):
+    """Parse scraped numbers: '4,5' -> 4.5, '1.234' / '1,234' -> 1234, 'N/A' -> NULL.
+
+    Columns normalize.normalize_frame already typed pass through unchanged.
+    """
+    return normalize.parse_count(series) if integer else normalize.parse_decimal(series)
+
+
+def prepare_results_frame(df, table=results_table):
+    """Coerce a results frame to the typed schema: numbers, datetimes, bounded strings, NULLs.
+
+    Columns the table doesn't have are dropped.
+    """
+    out = pd.DataFrame(index=df.index)
+    for column in table.columns:
+        name = column.name
+        if name == "id":
+            continue
+        if name == "place_key":
+            out[name] = df[name] if name in df.columns and df[name].notna().all() else place_keys(df)
+            continue
+        if name == "geohash":
+            if "Latitude" in df.columns and "Longitude" in df.columns:
+                out[name] = geo.encode_geohash(parse_numeric(df["Latitude"]), parse_numeric(df["Longitude"]))
+            continue
+        if name not in df.columns:
+            continue
+        values = df[name]
+        if isinstance(column.type, DateTime):
+            out[name] = normalize.parse_timestamp(values)
+        elif isinstance(column.type, (Integer, Numeric, Double)):
+            integer = isinstance(column.type, Integer)
+            out[name] = parse_numeric(values, integer=integer).astype("Int64" if integer else "float64")
+        else:
+            values = values.astype(object).where(values.notna(), None)
+            values = values.map(lambda v: None if v is None else str(v))
+            length = getattr(column.type, "length", None)
+            out[name] = values.str.slice(0, length) if length else values
+    # NaN/NaT -> NULL
+    return out.astype(object).where(out.notna(), None)
+
+
+def ensure_results_table(connection):
+    metadata.create_all(connection, tables=[results_table], checkfirst=True)
+
+
+def db_value(value):
+    """Plain Python value a DBAPI driver can bind (no numpy/pandas scalars)."""
+    if value is None:
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    if hasattr(value, "item"):
+        return value.item()
+    return value
+
+
+def insert_frame(connection, frame, table=RESULTS_TABLE, chunksize=BULK_CHUNK_SIZE):
+    """Insert an already prepared frame on an open connection."""
+    if frame.empty:
+        return 0
+    columns = list(frame.columns)
+    stmt = text(
+        f"INSERT INTO {table} ({', '.join(f'`{c}`' for c in columns)}) "
+        f"VALUES ({', '.join(f':p{i}' for i in range(len(columns)))})"
+    )
+    rows = [{f"p{i}": db_value(v) for i, v in enumerate(row)} for row in frame.itertuples(index=False, name=None)]
+    for chunk in chunked(rows, chunksize):
+        connection.execute(stmt, chunk)
+    return len(rows)
+
+
+# --- ROLLUP ---
+
+def has_rollup(connection):
+    """Rollups are only maintained once migrate.py has created and backfilled them."""
+    return inspect(connection).has_table(ROLLUP_TABLE)
+
+
+def rollup_counts(connection, where="", params=None):
+    """[(username, provinsi, kabupaten, kbli, n)] for the scraped_results rows matching `where`."""
+    query = f"SELECT {ROLLUP_KEY_SQL}, COUNT(*) FROM {RESULTS_TABLE} {where} GROUP BY 1, 2, 3, 4"
+    return [tuple(row) for row in connection.execute(text(query), params or {})]
+
+
+def frame_rollup_counts(frame):
+    """Same as rollup_counts, for a prepared frame that is about to be inserted."""
+    def column(name):
+        if name not in frame.columns:
+            return pd.Series("", index=frame.index)
+        return frame[name].fillna("").astype(str)
+
+    keys = pd.DataFrame({
+        "username": column("username"),
+        "provinsi": column("Provinsi"),
+        "kabupaten": column("Kabupaten"),
+        "kbli": column("KBLI").str[:2],
+    })
+    counts = keys.groupby(list(keys.columns), sort=False).size()
+    return [(*key, int(n)) for key, n in counts.items()]
+
+
+def adjust_rollup(connection, counts, sign=1):
+    """Add (sign=1) or subtract (sign=-1) row counts, dropping groups that reach zero."""
+    if not counts:
+        return
+    columns = "username, provinsi, kabupaten, kbli, n"
+    values = "VALUES (:u, :p, :k, :c, :n)"
+    if connection.dialect.name == "sqlite":
+        upsert = f"INSERT INTO {ROLLUP_TABLE} ({columns}) {values} " \
+                 "ON CONFLICT (username, provinsi, kabupaten, kbli) DO UPDATE SET n = n + excluded.n"
+    else:
+        upsert = f"INSERT INTO {ROLLUP_TABLE} ({columns}) {values} ON DUPLICATE KEY UPDATE n = n + VALUES(n)"
+    rows = [{"u": u, "p": p, "k": k, "c": c, "n": sign * n} for u, p, k, c, n in counts]
+    for chunk in chunked(rows, BULK_CHUNK_SIZE):
+        connection.execute(text(upsert), chunk)
+    if sign < 0:
+        connection.execute(text(f"DELETE FROM {ROLLUP_TABLE} WHERE n <= 0"))
+
+
+def rebuild_rollup(engine=None):
+    """Recompute the rollup from scratch. Returns the number of groups."""
+    with (engine or get_engine()).begin() as connection:
+        metadata.create_all(connection, tables=[rollup_table], checkfirst=True)
+        connection.execute(text(f"DELETE FROM {ROLLUP_TABLE}"))
+        connection.execute(text(
+            f"INSERT INTO {ROLLUP_TABLE} (username, provinsi, kabupaten, kbli, n) "
+            f"SELECT {ROLLUP_KEY_SQL}, COUNT(*) FROM {RESULTS_TABLE} GROUP BY 1, 2, 3, 4"
+        ))
+        return connection.execute(text(f"SELECT COUNT(*) FROM {ROLLUP_TABLE}")).scalar()
+
+
+def rollup_source(connection, username=None, filters=None):
+    """(FROM source, WHERE clause, params) over rollup-shaped rows (username, provinsi, kabupaten, kbli, n).
+
+    Reads the rollup table when the filters only touch its dimensions,
+    otherwise groups the matching scraped_results rows on the fly.
+    """
+    f = {k: v for k, v in (filters or {}).items() if v not in (None, "")}
+    prefix = f.get("kbli_prefix")
+    if set(f) <= {"provinsi", "kabupaten", "kbli_prefix"} and len(prefix or "") <= 2 and has_rollup(connection):
+        clauses, params = [], {}
+        if username is not None:
+            clauses.append("username = :user")
+            params["user"] = username
+        for name in ("provinsi", "kabupaten"):
+            if name in f:
+                clauses.append(f"{name} = :{name}")
+                params[name] = f[name]
+        if prefix:
+            clauses.append("kbli LIKE :kbli_prefix")
+            params["kbli_prefix"] = f"{prefix}%"
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return ROLLUP_TABLE, where, params
+
+    where, params = build_filters(username, filters)
+    source = f"(SELECT {ROLLUP_KEY_SQL}, COUNT(*) AS n FROM {RESULTS_TABLE} {where} GROUP BY 1, 2, 3, 4) r"
+    return source, "", params
+
+
+# --- CHANGE LOG ---
+
+def has_change_log(connection):
+    return inspect(connection).has_table(CHANGES_TABLE)
+
+
+def log_changes(connection, op, where, params=None):
+    """Record every scraped_results row matching `where` as inserted ('I'), deleted ('D') or updated ('U')."""
+    connection.execute(
+        text(f"INSERT INTO {CHANGES_TABLE} (row_id, username, op, changed_at) "
+             f"SELECT id, username, :op, :changed_at FROM {RESULTS_TABLE} {where}"),
+        {**(params or {}), "op": op, "changed_at": pd.Timestamp.now().to_pydatetime()},
+    )
+
+
+def change_version(username=None, engine=None):
+    """Watermark of `username`'s rows (everyone's when None): (max change seq, max scraped_at).
+
+    Any insert, delete or update visible to the user changes it, so it can
+    key caches and drive delta refreshes.
+    """
+    user = "WHERE username = :user" if username is not None else ""
+    params = {"user": username} if username is not None else {}
+    with (engine or get_engine()).connect() as connection:
+        # scraped_at is per user via its index
+        scraped_at = connection.execute(text(f"SELECT MAX(scraped_at) FROM {RESULTS_TABLE} {user}"), params).scalar()
+        seq = None
+        if has_change_log(connection):
+            seq = connection.execute(text(f"SELECT MAX(seq) FROM {CHANGES_TABLE} {user}"), params).scalar()
+    return seq or 0, str(scraped_at) if scraped_at is not None else None
+
+
+# --- SEARCH INDEX ---
+
+def has_term_index(connection):
+    return inspect(connection).has_table(TERMS_TABLE)
+
+
+def insert_terms(connection, frame):
+    """Index the searchable columns of `frame` (which has an id column). Returns the number of terms."""
+    terms = search.document_terms(frame)
+    if terms.empty:
+        return 0
+    ignore = "OR IGNORE" if connection.dialect.name == "sqlite" else "IGNORE"
+    stmt = text(f"INSERT {ignore} INTO {TERMS_TABLE} (term, row_id, weight) VALUES (:t, :r, :w)")
+    rows = [{"t": t, "r": int(r), "w": int(w)} for t, r, w in terms.itertuples(index=False, name=None)]
+    for chunk in chunked(rows, BULK_CHUNK_SIZE):
+        connection.execute(stmt, chunk)
+    return len(rows)
+
+
+def index_terms(connection, where, params=None):
+    """Index the scraped_results rows matching `where`."""
+    columns = ", ".join(f"`{c}`" for c in search.SEARCH_COLUMNS)
+    frame = pd.read_sql(text(f"SELECT id, {columns} FROM {RESULTS_TABLE} {where}"), connection, params=params)
+    return insert_terms(connection, frame)
+
+
+def unindex_terms(connection, where, params=None):
+    """Drop the terms of the scraped_results rows matching `where`."""
+    connection.execute(text(f"DELETE FROM {TERMS_TABLE} WHERE row_id IN (SELECT id FROM {RESULTS_TABLE} {where})"),
+                       params or {})
+
+
+def rebuild_search_index(engine=None):
+    """Recompute the term index from scratch, one transaction per chunk. Returns the number of terms."""
+    engine = engine or get_engine()
+    with engine.begin() as connection:
+        metadata.create_all(connection, tables=[terms_table], checkfirst=True)
+        connection.execute(text(f"DELETE FROM {TERMS_TABLE}"))
+    total, cursor = 0, None
+    while True:
+        page, cursor = fetch_results_page(columns=list(search.SEARCH_COLUMNS), sort="id", descending=False,
+                                          after=cursor, limit=EXPORT_CHUNK_SIZE, engine=engine)
+        with engine.begin() as connection:
+            total += insert_terms(connection, page)
+        if cursor is None:
+            return total
+
+
+# --- SCRAPED RESULTS ---
+
+def bulk_insert(df, engine=None, table=RESULTS_TABLE, chunksize=BULK_CHUNK_SIZE):
+    """Insert `df` in chunks inside a single transaction.
+
+    Values are coerced to the column types of `results_table` by
+    prepare_results_frame, and a missing table is created with those types.
+    Legacy tables created by to_sql keep their TEXT columns until migrated.
+    Each chunk goes through executemany(), which PyMySQL rewrites into
+    multi-row INSERT statements. Either every row is written or none is.
+    Returns the number of rows inserted.
+    """
+    if df is None or df.empty:
+        return 0
+    frame = prepare_results_frame(df)
+    with (engine or get_engine()).begin() as connection:
+        ensure_results_table(connection)
+        # Tables not yet migrated to the typed schema lack some columns
+        existing = set(table_columns(connection, table))
+        frame = frame[[c for c in frame.columns if c in existing]]
+        inserted = insert_frame(connection, frame, table, chunksize)
+        if table == RESULTS_TABLE and has_rollup(connection):
+            adjust_rollup(connection, frame_rollup_counts(frame))
+        terms = table == RESULTS_TABLE and has_term_index(connection)
+        change_log = table == RESULTS_TABLE and has_change_log(connection)
+        if terms or change_log:
+            # By place_key, not by id > old MAX(id): TiDB's AUTO_INCREMENT is unique but not monotonic
+            # across servers. Older rows of the same place come along: INSERT IGNORE absorbs their
+            # terms, and a delta refresh just fetches them again.
+            for chunk in chunked(frame["place_key"].dropna().unique().tolist()):
+                params = {f"k{i}": k for i, k in enumerate(chunk)}
+                where = f"WHERE place_key IN ({', '.join(':' + k for k in params)})"
+                if terms:
+                    index_terms(connection, where, params)
+                if change_log:
+                    log_changes(connection, "I", where, params)
+        return inserted
+
+
+def fetch_results(username=None, engine=None):
+    """All stored results, or only `username`'s when given."""
+    query = f"SELECT * FROM {RESULTS_TABLE}"
+    params = {}
+    if username is not None:
+        query += " WHERE username = :user"
+        params["user"] = username
+    with (engine or get_engine()).connect() as connection:
+        return pd.read_sql(text(query), connection, params=params)
+
+
+def build_filters(username=None, filters=None):
+    """WHERE clause and params for the explorer filters.
+
+    Supported keys: provinsi, kabupaten, kbli_prefix, rating_min, rating_max,
+    date_from, date_to (inclusive dates), id_max, name (substring).
+    """
+    f = filters or {}
+    clauses, params = [], {}
+    if username is not None:
+        clauses.append("username = :user")
+        params["user"] = username
+    if f.get("provinsi"):
+        clauses.append("Provinsi = :provinsi")
+        params["provinsi"] = f["provinsi"]
+    if f.get("kabupaten"):
+        clauses.append("Kabupaten = :kabupaten")
+        params["kabupaten"] = f["kabupaten"]
+    if f.get("kbli_prefix"):
+        clauses.append("KBLI LIKE :kbli_prefix")
+        params["kbli_prefix"] = f"{f['kbli_prefix']}%"
+    if f.get("rating_min") is not None:
+        clauses.append("Rating >= :rating_min")
+        params["rating_min"] = f["rating_min"]
+    if f.get("rating_max") is not None:
+        clauses.append("Rating <= :rating_max")
+        params["rating_max"] = f["rating_max"]
+    if f.get("date_from"):
+        clauses.append("scraped_at >= :date_from")
+        params["date_from"] = pd.Timestamp(f["date_from"]).to_pydatetime()
+    if f.get("date_to"):
+        clauses.append("scraped_at < :date_to")
+        params["date_to"] = (pd.Timestamp(f["date_to"]) + pd.Timedelta(days=1)).to_pydatetime()
+    if f.get("name"):
+        clauses.append("LOWER(Name) LIKE :name")
+        params["name"] = f"%{f['name'].lower()}%"
+    if f.get("id_max") is not None:
+        clauses.append("id <= :id_max")
+        params["id_max"] = f["id_max"]
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    return where, params
+
+
+def fetch_results_page(username=None, filters=None, columns=None, sort="scraped_at", descending=True,
+                       after=None, limit=PAGE_SIZE, engine=None):
+    """One keyset-paginated page of results.
+
+    `after` is the cursor returned with the previous page. Returns
+    (DataFrame, next cursor or None on the last page).
+    """
+    if sort not in SORTABLE_COLUMNS:
+        raise ValueError(f"Cannot sort by {sort}")
+    with (engine or get_engine()).connect() as connection:
+        if "id" not in table_columns(connection):
+            raise RuntimeError(MIGRATION_HINT)
+        if columns:
+            check_columns(connection, columns)
+            projection = ", ".join(f"`{c}`" for c in dict.fromkeys(["id", sort, *columns]))
+        else:
+            projection = "*"
+        where, params = build_filters(username, filters)
+
+        direction = "DESC" if descending else "ASC"
+        if after is not None:
+            keyset = keyset_after(f"`{sort}`", descending, after[0] is None, SORTABLE_COLUMNS[sort] is not None)
+            where = f"{where} AND {keyset}" if where else f"WHERE {keyset}"
+            params.update(after_key=after[0], after_id=after[1])
+
+        query = (f"SELECT {projection} FROM {RESULTS_TABLE} {where} "
+                 f"ORDER BY `{sort}` {direction}, id {direction} LIMIT {int(limit)}")
+        page = pd.read_sql(text(query), connection, params=params)
+
+    cursor = page_cursor(page, sort) if len(page) == limit else None
+    return page, cursor
+
+
+def keyset_after(column, descending, key_is_null, nullable=True):
+    """WHERE clause for the rows after cursor (:after_key, :after_id) in ORDER BY column, id.
+
+    NULLs sort lowest: last when descending, first when ascending.
+    """
+    if key_is_null:
+        return f"({column} IS NULL AND id < :after_id)" if descending else f"({column} IS NOT NULL OR id > :after_id)"
+    if descending:
+        nulls = f" OR {column} IS NULL" if nullable else ""
+        return f"({column} < :after_key{nulls} OR ({column} = :after_key AND id < :after_id))"
+    return f"({column} > :after_key OR ({column} = :after_key AND id > :after_id))"
+
+
+def search_source(connection, terms):
+    """(FROM source, score expression, extra WHERE clause, params) for rows matching every term.
+
+    Uses the term index, else (before migrate.py has run) a LIKE scan
+    without ranking. MySQL's FULLTEXT index isn't used: it holds the raw
+    text, so "rm" can't match a query for "rumah makan", and InnoDB drops
+    words shorter than 3 letters ("jl", "gg", "rm").
+    """
+    if has_term_index(connection):
+        matches, params = [], {}
+        for i, term in enumerate(terms):
+            params[f"t{i}"], params[f"h{i}"] = search.prefix_range(term)
+            # An exact term counts double against a longer word it is a prefix of
+            matches.append(f"SELECT row_id, MAX(CASE WHEN term = :t{i} THEN 2 * weight ELSE weight END) AS score "
+                           f"FROM {TERMS_TABLE} WHERE term >= :t{i} AND term < :h{i} GROUP BY row_id")
+        hits = (f"SELECT row_id, SUM(score) AS score FROM ({' UNION ALL '.join(matches)}) m "
+                f"GROUP BY row_id HAVING COUNT(*) = {len(terms)}")
+        return f"({hits}) h JOIN {RESULTS_TABLE} ON id = h.row_id", "h.score", "", params
+    clauses, params = [], {}
+    for i, term in enumerate(terms):
+        variants = search.query_variants(term)
+        clauses.append("(" + " OR ".join(
+            f"LOWER(`{c}`) LIKE :l{i}_{j}" for c in search.SEARCH_COLUMNS for j in range(len(variants))
+        ) + ")")
+        params.update({f"l{i}_{j}": f"%{v}%" for j, v in enumerate(variants)})
+    return RESULTS_TABLE, "0", " AND ".join(clauses), params
+
+
+def search_results(query, username=None, filters=None, columns=None, limit=SEARCH_PAGE_SIZE, offset=0, engine=None):
+    """Rows matching every term of `query` within the filters, best match first.
+
+    Returns (DataFrame with a `score` column, total number of matches).
+    """
+    terms = search.query_terms(query)
+    if not terms:
+        return pd.DataFrame(), 0
+    with (engine or get_engine()).connect() as connection:
+        if columns:
+            check_columns(connection, columns)
+            projection = ", ".join(f"{RESULTS_TABLE}.`{c}`" for c in dict.fromkeys(["id", *columns]))
+        else:
+            projection = f"{RESULTS_TABLE}.*"
+        source, score, match, search_params = search_source(connection, terms)
+        where, params = build_filters(username, filters)
+        if match:
+            where = f"{where} AND {match}" if where else f"WHERE {match}"
+        params.update(search_params)
+
+        total = connection.execute(text(f"SELECT COUNT(*) FROM {source} {where}"), params).scalar()
+        page = pd.read_sql(text(
+            f"SELECT {projection}, {score} AS _score FROM {source} {where} "
+            f"ORDER BY _score DESC, id DESC LIMIT {int(limit)} OFFSET {int(offset)}"
+        ), connection, params=params)
+    return page.rename(columns={"_score": "score"}), total
+
+
+# --- DELTA REFRESH ---
+
+def sort_keys(frame, sort, casefold=False):
+    """Per-row sort key as fetch_results_page orders by it, NaN/NaT for NULL.
+
+    With `casefold`, names are lowercased like MySQL's default
+    case-insensitive collation compares them (SQLite compares bytes).
+    """
+    values = frame[sort]
+    if sort == "scraped_at":
+        values = normalize.parse_timestamp(values)
+    elif sort != "Name":
+        values = pd.to_numeric(values, errors="coerce")
+    return values.str.lower() if casefold and sort == "Name" else values
+
+
+def rows_after(frame, sort, descending, bound, casefold=True):
+    """Mask of rows that come strictly after cursor `bound` = (key, id) in page order (NULLs lowest)."""
+    keys, ids = sort_keys(frame, sort, casefold), frame["id"]
+    null = keys.isna()
+    key = bound[0]
+    if key is None:
+        return (null & (ids < bound[1])) if descending else (~null | (ids > bound[1]))
+    if sort == "Name":
+        key = str(key).lower() if casefold else str(key)
+    elif sort == "scraped_at":
+        key = pd.Timestamp(key)
+    if descending:
+        return null | (keys < key) | ((keys == key) & (ids < bound[1]))
+    return ~null & ((keys > key) | ((keys == key) & (ids > bound[1])))
+
+
+def sort_frame(frame, sort, descending, casefold=True):
+    """`frame` in page order: by sort key with NULLs lowest, then id."""
+    keys = sort_keys(frame, sort, casefold)
+    order = frame.assign(_has_key=keys.notna(), _key=keys)
+    columns = ["_has_key", "_key", "id"]
+    return frame.loc[order.sort_values(columns, ascending=not descending, na_position="first").index]
+
+
+def page_cursor(frame, sort):
+    """Cursor pointing after the last row of `frame`."""
+    key = frame[sort].iloc[-1]
+    if sort == "scraped_at" and key is not None and not pd.isna(key):
+        key = pd.Timestamp(key)
+    key = None if key is None or pd.isna(key) else key
+    return (key.to_pydatetime() if isinstance(key, pd.Timestamp) else db_value(key), int(frame["id"].iloc[-1]))
+
+
+def fetch_changed_ids(since_seq, username=None, engine=None):
+    """Ids inserted, deleted or updated after change-log position `since_seq`, and the newest position.
+
+    Returns (set(), since_seq) when the change log doesn't exist yet.
+    """
+    with (engine or get_engine()).connect() as connection:
+        if not has_change_log(connection):
+            return set(), since_seq
+        query = f"SELECT row_id, seq FROM {CHANGES_TABLE} WHERE seq > :seq"
+        params = {"seq": since_seq}
+        if username is not None:
+            query += " AND username = :user"
+            params["user"] = username
+        rows = connection.execute(text(query), params).fetchall()
+    return {r[0] for r in rows}, max((r[1] for r in rows), default=since_seq)
+
+
+def fetch_rows(ids, engine=None):
+    """Stored rows with the given ids, in chunks of MUTATION_CHUNK_SIZE. Yields DataFrames."""
+    for chunk in chunked(sorted(ids)):
+        params = {f"v{i}": v for i, v in enumerate(chunk)}
+        with (engine or get_engine()).connect() as connection:
+            yield pd.read_sql(
+                text(f"SELECT * FROM {RESULTS_TABLE} WHERE id IN ({', '.join(':' + k for k in params)})"),
+                connection, params=params,
+            )
+
+
+def fetch_delta(since, username=None, filters=None, columns=None, engine=None):
+    """What changed after `since` (a change_version).
+
+    Returns (rows inserted or updated since then that match the filters,
+    ids of rows inserted, deleted or updated since then).
+    """
+    seq, _ = since
+    changed, _ = fetch_changed_ids(seq, username, engine)
+    if not changed:
+        return pd.DataFrame(columns=["id", *(columns or [])]), changed
+    with (engine or get_engine()).connect() as connection:
+        if columns:
+            check_columns(connection, columns)
+            projection = ", ".join(f"`{c}`" for c in dict.fromkeys(["id", *columns]))
+        else:
+            projection = "*"
+        where, params = build_filters(username, filters)
+        # Inserted and updated rows alike, by id from the change log
+        frames = []
+        for chunk in chunked(sorted(changed)):
+            ids = {f"c{i}": v for i, v in enumerate(chunk)}
+            clause = f"id IN ({', '.join(':' + k for k in ids)})"
+            scoped = f"{where} AND {clause}" if where else f"WHERE {clause}"
+            frames.append(pd.read_sql(text(f"SELECT {projection} FROM {RESULTS_TABLE} {scoped}"),
+                                      connection, params={**params, **ids}))
+    rows = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+    return rows, changed
+
+
+def refresh_page(page, since, after=None, has_next=False, username=None, filters=None, columns=None,
+                 sort="scraped_at", descending=True, limit=PAGE_SIZE, engine=None):
+    """Bring one keyset page up to date by fetching only what changed since `since`.
+
+    `after` is the cursor the page was fetched with and `has_next` whether
+    a page followed it. Deleted rows are topped up from the next page.
+    Returns (page, next cursor or None).
+    """
+    engine = engine or get_engine()
+    casefold = engine.dialect.name != "sqlite"
+    columns = list(dict.fromkeys([sort, *columns])) if columns else None
+    rows, changed = fetch_delta(since, username, filters, columns, engine)
+    kept = page[~page["id"].isin(changed | set(rows["id"]))]
+
+    # Only rows whose position falls inside this page's range belong here
+    if after is not None and not rows.empty:
+        rows = rows[rows_after(rows, sort, descending, after, casefold)]
+    if has_next and not page.empty and not rows.empty:
+        rows = rows[~rows_after(rows, sort, descending, page_cursor(page, sort), casefold)]
+
+    merged = pd.concat([kept, rows], ignore_index=True) if not rows.empty else kept.reset_index(drop=True)
+    merged = sort_frame(merged, sort, descending, casefold).reset_index(drop=True)
+
+    if len(merged) > limit:
+        return merged.iloc[:limit], page_cursor(merged.iloc[:limit], sort)
+    if has_next and len(merged) < limit:
+        start = page_cursor(merged, sort) if not merged.empty else after
+        extra, cursor = fetch_results_page(username, filters, columns, sort, descending, start,
+                                           limit - len(merged), engine)
+        return pd.concat([merged, extra], ignore_index=True), cursor
+    return merged, page_cursor(merged, sort) if has_next else None
+
+
+def iter_results(username=None, filters=None, columns=None, chunksize=EXPORT_CHUNK_SIZE, engine=None):
+    """Yield every filtered row as DataFrames of at most `chunksize` rows, in id order."""
+    cursor = None
+    while True:
+        page, cursor = fetch_results_page(username=username, filters=filters, columns=columns, sort="id",
+                                          descending=False, after=cursor, limit=chunksize, engine=engine)
+        if not page.empty:
+            yield page
+        if cursor is None:
+            return
+
+
+def count_results(username=None, filters=None, engine=None):
+    where, params = build_filters(username, filters)
+    with (engine or get_engine()).connect() as connection:
+        return connection.execute(text(f"SELECT COUNT(*) FROM {RESULTS_TABLE} {where}"), params).scalar()
+
+
+def summarize_results(username=None, filters=None, engine=None):
+    """Header metrics (rows, distinct kabupaten / provinsi / KBLI divisions), read from the rollup."""
+    with (engine or get_engine()).connect() as connection:
+        source, where, params = rollup_source(connection, username, filters)
+        query = f"""
+            SELECT COALESCE(SUM(n), 0), COUNT(DISTINCT NULLIF(kabupaten, '')),
+                   COUNT(DISTINCT NULLIF(provinsi, '')), COUNT(DISTINCT NULLIF(kbli, ''))
+            FROM {source} {where}
+        """
+        total, kabupaten, provinsi, kbli = connection.execute(text(query), params).fetchone()
+    return {"total": int(total), "kabupaten": kabupaten, "provinsi": provinsi, "kbli": kbli}
+
+
+def breakdown_results(dimension, username=None, filters=None, limit=15, engine=None):
+    """Row counts per provinsi, kabupaten or KBLI division, largest first."""
+    if dimension not in ROLLUP_DIMENSIONS:
+        raise ValueError(f"Cannot break down by {dimension}")
+    with (engine or get_engine()).connect() as connection:
+        source, where, params = rollup_source(connection, username, filters)
+        where = f"{where} AND {dimension} <> ''" if where else f"WHERE {dimension} <> ''"
+        query = f"""
+            SELECT {dimension}, SUM(n) AS total FROM {source} {where}
+            GROUP BY {dimension} ORDER BY total DESC LIMIT {int(limit)}
+        """
+        return pd.read_sql(text(query), connection, params=params)
+
+
+def distinct_values(column, username=None, filters=None, engine=None):
+    """Sorted distinct non-empty values of `column`, for filter dropdowns."""
+    where, params = build_filters(username, filters)
+    with (engine or get_engine()).connect() as connection:
+        check_columns(connection, [column])
+        extra = f"`{column}` IS NOT NULL AND `{column}` NOT IN ('', 'N/A')"
+        where = f"{where} AND {extra}" if where else f"WHERE {extra}"
+        rows = connection.execute(text(f"SELECT DISTINCT `{column}` FROM {RESULTS_TABLE} {where} ORDER BY 1"), params)
+        return [r[0] for r in rows]
+
+
+def fetch_map_extent(username=None, filters=None, engine=None):
+    """(south, west, north, east) around the filtered rows that have coordinates, or None."""
+    where, params = build_filters(username, filters)
+    extra = "Latitude IS NOT NULL AND Longitude IS NOT NULL"
+    where = f"{where} AND {extra}" if where else f"WHERE {extra}"
+    query = f"SELECT MIN(Latitude), MIN(Longitude), MAX(Latitude), MAX(Longitude) FROM {RESULTS_TABLE} {where}"
+    with (engine or get_engine()).connect() as connection:
+        row = connection.execute(text(query), params).fetchone()
+    return None if row[0] is None else tuple(float(v) for v in row)
+
+
+def spatial_filter(connection, bbox, table=RESULTS_TABLE):
+    """WHERE clauses and params selecting rows inside bbox (south, west, north, east).
+
+    Prefilters on the indexed geohash prefixes covering the box, then on the
+    exact coordinate ranges. Tables without a geohash column get the ranges only.
+    """
+    south, west, north, east = bbox
+    clauses = ["Latitude BETWEEN :south AND :north", "Longitude BETWEEN :west AND :east"]
+    params = {"south": south, "west": west, "north": north, "east": east}
+    prefixes = [p for p in geo.cover_prefixes(bbox) if p]
+    if prefixes and "geohash" in table_columns(connection, table):
+        params.update({f"gh{i}": f"{p}%" for i, p in enumerate(prefixes)})
+        clauses.insert(0, f"({' OR '.join(f'geohash LIKE :gh{i}' for i in range(len(prefixes)))})")
+    return clauses, params
+
+
+def fetch_map_points(username=None, filters=None, bbox=None, limit=MAP_POINT_LIMIT, engine=None):
+    """Newest `limit` filtered points inside bbox (south, west, north, east).
+
+    Returns (DataFrame of id, Name, Latitude, Longitude; number of points in the bbox).
+    """
+    where, params = build_filters(username, filters)
+    with (engine or get_engine()).connect() as connection:
+        clauses = ["Latitude IS NOT NULL", "Longitude IS NOT NULL"]
+        if bbox is not None:
+            spatial, spatial_params = spatial_filter(connection, bbox)
+            clauses += spatial
+            params.update(spatial_params)
+        where = f"{where} AND {' AND '.join(clauses)}" if where else f"WHERE {' AND '.join(clauses)}"
+        total = connection.execute(text(f"SELECT COUNT(*) FROM {RESULTS_TABLE} {where}"), params).scalar()
+        points = pd.read_sql(
+            text(f"SELECT id, Name, Latitude, Longitude FROM {RESULTS_TABLE} {where} ORDER BY id DESC LIMIT {int(limit)}"),
+            connection, params=params,
+        )
+    return points, total
+
+
+def fetch_in_bbox(bbox, username=None, filters=None, columns=None, engine=None):
+    """Filtered rows inside bbox (south, west, north, east)."""
+    where, params = build_filters(username, filters)
+    with (engine or get_engine()).connect() as connection:
+        if columns:
+            check_columns(connection, columns)
+            projection = ", ".join(f"`{c}`" for c in dict.fromkeys(["id", "Latitude", "Longitude", *columns]))
+        else:
+            projection = "*"
+        spatial, spatial_params = spatial_filter(connection, bbox)
+        params.update(spatial_params)
+        where = f"{where} AND {' AND '.join(spatial)}" if where else f"WHERE {' AND '.join(spatial)}"
+        return pd.read_sql(text(f"SELECT {projection} FROM {RESULTS_TABLE} {where}"), connection, params=params)
+
+
+def fetch_nearby(lat, lng, radius_m, username=None, filters=None, columns=None, engine=None):
+    """Filtered rows within `radius_m` metres of (lat, lng), nearest first, with a distance_m column."""
+    candidates = fetch_in_bbox(geo.radius_bbox(lat, lng, radius_m), username, filters, columns, engine)
+    distance = geo.haversine_m(lat, lng, candidates["Latitude"], candidates["Longitude"])
+    nearby = candidates.assign(distance_m=distance.round(1))[distance <= radius_m]
+    return nearby.sort_values("distance_m", ignore_index=True)
+
+
+def fetch_result(row_id, username=None, engine=None):
+    """One stored row by id as a dict, or None (also when it belongs to another user)."""
+    query = f"SELECT * FROM {RESULTS_TABLE} WHERE id = :id"
+    params = {"id": int(row_id)}
+    if username is not None:
+        query += " AND username = :user"
+        params["user"] = username
+    with (engine or get_engine()).connect() as connection:
+        row = connection.execute(text(query), params).mappings().fetchone()
+    return dict(row) if row else None
+
+
+def fetch_unclassified_results(engine=None):
+    """Rows without a usable KBLI code, with their row id in a `row_id` column."""
+    with (engine or get_engine()).connect() as connection:
+        rid = row_id_column(connection)
+        query = (f"SELECT {rid} AS row_id, t.* FROM {RESULTS_TABLE} t "
+                 "WHERE KBLI IS NULL OR KBLI IN ('', 'N/A') OR KBLI LIKE 'Error%'")
+        return pd.read_sql(text(query), connection), rid
+
+
+def row_id_column(connection, table=RESULTS_TABLE):
+    """Column that uniquely identifies a stored row.
+
+    Tables created by to_sql have no primary key; TiDB and SQLite still
+    expose an implicit row id we can address rows by.
+    """
+    if "id" in table_columns(connection, table):
+        return "id"
+    return "rowid" if connection.dialect.name == "sqlite" else "_tidb_rowid"
+
+
+def check_columns(connection, columns):
+    """Column names are interpolated into SQL, so only accept real ones."""
+    known = set(table_columns(connection)) | {row_id_column(connection)}
+    unknown = [c for c in columns if c not in known]
+    if unknown:
+        raise ValueError(f"Unknown columns: {unknown}")
+
+
+def delete_results(values, column="id", username=None, engine=None):
+    """Delete rows whose `column` is in `values`, chunked IN lists in one transaction.
+
+    Scoped to `username` when given. Returns the number of rows removed.
+    """
+    removed = 0
+    with (engine or get_engine()).begin() as connection:
+        check_columns(connection, [column])
+        rollup, change_log, terms = has_rollup(connection), has_change_log(connection), has_term_index(connection)
+        for chunk in chunked(values):
+            params = {f"v{i}": v for i, v in enumerate(chunk)}
+            where = f"WHERE `{column}` IN ({', '.join(':' + k for k in params)})"
+            if username is not None:
+                where += " AND username = :user"
+                params["user"] = username
+            if rollup:
+                adjust_rollup(connection, rollup_counts(connection, where, params), sign=-1)
+            if change_log:
+                log_changes(connection, "D", where, params)
+            if terms:
+                unindex_terms(connection, where, params)
+            removed += connection.execute(text(f"DELETE FROM {RESULTS_TABLE} {where}"), params).rowcount
+    return removed
+
+
+def update_results(rows, key="id", engine=None):
+    """Apply per-row updates (dicts holding `key` plus new values) in one transaction.
+
+    Rows with the same set of columns share one executemany() round trip
+    per chunk. Returns the number of rows updated.
+    """
+    groups = {}
+    for row in rows:
+        columns = tuple(sorted(c for c in row if c != key))
+        if columns:
+            groups.setdefault(columns, []).append(row)
+
+    updated = 0
+    with (engine or get_engine()).begin() as connection:
+        rollup, change_log, terms = has_rollup(connection), has_change_log(connection), has_term_index(connection)
+        for columns, group in groups.items():
+            check_columns(connection, (key, *columns))
+            names = {c: f"p{i}" for i, c in enumerate(columns)}
+            assignments = ", ".join(f"`{c}` = :{names[c]}" for c in columns)
+            query = text(f"UPDATE {RESULTS_TABLE} SET {assignments} WHERE `{key}` = :key")
+            # Moving rows between rollup groups: take them out before, add them back after
+            moves_rollup = rollup and bool({"username", "Provinsi", "Kabupaten", "KBLI"} & set(columns))
+            reindex = terms and bool(set(search.SEARCH_COLUMNS) & set(columns))
+            for chunk in chunked(group, MUTATION_CHUNK_SIZE):
+                keys = {f"k{i}": r[key] for i, r in enumerate(chunk)}
+                where = f"WHERE `{key}` IN ({', '.join(':' + k for k in keys)})"
+                if moves_rollup:
+                    adjust_rollup(connection, rollup_counts(connection, where, keys), sign=-1)
+                params = [{**{names[c]: r[c] for c in columns}, "key": r[key]} for r in chunk]
+                connection.execute(query, params)
+                if moves_rollup:
+                    adjust_rollup(connection, rollup_counts(connection, where, keys))
+                if reindex:
+                    unindex_terms(connection, where, keys)
+                    index_terms(connection, where, keys)
+                if change_log:
+                    log_changes(connection, "U", where, keys)
+                updated += len(chunk)
+    return updated
+
+
+def deduplicate_results(engine=None, username=None, key=None, table=RESULTS_TABLE):
+    """Delete redundant rows server-side, keeping the newest row per key.
+
+    Runs as a single DELETE in one transaction, scoped to `username` when
+    given. Returns the number of rows removed.
+    """
+    with (engine or get_engine()).begin() as connection:
+        rid = row_id_column(connection, table)
+        if key is None:
+            key = DEDUP_KEY if "place_key" in table_columns(connection, table) else LEGACY_DEDUP_KEY
+        partition = ", ".join(f"`{c}`" for c in key)
+        where = "WHERE username = :user" if username is not None else ""
+        # The extra derived table lets MySQL/TiDB delete from the table it reads
+        redundant = f"""
+            WHERE {rid} IN (
+                SELECT rid FROM (
+                    SELECT {rid} AS rid, ROW_NUMBER() OVER (
+                        PARTITION BY {partition} ORDER BY scraped_at DESC, {rid} DESC
+                    ) AS rn
+                    FROM {table} {where}
+                ) ranked WHERE rn > 1
+            )
+        """
+        params = {"user": username} if username is not None else {}
+        if table == RESULTS_TABLE and has_rollup(connection):
+            adjust_rollup(connection, rollup_counts(connection, redundant, params), sign=-1)
+        if table == RESULTS_TABLE and has_change_log(connection):
+            log_changes(connection, "D", redundant, params)
+        if table == RESULTS_TABLE and has_term_index(connection):
+            unindex_terms(connection, redundant, params)
+        return connection.execute(text(f"DELETE FROM {table} {redundant}"), params).rowcount
+
+
+def find_near_duplicates(username=None, radius_m=None, threshold=None, engine=None):
+    """Stored rows that look like another, newer row of the same place (see dedup).
+
+    Returns one row per redundant record: the newest row of its group
+    (`keep_id`, `keep_name`), the redundant one (`drop_id`, `drop_name`),
+    their distance and name similarity.
+    """
+    columns = ["Name", "URL", "Latitude", "Longitude", "scraped_at"]
+    chunks = list(iter_results(username=username, columns=columns, engine=engine))
+    if not chunks:
+        return pd.DataFrame(columns=["keep_id", "keep_name", "drop_id", "drop_name", "distance_m", "similarity"])
+    frame = pd.concat(chunks, ignore_index=True)
+    # Newest first, so each group is labelled by the row deduplicate_results would keep
+    frame = frame.sort_values(["scraped_at", "id"], ascending=False, na_position="last", ignore_index=True)
+    labels = dedup.group_labels(len(frame), dedup.near_duplicate_pairs(frame, radius_m, threshold),
+                                dedup.place_ids(frame))
+    dropped = labels != range(len(frame))
+    keep, drop = frame.iloc[labels[dropped]].reset_index(drop=True), frame[dropped].reset_index(drop=True)
+    distance = geo.haversine_m(normalize.parse_coordinate(keep["Latitude"], 90),
+                               normalize.parse_coordinate(keep["Longitude"], 180),
+                               normalize.parse_coordinate(drop["Latitude"], 90),
+                               normalize.parse_coordinate(drop["Longitude"], 180))
+    return pd.DataFrame({
+        "keep_id": keep["id"], "keep_name": keep["Name"], "drop_id": drop["id"], "drop_name": drop["Name"],
+        "distance_m": distance.round(1),
+        "similarity": [round(dedup.similarity(dedup.name_key(a), dedup.name_key(b)), 3)
+                       for a, b in zip(keep["Name"], drop["Name"])],
+    })
+
+
+def merge_near_duplicates(username=None, radius_m=None, threshold=None, engine=None):
+    """Delete the redundant rows find_near_duplicates() reports. Returns the number of rows removed."""
+    suggestions = find_near_duplicates(username, radius_m, threshold, engine)
+    if suggestions.empty:
+        return 0
+    return delete_results([int(i) for i in suggestions["drop_id"]], column="id", username=username, engine=engine)
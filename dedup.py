@@ -0,0 +1,185 @@
+"""Near-duplicate places: the same business scraped twice with a slightly
+different pin or spelling ("Kopi Kenangan - Dago" / "Kopi Kenangan Dago").
+
+Comparing every pair of rows doesn't scale, so candidates are blocked
+first. Each row goes into the geohash-sized grid cell of its coordinates,
+once for every name word prefix it has. Only rows in the same or an
+adjacent cell that also share a word prefix are compared. Those pairs are
+then checked for their exact distance and scored on name similarity, and
+the pairs that pass are joined into groups.
+
+Two rows whose URLs carry different Google place ids are never paired,
+however alike they look: those are separate listings, like several
+"ATM BCA" in one mall.
+"""
+import os
+import re
+import difflib
+
+import numpy as np
+import pandas as pd
+
+import geo
+from normalize import parse_coordinate
+from search import ABBREVIATIONS, fold
+
+# Two pins further apart than this are different places
+NEAR_DUP_RADIUS_M = float(os.environ.get("DEDUP_RADIUS_M", 75))
+# Name similarity (0..1) from which a close pair counts as one place
+NAME_SIMILARITY = float(os.environ.get("DEDUP_NAME_SIMILARITY", 0.9))
+# Words are blocked on their first characters, so a typo further in still meets its twin
+BLOCK_PREFIX_LENGTH = 4
+
+# Half of the 3x3 neighbourhood; the mirrored offsets would only repeat pairs
+NEIGHBOUR_OFFSETS = ((0, 0), (0, 1), (1, -1), (1, 0), (1, 1))
+
+# Google's feature id inside a /maps/place/ URL
+PLACE_ID_PATTERN = r"!1s(0x[0-9a-fA-F]+:0x[0-9a-fA-F]+)"
+
+_WORD = re.compile(r"[a-z0-9]+")
+_NUMBER = re.compile(r"\d+")
+
+
+def name_key(name):
+    """Comparable form of a place name: folded words with abbreviations expanded, punctuation dropped.
+
+    Unlike search terms, short words and numbers stay: "SDN 1" and "SDN 2" are different schools.
+    """
+    return " ".join(part for word in _WORD.findall(fold(name)) for part in ABBREVIATIONS.get(word, word).split())
+
+
+def similarity(a, b, floor=0.0):
+    """Similarity of two name keys, insensitive to word order; 0 when their numbers differ.
+
+    Pairs that can't reach `floor` get a cheap upper bound instead of their exact score.
+    """
+    if a == b:
+        return 1.0
+    if not a or not b:
+        return 0.0
+    if _NUMBER.findall(a) != _NUMBER.findall(b):
+        return 0.0
+    # Best case when the shorter name lines up entirely with the longer one
+    bound = 2 * min(len(a), len(b)) / (len(a) + len(b))
+    if bound < floor:
+        return bound
+    matcher = difflib.SequenceMatcher(None, a, b)
+    # Sorting the words keeps the characters, so this bounds both orders
+    bound = matcher.quick_ratio()
+    if bound < floor:
+        return bound
+    ordered = matcher.ratio()
+    a_sorted, b_sorted = " ".join(sorted(a.split())), " ".join(sorted(b.split()))
+    return max(ordered, difflib.SequenceMatcher(None, a_sorted, b_sorted).ratio())
+
+
+def block_precision(radius_m, max_abs_lat):
+    """Finest geohash precision whose cells are at least `radius_m` across at `max_abs_lat`."""
+    shrink = max(np.cos(np.radians(max_abs_lat)), 1e-6)
+    for precision in range(geo.GEOHASH_PRECISION, 0, -1):
+        height, width = geo.cell_size(precision)
+        if min(height, width * shrink) * geo.METERS_PER_DEGREE >= radius_m:
+            return precision
+    return 1
+
+
+def candidate_pairs(lat, lng, keys, radius_m):
+    """(left, right) positions, left < right, of rows within `radius_m` of each other sharing a word prefix."""
+    valid = ~(np.isnan(lat) | np.isnan(lng))
+    if not valid.any():
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    height, width = geo.cell_size(block_precision(radius_m, np.abs(lat[valid]).max()))
+    blocks = pd.DataFrame({
+        "pos": np.flatnonzero(valid),
+        "row": np.floor((lat[valid] + 90) / height).astype(np.int64),
+        "col": np.floor((lng[valid] + 180) / width).astype(np.int64),
+        "prefix": [sorted({w[:BLOCK_PREFIX_LENGTH] for w in keys[i].split()}) for i in np.flatnonzero(valid)],
+    }).explode("prefix").dropna(subset=["prefix"])
+    # Integer codes join much faster than strings
+    blocks["prefix"] = pd.factorize(blocks["prefix"])[0]
+
+    found = []
+    for d_row, d_col in NEIGHBOUR_OFFSETS:
+        shifted = blocks.assign(row=blocks["row"] - d_row, col=blocks["col"] - d_col)
+        pairs = blocks.merge(shifted, on=["row", "col", "prefix"], suffixes=("_a", "_b"))
+        a, b = pairs["pos_a"].to_numpy(np.int64), pairs["pos_b"].to_numpy(np.int64)
+        keep = (a != b) & (geo.haversine_m(lat[a], lng[a], lat[b], lng[b]) <= radius_m)
+        # One int64 per pair; rows sharing several prefixes meet more than once
+        found.append(np.minimum(a, b)[keep] * len(lat) + np.maximum(a, b)[keep])
+    pairs = np.unique(np.concatenate(found))
+    return pairs // len(lat), pairs % len(lat)
+
+
+def place_ids(df):
+    """Google place id of each row of `df` from its URL (NaN where it has none), or None without a URL column."""
+    if "URL" not in df.columns:
+        return None
+    return df["URL"].astype(str).str.extract(PLACE_ID_PATTERN, expand=False).to_numpy(dtype=object)
+
+
+def near_duplicate_pairs(df, radius_m=None, threshold=None):
+    """Pairs of rows of `df` that look like one place.
+
+    Returns a DataFrame of positional `left`, `right`, `distance_m` and
+    `similarity`, most similar first.
+    """
+    radius_m = NEAR_DUP_RADIUS_M if radius_m is None else radius_m
+    threshold = NAME_SIMILARITY if threshold is None else threshold
+    lat = parse_coordinate(df["Latitude"], 90).to_numpy(dtype=float)
+    lng = parse_coordinate(df["Longitude"], 180).to_numpy(dtype=float)
+    # Chains repeat the same name many times over
+    codes, unique = pd.factorize(df["Name"].fillna("").astype(str))
+    unique_keys = [name_key(name) for name in unique]
+    keys = [unique_keys[code] for code in codes]
+
+    left, right = candidate_pairs(lat, lng, keys, radius_m)
+    distance = geo.haversine_m(lat[left], lng[left], lat[right], lng[right])
+    # Score each distinct pair of names once
+    name_pairs = pd.DataFrame({"a": np.minimum(codes[left], codes[right]), "b": np.maximum(codes[left], codes[right])})
+    distinct = name_pairs.drop_duplicates()
+    distinct_scores = pd.Series(
+        [similarity(unique_keys[a], unique_keys[b], threshold) for a, b in zip(distinct["a"], distinct["b"])],
+        index=pd.MultiIndex.from_frame(distinct), dtype=float)
+    scores = distinct_scores.reindex(pd.MultiIndex.from_frame(name_pairs)).to_numpy()
+    similar = scores >= threshold
+    ids = place_ids(df)
+    if ids is not None:
+        known = pd.notna(ids[left]) & pd.notna(ids[right])
+        similar &= ~(known & (ids[left] != ids[right]))
+    pairs = pd.DataFrame({"left": left[similar], "right": right[similar],
+                          "distance_m": distance[similar].round(1), "similarity": scores[similar].round(3)})
+    return pairs.sort_values(["similarity", "distance_m"], ascending=[False, True], ignore_index=True)
+
+
+def group_labels(n, pairs, ids=None):
+    """Group of each of `n` rows joined by (left, right) pairs: the smallest position in its group.
+
+    With `ids` (place_ids), pairs that would put two different place ids in one group are
+    skipped, so a row without an id can't chain two listings together. Pairs come first
+    to last, so the most similar ones win.
+    """
+    parent = list(range(n))
+    group_id = [None if ids is None or pd.isna(ids[i]) else ids[i] for i in range(n)]
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for a, b in zip(pairs["left"], pairs["right"]):
+        ra, rb = find(a), find(b)
+        if ra == rb or (group_id[ra] and group_id[rb] and group_id[ra] != group_id[rb]):
+            continue
+        root = min(ra, rb)
+        parent[max(ra, rb)] = root
+        group_id[root] = group_id[ra] or group_id[rb]
+    return np.array([find(i) for i in range(n)], dtype=np.int64)
+
+
+def drop_near_duplicates(df, radius_m=None, threshold=None):
+    """`df` with only the first row of each near-duplicate group (sort it by preference first)."""
+    if df.empty or not {"Name", "Latitude", "Longitude"} <= set(df.columns):
+        return df
+    labels = group_labels(len(df), near_duplicate_pairs(df, radius_m, threshold), place_ids(df))
+    return df[labels == np.arange(len(df))]
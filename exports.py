@@ -0,0 +1,141 @@
+"""CSV, Excel and Parquet exports written chunk by chunk.
+
+Exports take an iterable of DataFrames (e.g. `db.iter_results`) so the
+full table never has to sit in one DataFrame. Excel uses openpyxl's
+write-only workbook, Parquet needs the optional `pyarrow` package.
+"""
+import io
+import datetime
+import decimal
+
+import pandas as pd
+from sqlalchemy import DateTime, Double, Integer, Numeric
+
+import normalize
+
+# format -> (label, file extension, MIME type)
+EXPORT_FORMATS = {
+    "xlsx": ("Excel", "xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "csv": ("CSV", "csv", "text/csv"),
+    "parquet": ("Parquet", "parquet", "application/vnd.apache.parquet"),
+}
+
+
+def available_formats():
+    """Export formats usable in this environment."""
+    try:
+        import pyarrow  # noqa: F401
+        return list(EXPORT_FORMATS)
+    except ImportError:
+        return [f for f in EXPORT_FORMATS if f != "parquet"]
+
+
+def cell_value(value):
+    """Excel-safe cell: no NaN/NaT, pandas or numpy scalars."""
+    if value is None or (not isinstance(value, (str, bytes)) and pd.isna(value)):
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if hasattr(value, "item"):
+        return value.item()
+    return value
+
+
+def write_csv(chunks, out):
+    first = True
+    for chunk in chunks:
+        chunk.to_csv(out, header=first, index=False, encoding="utf-8")
+        first = False
+
+
+def write_xlsx(chunks, out):
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Data")
+    first = True
+    for chunk in chunks:
+        if first:
+            sheet.append([str(c) for c in chunk.columns])
+            first = False
+        for row in chunk.itertuples(index=False, name=None):
+            sheet.append([cell_value(v) for v in row])
+    workbook.save(out)
+
+
+def arrow_schema(table, columns):
+    """Arrow schema for `columns` of a SQLAlchemy table, so every chunk gets the same types."""
+    import pyarrow as pa
+
+    fields = []
+    for name in columns:
+        column_type = table.columns[name].type if name in table.columns else None
+        if isinstance(column_type, Integer):
+            fields.append((name, pa.int64()))
+        elif isinstance(column_type, (Numeric, Double)):
+            fields.append((name, pa.float64()))
+        elif isinstance(column_type, DateTime):
+            fields.append((name, pa.timestamp("us")))
+        else:
+            fields.append((name, pa.string()))
+    return pa.schema(fields)
+
+
+def arrow_frame(chunk, schema):
+    """Coerce a chunk to `schema`'s column kinds before handing it to Arrow."""
+    import pyarrow as pa
+
+    out = {}
+    for field in schema:
+        values = chunk[field.name]
+        if pa.types.is_integer(field.type) or pa.types.is_floating(field.type):
+            out[field.name] = pd.to_numeric(values, errors="coerce")
+        elif pa.types.is_timestamp(field.type):
+            out[field.name] = normalize.parse_timestamp(values)
+        else:
+            values = values.astype(object).where(values.notna(), None)
+            out[field.name] = values.map(lambda v: None if v is None else str(v))
+    return pa.Table.from_pandas(pd.DataFrame(out), schema=schema, preserve_index=False)
+
+
+def write_parquet(chunks, out, table=None):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    try:
+        for chunk in chunks:
+            if writer is None:
+                if table is not None:
+                    schema = arrow_schema(table, chunk.columns)
+                else:
+                    schema = pa.schema([(str(c), pa.string()) for c in chunk.columns])
+                writer = pq.ParquetWriter(out, schema, compression="zstd")
+            writer.write_table(arrow_frame(chunk, schema))
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def export_bytes(fmt, chunks, table=None):
+    """Serialize `chunks` (iterable of DataFrames) to `fmt`.
+
+    `table` (a SQLAlchemy Table) fixes the Parquet column types; without it
+    every column is written as text.
+    """
+    out = io.BytesIO()
+    if fmt == "csv":
+        write_csv(chunks, out)
+    elif fmt == "xlsx":
+        write_xlsx(chunks, out)
+    elif fmt == "parquet":
+        write_parquet(chunks, out, table)
+    else:
+        raise ValueError(f"Unknown export format: {fmt}")
+    return out.getvalue()
+
+
+def export_file_name(prefix, fmt):
+    return f"{prefix}_{datetime.datetime.now():%Y%m%d_%H%M%S}.{EXPORT_FORMATS[fmt][1]}"
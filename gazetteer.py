@@ -0,0 +1,315 @@
+"""Offline Indonesian address parser backed by a region gazetteer.
+
+Google Maps addresses usually spell out the kelurahan, kecamatan,
+kabupaten/kota and province ("..., Gondangdia, Kec. Menteng, Kota Jakarta
+Pusat, Daerah Khusus Ibukota Jakarta 10350"). Every region name in the
+gazetteer goes into one Aho-Corasick automaton over words. A single pass
+over an address finds all names in it. "Kec.", "Kel.", "Kab." and "Kota"
+restrict a match to that level. The hierarchy is then resolved
+consistently. The region whose chain of ancestors is named by the most
+distinct mentions wins, with deeper regions winning ties. Readings that
+remain equally good are cut back to the levels they agree on.
+
+enrich_results uses the result when it reaches the kelurahan and only
+geocodes the rest.
+
+The gazetteer is a CSV in one of two formats:
+- provinsi,kabupaten,kecamatan,kelurahan[,kode_pos]: one row per village, as in the postal code lists.
+- kode,nama: the BPS / Kemendagri region code list, where the level follows from the dotted code.
+
+The bundled data/wilayah.csv only covers Kota Jakarta Pusat; addresses
+elsewhere fall through to Nominatim. Point GAZETTEER_PATH at a full export
+to cover the country.
+"""
+import os
+import re
+from collections import deque
+from functools import lru_cache
+
+import pandas as pd
+
+from search import fold
+
+BUNDLED_GAZETTEER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "wilayah.csv")
+GAZETTEER_PATH = os.environ.get("GAZETTEER_PATH", BUNDLED_GAZETTEER_PATH)
+
+PROVINCE, REGENCY, DISTRICT, VILLAGE = range(4)
+LEVEL_FIELDS = ("Provinsi", "Kabupaten", "Kecamatan", "Kelurahan")
+
+# Words in front of a name that pin its level (and for kabupaten/kota, its kind)
+MARKERS = {
+    "provinsi": (PROVINCE, None), "prov": (PROVINCE, None),
+    "kabupaten": (REGENCY, "kabupaten"), "kab": (REGENCY, "kabupaten"),
+    "kota": (REGENCY, "kota"), "kotamadya": (REGENCY, "kota"),
+    "kecamatan": (DISTRICT, None), "kec": (DISTRICT, None), "distrik": (DISTRICT, None),
+    "kelurahan": (VILLAGE, None), "kel": (VILLAGE, None), "desa": (VILLAGE, None), "ds": (VILLAGE, None),
+}
+NAME_PREFIXES = {
+    PROVINCE: ("provinsi", "prov"),
+    REGENCY: ("kabupaten", "kab", "kota", "kotamadya"),
+    DISTRICT: ("kecamatan", "kec", "distrik"),
+    VILLAGE: ("kelurahan", "kel", "desa", "ds"),
+}
+# Spellings folded together, in names and addresses alike
+PHRASE_ALIASES = [
+    (("daerah", "khusus", "ibukota"), ("dki",)),
+    (("daerah", "khusus", "ibu", "kota"), ("dki",)),
+    (("daerah", "khusus"), ("dki",)),
+    (("daerah", "istimewa"), ("di",)),
+]
+# Google's short forms ("Kec. Bogor Sel.", "Kby. Baru")
+WORD_ALIASES = {"sel": "selatan", "utr": "utara", "tim": "timur", "bar": "barat", "tgh": "tengah",
+                "kby": "kebayoran", "pd": "pondok", "tj": "tanjung", "kp": "kampung"}
+DROPPED_WORDS = {"adm", "administrasi"}
+ACRONYMS = {"dki": "DKI", "di": "DI"}
+
+# Comma-separated address parts starting with these are street names, never regions
+STREET_WORDS = {"jl", "jln", "jalan", "gg", "gang", "komp", "kompleks", "perum", "perumahan", "ruko"}
+STREET_PATTERN = re.compile(r"^\s*(?:jl|jln|jalan|gg|gang)\b", re.IGNORECASE)
+HOUSE_NUMBER_PATTERN = re.compile(r"^(?P<road>.+?)[\s,]+No\.?\s*(?P<number>[\w/.-]+)", re.IGNORECASE)
+POSTAL_PATTERN = re.compile(r"\b([1-9]\d{4})\b")
+
+_TOKEN = re.compile(r"[a-z0-9]+|,")
+
+
+def tokens(text):
+    """Folded words of `text` with commas kept as separators and aliases applied."""
+    words = [WORD_ALIASES.get(w, w) for w in _TOKEN.findall(fold(text)) if w not in DROPPED_WORDS]
+    out, i = [], 0
+    while i < len(words):
+        for phrase, alias in PHRASE_ALIASES:
+            if tuple(words[i:i + len(phrase)]) == phrase:
+                out.extend(alias)
+                i += len(phrase)
+                break
+        else:
+            out.append(words[i])
+            i += 1
+    return out
+
+
+def name_key(name, level):
+    """Matching key of a gazetteer name: its words without the level prefix."""
+    words = tokens(name)
+    while words and words[0] in NAME_PREFIXES[level]:
+        words = words[1:]
+    return tuple(w for w in words if w != ",")
+
+
+def regency_kind(name):
+    words = tokens(name)
+    return "kota" if words and words[0] in ("kota", "kotamadya") else "kabupaten"
+
+
+def display_name(name, level):
+    """Readable region name: title case for all-caps sources, 'Kab.' spelled out, ADM dropped."""
+    words = name_key(name, level)
+    text = " ".join(ACRONYMS.get(w, w.capitalize()) for w in words)
+    if level == REGENCY:
+        return f"{'Kota' if regency_kind(name) == 'kota' else 'Kabupaten'} {text}"
+    return text
+
+
+class Automaton:
+    """Aho-Corasick automaton over word sequences."""
+
+    def __init__(self):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]
+
+    def add(self, words, value):
+        node = 0
+        for word in words:
+            child = self.goto[node].get(word)
+            if child is None:
+                child = len(self.goto)
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append([])
+                self.goto[node][word] = child
+            node = child
+        self.out[node].append((len(words), value))
+
+    def build(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for word, child in self.goto[node].items():
+                queue.append(child)
+                f = self.fail[node]
+                while f and word not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[child] = self.goto[f].get(word, 0)
+                self.out[child] = self.out[child] + self.out[self.fail[child]]
+        return self
+
+    def find(self, words):
+        """(start, end, value) of every pattern occurrence in `words`."""
+        node = 0
+        for i, word in enumerate(words):
+            while node and word not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(word, 0)
+            for length, value in self.out[node]:
+                yield i - length + 1, i + 1, value
+
+
+def _flat_rows(table):
+    """Rows of (provinsi, kabupaten, kecamatan, kelurahan, kode_pos) from either gazetteer format."""
+    columns = {c.lower(): c for c in table.columns}
+    if "kode" in columns and "nama" in columns:
+        names = dict(zip(table[columns["kode"]].str.strip(), table[columns["nama"]].str.strip()))
+        for code, name in names.items():
+            parts = code.split(".")
+            if len(parts) == 4:
+                chain = [names.get(".".join(parts[:n])) for n in range(1, 4)]
+                if all(chain):
+                    yield (*chain, name, "")
+        return
+    get = lambda key: table[columns[key]] if key in columns else pd.Series("", index=table.index)
+    yield from zip(get("provinsi"), get("kabupaten"), get("kecamatan"), get("kelurahan"), get("kode_pos"))
+
+
+class Gazetteer:
+    """Region hierarchy plus the automaton matching its names."""
+
+    def __init__(self, rows):
+        # Region: [level, display name, parent index, kind, postal codes]
+        self.regions = []
+        self.by_key = {}
+        index = {}
+        for row in rows:
+            parent = None
+            for level, name in enumerate(row[:4]):
+                name = str(name or "").strip()
+                key = name_key(name, level)
+                if not key:
+                    break
+                kind = regency_kind(name) if level == REGENCY else None
+                # Kota Bogor and Kabupaten Bogor share a key but are different regions
+                node_id = (parent, level, key, kind)
+                if node_id not in index:
+                    index[node_id] = len(self.regions)
+                    self.regions.append([level, display_name(name, level), parent, kind, set()])
+                    self.by_key.setdefault(key, []).append(index[node_id])
+                parent = index[node_id]
+            else:
+                postal = str(row[4] or "").strip()
+                if postal:
+                    self.regions[parent][4].add(postal)
+        self.automaton = Automaton()
+        for key in self.by_key:
+            self.automaton.add(key, key)
+        self.automaton.build()
+
+    def chain(self, region):
+        """Region indices from the province down to `region`."""
+        out = []
+        while region is not None:
+            out.append(region)
+            region = self.regions[region][2]
+        return out[::-1]
+
+    def matches(self, address):
+        """{region index: positions of its mentions} for the region names in `address`."""
+        words = tokens(address)
+        street = set()
+        segment_start = 0
+        for i, word in enumerate(words + [","]):
+            if word == ",":
+                if segment_start < i and words[segment_start] in STREET_WORDS:
+                    street.update(range(segment_start, i))
+                segment_start = i + 1
+        spans = [m for m in self.automaton.find(words) if m[0] not in street]
+        found = {}
+        for start, end, key in spans:
+            # "Pusat" inside "Jakarta Pusat" is not a mention of its own
+            if any(s <= start and end <= e and e - s > end - start for s, e, _ in spans):
+                continue
+            marker = MARKERS.get(words[start - 1]) if start else None
+            for region in self.by_key[key]:
+                level, _, _, kind, _ = self.regions[region]
+                if marker and (marker[0] != level or (marker[1] and kind and marker[1] != kind)):
+                    continue
+                found.setdefault(region, set()).add(start)
+        return found
+
+    def resolve(self, address):
+        """Region chain named by `address` (province first), or [] when nothing is corroborated."""
+        found = self.matches(address)
+        if not found:
+            return []
+        postal = POSTAL_PATTERN.findall(str(address or ""))
+        postal = postal[-1] if postal else None
+
+        def rank(region):
+            named = [r for r in self.chain(region) if r in found]
+            mentions = set().union(*(found[r] for r in named))
+            # One word can't name two levels: "Menteng" alone is the kecamatan or the kelurahan, not both
+            support = min(len(named), len(mentions)) + (postal in self.regions[region][4])
+            shared = len(named) - len(mentions)
+            return support, -shared, self.regions[region][0], max(found[region])
+
+        ranks = {region: rank(region) for region in found}
+        best = max(ranks.values())
+        # One uncorroborated name below province level could be anything (a street, a shop)
+        if best[0] < 2 and best[2] != PROVINCE:
+            return []
+        # Equally good readings that disagree keep only what they share
+        tied = [self.chain(r) for r, value in ranks.items() if value == best]
+        chain = tied[0]
+        for other in tied[1:]:
+            n = 0
+            while n < min(len(chain), len(other)) and chain[n] == other[n]:
+                n += 1
+            chain = chain[:n]
+        return chain
+
+    def parse(self, address):
+        """enrich_results-style fields for `address`: the admin levels resolved, postal code, street and number."""
+        chain = self.resolve(address)
+        if not chain:
+            return {}
+        fields = {"Negara": "Indonesia"}
+        for field, region in zip(LEVEL_FIELDS, chain):
+            fields[field] = self.regions[region][1]
+        postal = POSTAL_PATTERN.findall(str(address))
+        village_postal = self.regions[chain[-1]][4] if len(chain) == 4 else set()
+        if postal:
+            fields["Kode Pos"] = postal[-1]
+        elif len(village_postal) == 1:
+            fields["Kode Pos"] = next(iter(village_postal))
+        street = next((part.strip() for part in str(address).split(",") if STREET_PATTERN.match(part)), None)
+        if street:
+            numbered = HOUSE_NUMBER_PATTERN.match(street)
+            fields["Jalan"] = numbered.group("road").strip() if numbered else street
+            if numbered:
+                fields["Nomor"] = numbered.group("number").rstrip(".")
+        return fields
+
+    def parse_many(self, addresses):
+        """parse() over a batch; repeated addresses are parsed once."""
+        cache = {}
+        out = []
+        for address in addresses:
+            if address not in cache:
+                cache[address] = self.parse(address)
+            out.append(cache[address])
+        return out
+
+
+def is_complete(fields):
+    """True when `fields` resolve every level down to the kelurahan."""
+    return all(fields.get(f) for f in LEVEL_FIELDS)
+
+
+@lru_cache(maxsize=4)
+def load_gazetteer(path=GAZETTEER_PATH):
+    """Gazetteer from `path`, or None when the file doesn't exist."""
+    if not os.path.exists(path):
+        return None
+    if os.path.abspath(path) == BUNDLED_GAZETTEER_PATH:
+        print("Using the bundled gazetteer, which only covers Kota Jakarta Pusat; set GAZETTEER_PATH for other regions.")
+    table = pd.read_csv(path, dtype=str, keep_default_na=False)
+    return Gazetteer(_flat_rows(table))
@@ -0,0 +1,87 @@
+"""Geohash cells and distances for spatial lookups over stored places.
+
+Every stored row carries the geohash of its coordinates in an indexed
+column. A radius or bounding-box lookup first selects the few geohash
+prefixes covering the area (an index range scan each), then checks the
+exact distance of the candidates with numpy.
+"""
+import math
+
+import numpy as np
+import pandas as pd
+
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+# Stored precision: 8 characters is a cell of about 38 m x 19 m
+GEOHASH_PRECISION = 8
+
+# A covering with more prefixes than this is redone one level coarser
+MAX_COVER_CELLS = 16
+
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS_M / 180
+
+
+def encode_geohash(lat, lng, precision=GEOHASH_PRECISION):
+    """Vectorized geohash of coordinate arrays. NaN coordinates give None."""
+    lat = np.asarray(pd.to_numeric(pd.Series(lat), errors="coerce"), dtype=float)
+    lng = np.asarray(pd.to_numeric(pd.Series(lng), errors="coerce"), dtype=float)
+    valid = ~(np.isnan(lat) | np.isnan(lng)) & (np.abs(lat) <= 90) & (np.abs(lng) <= 180)
+
+    lat_lo, lat_hi = np.full(lat.shape, -90.0), np.full(lat.shape, 90.0)
+    lng_lo, lng_hi = np.full(lng.shape, -180.0), np.full(lng.shape, 180.0)
+    lat, lng = np.where(valid, lat, 0.0), np.where(valid, lng, 0.0)
+    codes = np.zeros((len(lat), precision), dtype=np.int64)
+    for bit in range(precision * 5):
+        # Bits alternate longitude, latitude, starting with longitude
+        if bit % 2 == 0:
+            mid = (lng_lo + lng_hi) / 2
+            upper = lng >= mid
+            lng_lo, lng_hi = np.where(upper, mid, lng_lo), np.where(upper, lng_hi, mid)
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            upper = lat >= mid
+            lat_lo, lat_hi = np.where(upper, mid, lat_lo), np.where(upper, lat_hi, mid)
+        codes[:, bit // 5] = codes[:, bit // 5] * 2 + upper
+
+    alphabet = np.array(list(GEOHASH_ALPHABET))
+    hashes = ["".join(row) for row in alphabet[codes]]
+    return [h if ok else None for h, ok in zip(hashes, valid)]
+
+
+def cell_size(precision):
+    """(height, width) in degrees of a geohash cell."""
+    bits = precision * 5
+    return 180 / 2 ** (bits // 2), 360 / 2 ** ((bits + 1) // 2)
+
+
+def radius_bbox(lat, lng, radius_m):
+    """(south, west, north, east) around a circle."""
+    dlat = radius_m / METERS_PER_DEGREE
+    dlng = radius_m / (METERS_PER_DEGREE * max(math.cos(math.radians(lat)), 1e-6))
+    return max(lat - dlat, -90), max(lng - dlng, -180), min(lat + dlat, 90), min(lng + dlng, 180)
+
+
+def cover_prefixes(bbox, precision=GEOHASH_PRECISION):
+    """Geohash prefixes whose cells together cover `bbox`, at most MAX_COVER_CELLS of them."""
+    south, west, north, east = bbox
+    for p in range(precision, 0, -1):
+        height, width = cell_size(p)
+        rows = math.floor(north / height) - math.floor(south / height) + 1
+        cols = math.floor(east / width) - math.floor(west / width) + 1
+        if rows * cols > MAX_COVER_CELLS:
+            continue
+        # One sample point per cell row/column, plus the far edges
+        lats = np.append(np.arange(south, north, height), north)
+        lngs = np.append(np.arange(west, east, width), east)
+        grid_lat, grid_lng = np.meshgrid(lats, lngs)
+        return sorted(set(encode_geohash(grid_lat.ravel(), grid_lng.ravel(), p)))
+    return [""]
+
+
+def haversine_m(lat, lng, lats, lngs):
+    """Distance in metres from (lat, lng) to each point of the arrays (pairwise when lat, lng are arrays too)."""
+    lat1, lng1 = np.radians(np.asarray(lat, dtype=float)), np.radians(np.asarray(lng, dtype=float))
+    lat2, lng2 = np.radians(np.asarray(lats, dtype=float)), np.radians(np.asarray(lngs, dtype=float))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
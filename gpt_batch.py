@@ -0,0 +1,303 @@
+"""Bulk GPT enrichment through the OpenAI Batch API.
+
+Nightly sweeps don't need interactive latency, so instead of calling
+`process_with_gpt` per record we write every request into one JSONL file,
+submit it as a batch, poll until it finishes and merge the answers back by
+record id. Job state is kept on disk so a restarted process picks up where
+it left off instead of submitting (and paying for) the batch twice. A batch
+that fails or expires keeps the job open: the answers it did return are
+merged, and the next run resubmits only the requests still unanswered.
+
+    python gpt_batch.py results.csv --job nightly --output enriched.csv
+    python gpt_batch.py --from-db --job nightly
+"""
+import os
+import json
+import time
+import argparse
+
+import pandas as pd
+from openai import OpenAI
+
+from scraper import (build_gpt_request, apply_gpt_result, apply_gpt_error, new_usage_totals, add_usage,
+                     is_missing, GPT_ADMIN_FIELDS)
+from kbli import classify_records, KBLI_LOCAL_THRESHOLD
+
+# Columns a batch run may change, written back with --from-db
+ENRICHED_COLUMNS = ["KBLI", "Nama Resmi KBLI", "Keterangan KBLI"] + [column for _, column, _ in GPT_ADMIN_FIELDS]
+
+BATCH_DIR = "batch_jobs"
+BATCH_ENDPOINT = "/v1/chat/completions"
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+class OpenAIBatchClient:
+    """Thin adapter over the OpenAI SDK. Pass `base_url` to target a local fake server."""
+
+    def __init__(self, api_key=None, base_url=None, client=None):
+        self.client = client or OpenAI(api_key=api_key, base_url=base_url)
+
+    def upload(self, path):
+        with open(path, "rb") as f:
+            return self.client.files.create(file=f, purpose="batch").id
+
+    def submit(self, file_id, metadata=None):
+        batch = self.client.batches.create(
+            input_file_id=file_id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window="24h",
+            metadata=metadata,
+        )
+        return batch.id
+
+    def find_batch(self, file_id):
+        """Id of an existing batch over `file_id`, or None. Batches are listed newest first."""
+        for batch in self.client.batches.list(limit=100):
+            if batch.input_file_id == file_id:
+                return batch.id
+        return None
+
+    def status(self, batch_id):
+        batch = self.client.batches.retrieve(batch_id)
+        return {
+            "status": batch.status,
+            "output_file_id": batch.output_file_id,
+            "error_file_id": batch.error_file_id,
+        }
+
+    def download(self, file_id):
+        return self.client.files.content(file_id).text
+
+
+class BatchJob:
+    """One resumable batch run. Stages: prepared -> submitting -> submitted -> collected.
+
+    A batch that ends in any status but "completed" sends the job back to
+    prepared with only its unanswered requests left.
+    """
+
+    def __init__(self, name, client, batch_dir=BATCH_DIR, id_field="URL", poll_interval=60):
+        self.name = name
+        self.client = client
+        self.id_field = id_field
+        self.poll_interval = poll_interval
+        self.dir = os.path.join(batch_dir, name)
+        self.requests_path = os.path.join(self.dir, "requests.jsonl")
+        self.results_path = os.path.join(self.dir, "results.jsonl")
+        self.state_path = os.path.join(self.dir, "state.json")
+        os.makedirs(self.dir, exist_ok=True)
+        self.state = self._load_state()
+
+    def _load_state(self):
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                return json.load(f)
+        return {"stage": "new"}
+
+    def _save_state(self, **changes):
+        self.state.update(changes)
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp, self.state_path)
+
+    def record_id(self, item):
+        """The record's batch custom_id, or None when it has no usable id."""
+        value = item.get(self.id_field)
+        if is_missing(value) or pd.isna(value):
+            return None
+        return str(value).strip()
+
+    def prepare(self, records, local_threshold=KBLI_LOCAL_THRESHOLD):
+        """Write one request line per record the local classifier couldn't resolve.
+
+        Records without an id are left out: their answers couldn't be matched back.
+        """
+        pending = classify_records(records, threshold=local_threshold)
+        seen, skipped = set(), 0
+        if os.path.exists(self.results_path):
+            os.remove(self.results_path)
+        with open(self.requests_path, "w", encoding="utf-8") as f:
+            for i in pending:
+                record_id = self.record_id(records[i])
+                if record_id is None:
+                    skipped += 1
+                    continue
+                if record_id in seen:
+                    continue
+                seen.add(record_id)
+                f.write(json.dumps({
+                    "custom_id": record_id,
+                    "method": "POST",
+                    "url": BATCH_ENDPOINT,
+                    "body": build_gpt_request(records[i]),
+                }, ensure_ascii=False) + "\n")
+        print(f"Prepared {len(seen)} batch requests ({len(records) - len(pending)} resolved locally)")
+        if skipped:
+            print(f"Skipped {skipped} records without a {self.id_field}")
+        self._save_state(stage="prepared", request_count=len(seen), pending_count=len(seen))
+
+    def submit(self):
+        if not self.state.get("input_file_id"):
+            self._save_state(input_file_id=self.client.upload(self.requests_path))
+        if self.state["stage"] == "submitting":
+            # A previous run died between creating the batch and recording it
+            batch_id = self.client.find_batch(self.state["input_file_id"])
+            if batch_id:
+                self._save_state(stage="submitted", batch_id=batch_id)
+                print(f"Found batch {batch_id} from an interrupted submit")
+                return
+        self._save_state(stage="submitting")
+        batch_id = self.client.submit(self.state["input_file_id"], metadata={"job": self.name})
+        self._save_state(stage="submitted", batch_id=batch_id)
+        print(f"Submitted batch {batch_id}")
+
+    def wait(self):
+        while True:
+            info = self.client.status(self.state["batch_id"])
+            self._save_state(batch_status=info["status"])
+            if info["status"] in TERMINAL_STATUSES:
+                return info
+            print(f"Batch {self.state['batch_id']} is {info['status']}, checking again in {self.poll_interval}s")
+            time.sleep(self.poll_interval)
+
+    def collect(self, info):
+        """Append the output and error files to results.jsonl.
+
+        A batch that didn't complete sends the job back to prepared, with
+        requests.jsonl cut down to the requests it left unanswered.
+        """
+        lines = []
+        for key in ("output_file_id", "error_file_id"):
+            if info.get(key):
+                lines.extend(l for l in self.client.download(info[key]).splitlines() if l.strip())
+        with open(self.results_path, "a", encoding="utf-8") as f:
+            f.write("".join(l + "\n" for l in lines))
+        if info["status"] == "completed":
+            self._save_state(stage="collected", pending_count=0)
+            return
+
+        answered = {key for key, answer in self.load_results().items() if not isinstance(answer, Exception)}
+        with open(self.requests_path, encoding="utf-8") as f:
+            remaining = [l for l in f if l.strip() and json.loads(l)["custom_id"] not in answered]
+        with open(self.requests_path, "w", encoding="utf-8") as f:
+            f.writelines(remaining)
+        if remaining:
+            # The next run uploads the smaller file and submits a new batch
+            self._save_state(stage="prepared", pending_count=len(remaining), input_file_id=None, batch_id=None)
+            print(f"{len(remaining)} requests left unanswered, run the job again to resubmit them")
+        else:
+            self._save_state(stage="collected", pending_count=0)
+
+    def load_results(self):
+        """Map custom_id -> parsed GPT JSON, or an Exception for failed requests."""
+        results = {}
+        self.usage = new_usage_totals()
+        if not os.path.exists(self.results_path):
+            return results
+        with open(self.results_path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                response = row.get("response") or {}
+                add_usage(self.usage, (response.get("body") or {}).get("usage"))
+                try:
+                    if row.get("error") or response.get("status_code") != 200:
+                        raise ValueError(row.get("error") or f"HTTP {response.get('status_code')}")
+                    content = response["body"]["choices"][0]["message"]["content"]
+                    if not content:
+                        raise ValueError("Empty response from GPT")
+                    results[row["custom_id"]] = json.loads(content)
+                except Exception as e:
+                    self.usage["errors"] += 1
+                    results[row["custom_id"]] = e
+        return results
+
+    def merge(self, records):
+        """Apply collected answers to `records` by id. Returns the number merged."""
+        results = self.load_results()
+        merged = 0
+        for item in records:
+            answer = results.get(self.record_id(item))
+            if answer is None:
+                continue
+            if isinstance(answer, Exception):
+                apply_gpt_error(item, answer)
+            else:
+                apply_gpt_result(item, answer)
+                merged += 1
+        return merged
+
+    def run(self, records, local_threshold=KBLI_LOCAL_THRESHOLD):
+        """Drive the job to completion, skipping any stage a previous run already finished."""
+        if self.state["stage"] == "new":
+            self.prepare(records, local_threshold)
+        else:
+            # Locally resolvable records were never part of the batch, classify them again
+            classify_records(records, threshold=local_threshold)
+        if self.state["stage"] in ("prepared", "submitting"):
+            if self.state.get("pending_count", self.state.get("request_count", 0)) == 0:
+                self._save_state(stage="collected")
+            else:
+                self.submit()
+        if self.state["stage"] == "submitted":
+            info = self.wait()
+            if info["status"] != "completed":
+                print(f"Batch ended with status '{info['status']}'")
+            self.collect(info)
+        merged = self.merge(records)
+        self._save_state(usage=self.usage)
+        print(f"Merged {merged}/{self.state.get('request_count', 0)} batch results, "
+              f"{self.usage['prompt_tokens']} prompt + {self.usage['completion_tokens']} completion tokens")
+        return records
+
+
+def enrich_stored_results(job, local_threshold=KBLI_LOCAL_THRESHOLD):
+    """Run `job` over stored rows lacking a KBLI code and write the answers back by row id."""
+    import db
+    df, rid = db.fetch_unclassified_results()
+    records = df.to_dict("records")
+    job.id_field = "row_id"
+    job.run(records, local_threshold)
+    updates = [
+        {rid: r["row_id"], **{c: r.get(c) for c in ENRICHED_COLUMNS if c in df.columns}}
+        for r in records
+    ]
+    print(f"Updated {db.update_results(updates, key=rid)} stored records")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk KBLI enrichment with the OpenAI Batch API")
+    parser.add_argument("input", type=str, nargs="?", help="CSV or Excel file with scraped records")
+    parser.add_argument("--from-db", action="store_true", help="Enrich stored rows without a KBLI code instead of a file")
+    parser.add_argument("--job", type=str, required=True, help="Job name, reuse it to resume after a restart")
+    parser.add_argument("--output", type=str, help="Where to write the merged records (default: overwrite input)")
+    parser.add_argument("--id-field", type=str, default="URL", help="Column that identifies a record")
+    parser.add_argument("--base-url", type=str, default=None, help="Alternative API base URL, e.g. a local fake server")
+    parser.add_argument("--poll-interval", type=int, default=60, help="Seconds between status checks")
+    parser.add_argument("--batch-dir", type=str, default=BATCH_DIR)
+
+    args = parser.parse_args()
+    if not args.input and not args.from_db:
+        parser.error("either an input file or --from-db is required")
+
+    client = OpenAIBatchClient(api_key=os.environ.get("OPENAI_API_KEY"), base_url=args.base_url)
+    job = BatchJob(args.job, client, batch_dir=args.batch_dir, id_field=args.id_field, poll_interval=args.poll_interval)
+
+    if args.from_db:
+        enrich_stored_results(job)
+    else:
+        if args.input.endswith(".xlsx"):
+            df = pd.read_excel(args.input, dtype=str)
+        else:
+            df = pd.read_csv(args.input, dtype=str, keep_default_na=False)
+        records = df.to_dict("records")
+        job.run(records)
+
+        output = args.output or args.input
+        if output.endswith(".xlsx"):
+            pd.DataFrame(records).to_excel(output, index=False)
+        else:
+            pd.DataFrame(records).to_csv(output, index=False)
+        print(f"Saved enriched records to {output}")
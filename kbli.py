@@ -0,0 +1,252 @@
+import os
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+# Point KBLI_TABLE_PATH at a full OSS export (same columns) to widen coverage
+KBLI_TABLE_PATH = os.environ.get(
+    "KBLI_TABLE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "kbli_2020.csv"),
+)
+# Every KBLI 2020 code with its official title, for looking up codes the curated
+# table above has no keywords for. Point KBLI_TITLES_PATH at a newer BPS export
+# (columns kode, judul) when the classification is revised.
+KBLI_TITLES_PATH = os.environ.get(
+    "KBLI_TITLES_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "kbli_2020_judul.csv"),
+)
+KBLI_UNKNOWN_NOTE = "Kode tidak ditemukan di tabel referensi KBLI 2020"
+
+# Records scoring at or above this are classified locally, the rest go to GPT
+KBLI_LOCAL_THRESHOLD = 0.7
+
+# Rule weights: multi-word keywords are more specific than single words. One generic
+# word ("bengkel", "bank", "toko") stays below the threshold unless something backs it
+# up: a second keyword, the OSM tag, or a TF-IDF match of the same code.
+SINGLE_KEYWORD_WEIGHT = 0.6
+# Single words that name one code on their own (a pharmacy, a hotel, a minimarket
+# chain) and classify locally without corroboration
+UNAMBIGUOUS_KEYWORDS = frozenset({
+    "apotek", "apotik", "pharmacy", "k24", "k-24",
+    "hotel", "resort",
+    "minimarket", "supermarket", "hypermarket", "swalayan",
+    "indomaret", "alfamart", "alfamidi", "lawson", "superindo", "hypermart",
+})
+UNAMBIGUOUS_KEYWORD_WEIGHT = 0.75
+CORROBORATED_KEYWORD_WEIGHT = 0.8
+TFIDF_CORROBORATION = 0.5
+PHRASE_KEYWORD_WEIGHT = 0.9
+OSM_CATEGORY_WEIGHT = 0.7
+NGRAM_SIZE = 3
+
+# (name, OSM category, expected code or None for "left to GPT"), checked by `python kbli.py`
+REGRESSION_CASES = [
+    ("Bengkel Las Jaya", "", None),
+    ("Bank Sampah Melati", "", None),
+    ("Bengkel Motor Jaya", "", "45405"),
+    ("Bengkel Jaya Motor", "", "45405"),
+    ("Bengkel Ahass", "", "45405"),
+    ("Bengkel Jaya", "motorcycle_repair", "45405"),
+    ("Bank BCA KCP Dago", "", "64121"),
+    ("Bank Jateng", "bank", "64121"),
+    ("Apotek Kimia Farma", "", "47721"),
+    ("Apotek Sehat", "", "47721"),
+    ("Indomaret", "", "47111"),
+    ("Hotel Santika", "", "55110"),
+    ("Bengkel", "", None),
+]
+
+
+@lru_cache(maxsize=4)
+def load_kbli_table(path=KBLI_TABLE_PATH):
+    """Load the KBLI 2020 reference table (kode, judul, uraian, kata_kunci, osm)."""
+    table = pd.read_csv(path, dtype=str, keep_default_na=False)
+    table["kode"] = table["kode"].str.strip()
+    return table
+
+
+@lru_cache(maxsize=4)
+def kbli_index(path=KBLI_TABLE_PATH, titles_path=KBLI_TITLES_PATH):
+    """In-memory code index: 5-digit code -> (official title, description).
+
+    Covers every code in the title table; the curated table wins where both
+    have a code, since only it carries descriptions.
+    """
+    titles = pd.read_csv(titles_path, dtype=str, keep_default_na=False)
+    index = {kode.strip(): (judul, "N/A") for kode, judul in zip(titles["kode"], titles["judul"])}
+    table = load_kbli_table(path)
+    index.update(zip(table["kode"], zip(table["judul"], table["uraian"])))
+    return index
+
+
+def lookup_kbli(code):
+    """Resolve a model-predicted code to its official KBLI fields.
+
+    Invalid codes and codes missing from the reference tables are flagged
+    rather than trusted.
+    """
+    clean = re.sub(r"\D", "", str(code or ""))
+    if len(clean) != 5:
+        return {"KBLI": f"Error: kode KBLI tidak valid ({code})", "Nama Resmi KBLI": "N/A", "Keterangan KBLI": "N/A"}
+    entry = kbli_index().get(clean)
+    if entry is None:
+        return {"KBLI": clean, "Nama Resmi KBLI": "N/A", "Keterangan KBLI": KBLI_UNKNOWN_NOTE}
+    return {"KBLI": clean, "Nama Resmi KBLI": entry[0], "Keterangan KBLI": entry[1]}
+
+
+def normalize_text(series):
+    """Lowercase and strip punctuation so keywords match on word boundaries."""
+    return (series.fillna("").astype(str).str.lower()
+            .str.replace(r"[^\w\s&-]", " ", regex=True)
+            .str.replace(r"\s+", " ", regex=True).str.strip())
+
+
+def char_ngrams(text, n=NGRAM_SIZE):
+    padded = f" {text} "
+    return [padded[i:i + n] for i in range(len(padded) - n + 1)]
+
+
+class KBLIClassifier:
+    """Offline first-pass KBLI classifier: keyword rules + char n-gram TF-IDF."""
+
+    def __init__(self, table=None, threshold=KBLI_LOCAL_THRESHOLD):
+        self.table = table if table is not None else load_kbli_table()
+        self.threshold = threshold
+        self.codes = self.table["kode"].tolist()
+
+        # Keyword rules, one (pattern, code index, weight) per keyword
+        self.rules = []
+        for idx, keywords in enumerate(self.table["kata_kunci"]):
+            for kw in filter(None, (k.strip().lower() for k in keywords.split(";"))):
+                if " " in kw:
+                    weight = PHRASE_KEYWORD_WEIGHT
+                elif kw in UNAMBIGUOUS_KEYWORDS:
+                    weight = UNAMBIGUOUS_KEYWORD_WEIGHT
+                else:
+                    weight = SINGLE_KEYWORD_WEIGHT
+                self.rules.append((r"(?<!\w)" + re.escape(kw) + r"(?!\w)", idx, weight))
+
+        # OSM category -> code index
+        self.osm_map = {}
+        for idx, tags in enumerate(self.table["osm"]):
+            for tag in filter(None, (t.strip().lower() for t in tags.split(";"))):
+                self.osm_map.setdefault(tag, idx)
+
+        # TF-IDF over the reference documents (title + keywords)
+        docs = normalize_text(self.table["judul"] + " " + self.table["kata_kunci"].str.replace(";", " "))
+        doc_grams = [set(char_ngrams(d)) for d in docs]
+        self.vocab = {g: i for i, g in enumerate(sorted(set().union(*doc_grams)))}
+        df_counts = np.zeros(len(self.vocab))
+        for grams in doc_grams:
+            for g in grams:
+                df_counts[self.vocab[g]] += 1
+        self.idf = np.log((1 + len(docs)) / (1 + df_counts)) + 1
+        self.doc_matrix = self._tfidf(docs)
+
+    def _tfidf(self, texts):
+        matrix = np.zeros((len(texts), len(self.vocab)), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for g in char_ngrams(text):
+                col = self.vocab.get(g)
+                if col is not None:
+                    matrix[row, col] += 1
+        matrix *= self.idf
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return matrix / norms
+
+    def score(self, names, osm_categories=None, chunk_size=2000):
+        """Return a (records x codes) score matrix for the whole batch."""
+        names = pd.Series(names).reset_index(drop=True)
+        osm = pd.Series(osm_categories if osm_categories is not None else [""] * len(names)).reset_index(drop=True)
+        # Rules only look at the name, the OSM tag has its own mapping below
+        text = normalize_text(names)
+
+        scores = np.zeros((len(text), len(self.codes)), dtype=np.float32)
+        single_hits = np.zeros(scores.shape, dtype=np.int16)
+        for pattern, idx, weight in self.rules:
+            hits = text.str.contains(pattern, regex=True).to_numpy()
+            scores[hits, idx] = np.maximum(scores[hits, idx], weight)
+            if weight == SINGLE_KEYWORD_WEIGHT:
+                single_hits[hits, idx] += 1
+        scores[single_hits >= 2] = np.maximum(scores[single_hits >= 2], CORROBORATED_KEYWORD_WEIGHT)
+        # Cells resting on one generic word, which the TF-IDF match below may still back up
+        lone = (single_hits == 1) & (scores < CORROBORATED_KEYWORD_WEIGHT)
+
+        osm_idx = osm.fillna("").astype(str).str.lower().map(self.osm_map)
+        has_osm = osm_idx.notna().to_numpy()
+        if has_osm.any():
+            rows = np.flatnonzero(has_osm)
+            cols = osm_idx[has_osm].astype(int).to_numpy()
+            # Rule and OSM category agreeing is the strongest signal we have
+            agree = scores[rows, cols] > 0
+            scores[rows, cols] = np.where(agree, 1.0, np.maximum(scores[rows, cols], OSM_CATEGORY_WEIGHT))
+            lone[rows, cols] = False
+
+        full_text = normalize_text(names + " " + osm.fillna("").astype(str).str.replace("_", " "))
+        for start in range(0, len(full_text), chunk_size):
+            chunk = self._tfidf(full_text.iloc[start:start + chunk_size].tolist())
+            similarity = chunk @ self.doc_matrix.T
+            window = scores[start:start + chunk_size]
+            backed = lone[start:start + chunk_size] & (similarity >= TFIDF_CORROBORATION)
+            window[backed] = CORROBORATED_KEYWORD_WEIGHT
+            np.maximum(window, similarity, out=window)
+        return scores
+
+    def classify(self, names, osm_categories=None):
+        """Classify a batch. Returns a DataFrame with KBLI fields, confidence and `local` flag."""
+        scores = self.score(names, osm_categories)
+        if scores.shape[1] == 0 or scores.shape[0] == 0:
+            return pd.DataFrame(columns=["KBLI", "Nama Resmi KBLI", "Keterangan KBLI", "confidence", "local"])
+
+        best = scores.argmax(axis=1)
+        ordered = np.sort(scores, axis=1)
+        confidence = ordered[:, -1].copy()
+        if scores.shape[1] > 1:
+            # Two codes tied for first place is ambiguous, let the LLM decide
+            confidence[np.isclose(ordered[:, -1], ordered[:, -2])] *= 0.5
+
+        matched = self.table.iloc[best].reset_index(drop=True)
+        return pd.DataFrame({
+            "KBLI": matched["kode"],
+            "Nama Resmi KBLI": matched["judul"],
+            "Keterangan KBLI": matched["uraian"],
+            "confidence": confidence,
+            "local": confidence >= self.threshold,
+        })
+
+
+def classify_records(records, threshold=KBLI_LOCAL_THRESHOLD):
+    """Classify a list of result dicts in place. Returns the indices left for GPT."""
+    if not records:
+        return []
+    classifier = KBLIClassifier(threshold=threshold)
+    names = [r.get("Name") or "" for r in records]
+    osm = [r.get("Kategori OSM") if r.get("Kategori OSM") not in (None, "N/A") else "" for r in records]
+    result = classifier.classify(names, osm)
+
+    pending = []
+    for i, (record, row) in enumerate(zip(records, result.to_dict("records"))):
+        if row["local"]:
+            record.update({k: row[k] for k in ("KBLI", "Nama Resmi KBLI", "Keterangan KBLI")})
+        else:
+            pending.append(i)
+    return pending
+
+
+def check_regressions(cases=REGRESSION_CASES):
+    """Failed (name, osm, expected, got) of the known classification cases."""
+    names, osm, expected = zip(*cases)
+    result = KBLIClassifier().classify(list(names), list(osm))
+    got = [row["KBLI"] if row["local"] else None for row in result.to_dict("records")]
+    return [(n, o, e, g) for n, o, e, g in zip(names, osm, expected, got) if e != g]
+
+
+if __name__ == "__main__":
+    failures = check_regressions()
+    for name, osm, expected, got in failures:
+        print(f"FAIL {name!r} (osm={osm!r}): expected {expected or 'GPT'}, got {got or 'GPT'}")
+    print(f"{len(REGRESSION_CASES) - len(failures)}/{len(REGRESSION_CASES)} KBLI cases pass")
+    raise SystemExit(1 if failures else 0)
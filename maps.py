@@ -0,0 +1,94 @@
+"""Map layers that stay fast as the number of points grows.
+
+Instead of one folium.Marker with its own HTML popup per row, all points
+go into a single GeoJSON layer built from column arrays and drawn on a
+canvas. The details of a place are only loaded when it is clicked.
+"""
+import folium
+import pandas as pd
+
+import normalize
+
+MAP_HEIGHT = 500
+POINT_STYLE = {"radius": 5, "weight": 1, "fill": True, "fill_opacity": 0.8}
+
+
+def coordinate_frame(df, lat="Latitude", lng="Longitude"):
+    """Rows of `df` with usable coordinates, plus float `lat` / `lng` columns."""
+    if lat not in df.columns or lng not in df.columns:
+        return df.iloc[0:0].assign(lat=pd.Series(dtype=float), lng=pd.Series(dtype=float))
+    # Normalized frames already hold floats; those are used as they are
+    out = df.assign(lat=normalize.parse_coordinate(df[lat], 90), lng=normalize.parse_coordinate(df[lng], 180))
+    return out.dropna(subset=["lat", "lng"])
+
+
+def points_geojson(lat, lng, ids, names):
+    """FeatureCollection of bare points; properties are only what the tooltip and click need."""
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [x, y]},
+                "properties": {"id": i, "name": n},
+            }
+            for y, x, i, n in zip(lat, lng, ids, names)
+        ],
+    }
+
+
+def point_layer(points, id_column="id", name_column="Name", color="#4f46e5", layer_name="Lokasi"):
+    """One FeatureGroup holding every point of `points` (a coordinate_frame)."""
+    ids = points[id_column].astype(int).tolist() if id_column in points.columns else list(range(len(points)))
+    names = points[name_column].fillna("").astype(str).tolist() if name_column in points.columns else [""] * len(points)
+    layer = folium.FeatureGroup(name=layer_name)
+    folium.GeoJson(
+        points_geojson(points["lat"].tolist(), points["lng"].tolist(), ids, names),
+        marker=folium.CircleMarker(color=color, fill_color=color, **POINT_STYLE),
+        tooltip=folium.GeoJsonTooltip(fields=["name"], labels=False),
+    ).add_to(layer)
+    return layer
+
+
+def base_map(bounds, tiles="CartoDB positron"):
+    """Canvas-rendered map fitted to (south, west, north, east)."""
+    south, west, north, east = bounds
+    m = folium.Map(location=[(south + north) / 2, (west + east) / 2], tiles=tiles, prefer_canvas=True)
+    m.fit_bounds([[south, west], [north, east]], max_zoom=16)
+    return m
+
+
+def frame_bounds(points):
+    return points["lat"].min(), points["lng"].min(), points["lat"].max(), points["lng"].max()
+
+
+def viewport_bbox(map_state):
+    """(south, west, north, east) of the last viewport st_folium reported, or None."""
+    bounds = (map_state or {}).get("bounds") or {}
+    sw, ne = bounds.get("_southWest") or {}, bounds.get("_northEast") or {}
+    if None in (sw.get("lat"), sw.get("lng"), ne.get("lat"), ne.get("lng")):
+        return None
+    return sw["lat"], sw["lng"], ne["lat"], ne["lng"]
+
+
+def clicked_id(map_state):
+    """id property of the last clicked point, or None."""
+    feature = (map_state or {}).get("last_active_drawing") or {}
+    return (feature.get("properties") or {}).get("id")
+
+
+def detail_html(name, address=None, wa_link=None, gmap_link=None):
+    """Popup-style card for the clicked place."""
+    wa_btn = ""
+    if wa_link:
+        wa_btn = f'<a href="{wa_link}" target="_blank" style="display:inline-block; margin-top:5px; text-decoration:none; color:white; background:#25D366; padding:4px 8px; border-radius:4px; font-size:0.8em;">💬 WhatsApp</a>'
+    map_btn = ""
+    if gmap_link:
+        map_btn = f'<a href="{gmap_link}" target="_blank" style="display:inline-block; margin-top:5px; margin-left:5px; text-decoration:none; color:white; background:#4285F4; padding:4px 8px; border-radius:4px; font-size:0.8em;">📍 G-Maps</a>'
+    return f"""
+    <div style="font-family:sans-serif; min-width:200px;">
+        <b style="font-size:1.1em; color:#333;">{name or 'Tanpa Nama'}</b><br>
+        <div style="color:#666; font-size:0.85em; margin: 4px 0 8px 0; line-height:1.2;">{address or '-'}</div>
+        <div>{wa_btn} {map_btn}</div>
+    </div>
+    """
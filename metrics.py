@@ -0,0 +1,181 @@
+"""Timing spans and counters for scrape jobs.
+
+Each GoogleMapsScraper carries a JobMetrics. Stages and external calls are
+wrapped in `span()`; errors, retries, fallbacks and cache hits are
+`count()`ed; current settings such as concurrency limits are `gauge()`s.
+publish() appends the job to a JSONL log and folds it into
+process-wide totals, which are written in Prometheus text format (for
+node_exporter's textfile collector or any scraper that reads the file).
+"""
+import os
+import json
+import time
+import uuid
+import threading
+from contextlib import contextmanager
+
+METRICS_DIR = os.environ.get("METRICS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "metrics"))
+JSONL_FILE = "jobs.jsonl"
+PROMETHEUS_FILE = "sbrgo.prom"
+METRIC_PREFIX = "sbrgo"
+
+# Process-wide totals behind the Prometheus file: {stage: [count, errors, seconds]}, {(name, labels): n},
+# and the last published value of each gauge {(name, labels): value}
+_totals = {"stages": {}, "counters": {}, "gauges": {}}
+_totals_lock = threading.Lock()
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class JobMetrics:
+    """Spans, counters and gauges of one scrape job."""
+
+    def __init__(self, job="scrape"):
+        self.job = job
+        self.job_id = uuid.uuid4().hex[:12]
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self._end = None
+        self.spans = []
+        self.counters = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, stage, **labels):
+        """Time the block as `stage`. An exception escaping the block marks the span failed."""
+        start = time.perf_counter()
+        ok = True
+        try:
+            yield
+        except BaseException:
+            ok = False
+            raise
+        finally:
+            with self._lock:
+                self.spans.append({"stage": stage, "offset_s": round(start - self._start, 4),
+                                   "seconds": time.perf_counter() - start, "ok": ok, **labels})
+
+    def count(self, name, n=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def gauge(self, name, value, **labels):
+        """Record the current value of `name`; the last value wins."""
+        with self._lock:
+            self.gauges[(name, _label_key(labels))] = value
+
+    def finish(self):
+        """Stop the job clock (publish() does this)."""
+        if self._end is None:
+            self._end = time.perf_counter()
+
+    def elapsed(self):
+        return (self._end or time.perf_counter()) - self._start
+
+    def stage_totals(self):
+        """{stage: [calls, errors, seconds]}."""
+        totals = {}
+        for span in self.spans:
+            entry = totals.setdefault(span["stage"], [0, 0, 0.0])
+            entry[0] += 1
+            entry[1] += not span["ok"]
+            entry[2] += span["seconds"]
+        return totals
+
+    def summary(self):
+        """Per-stage rows (calls, errors, total / mean / p95 / max seconds), slowest stage first."""
+        by_stage = {}
+        for span in self.spans:
+            by_stage.setdefault(span["stage"], []).append(span)
+        rows = []
+        for stage, spans in by_stage.items():
+            seconds = sorted(s["seconds"] for s in spans)
+            rows.append({
+                "stage": stage,
+                "calls": len(spans),
+                "errors": sum(not s["ok"] for s in spans),
+                "total_s": round(sum(seconds), 3),
+                "mean_s": round(sum(seconds) / len(seconds), 3),
+                "p95_s": round(seconds[min(len(seconds) - 1, int(0.95 * len(seconds)))], 3),
+                "max_s": round(seconds[-1], 3),
+            })
+        return sorted(rows, key=lambda r: r["total_s"], reverse=True)
+
+    def counter_rows(self):
+        return [{"counter": name, **dict(labels), "n": n} for (name, labels), n in sorted(self.counters.items())]
+
+    def gauge_rows(self):
+        return [{"gauge": name, **dict(labels), "value": v} for (name, labels), v in sorted(self.gauges.items())]
+
+    def to_jsonl(self):
+        """One JSON line per span, counter and gauge, each tagged with the job id."""
+        base = {"job": self.job, "job_id": self.job_id, "started_at": self.started_at}
+        lines = [json.dumps({**base, "type": "span", **span, "seconds": round(span["seconds"], 4)})
+                 for span in self.spans]
+        lines += [json.dumps({**base, "type": "counter", "name": name, "labels": dict(labels), "n": n})
+                  for (name, labels), n in sorted(self.counters.items())]
+        lines += [json.dumps({**base, "type": "gauge", "name": name, "labels": dict(labels), "value": v})
+                  for (name, labels), v in sorted(self.gauges.items())]
+        lines.append(json.dumps({**base, "type": "job", "seconds": round(self.elapsed(), 4)}))
+        return "\n".join(lines) + "\n"
+
+    def prometheus_text(self):
+        return prometheus_text(self.stage_totals(), self.counters, self.gauges)
+
+
+# --- EXPORT ---
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(pairs):
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}" if pairs else ""
+
+
+def prometheus_text(stage_totals, counters, gauges=None):
+    """Prometheus exposition text for {stage: [calls, errors, seconds]}, {(name, labels): n} and gauges."""
+    p = METRIC_PREFIX
+    lines = [
+        f"# HELP {p}_stage_seconds Time spent in each scrape stage or external call.",
+        f"# TYPE {p}_stage_seconds summary",
+    ]
+    for stage, (calls, _, seconds) in sorted(stage_totals.items()):
+        lines.append(f'{p}_stage_seconds_sum{{stage="{_escape(stage)}"}} {seconds:.6f}')
+        lines.append(f'{p}_stage_seconds_count{{stage="{_escape(stage)}"}} {calls}')
+    lines += [f"# HELP {p}_stage_errors_total Stage runs that raised.", f"# TYPE {p}_stage_errors_total counter"]
+    for stage, (_, errors, _) in sorted(stage_totals.items()):
+        lines.append(f'{p}_stage_errors_total{{stage="{_escape(stage)}"}} {errors}')
+    lines += [f"# HELP {p}_events_total Errors, retries, fallbacks and cache hits.", f"# TYPE {p}_events_total counter"]
+    for (name, labels), n in sorted(counters.items()):
+        lines.append(f"{p}_events_total{_labels((('event', name),) + labels)} {n}")
+    for name in sorted({name for name, _ in gauges or {}}):
+        lines += [f"# TYPE {p}_{name} gauge"]
+        lines += [f"{p}_{name}{_labels(labels)} {value}"
+                  for (gauge, labels), value in sorted(gauges.items()) if gauge == name]
+    return "\n".join(lines) + "\n"
+
+
+def publish(job, directory=METRICS_DIR):
+    """Append `job` to the JSONL log and rewrite the Prometheus file with the updated process totals."""
+    job.finish()
+    os.makedirs(directory, exist_ok=True)
+    with _totals_lock:
+        for stage, (calls, errors, seconds) in job.stage_totals().items():
+            entry = _totals["stages"].setdefault(stage, [0, 0, 0.0])
+            entry[0] += calls
+            entry[1] += errors
+            entry[2] += seconds
+        for key, n in job.counters.items():
+            _totals["counters"][key] = _totals["counters"].get(key, 0) + n
+        _totals["gauges"].update(job.gauges)
+        with open(os.path.join(directory, JSONL_FILE), "a", encoding="utf-8") as f:
+            f.write(job.to_jsonl())
+        path = os.path.join(directory, PROMETHEUS_FILE)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(prometheus_text(_totals["stages"], _totals["counters"], _totals["gauges"]))
+        os.replace(path + ".tmp", path)
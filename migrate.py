@@ -1,77 +1,247 @@
-import os
-import pymysql
-import toml
-
-def migrate():
-    # Load secrets
-    secrets_path = os.path.join(".streamlit", "secrets.toml")
-    if not os.path.exists(secrets_path):
-        print("Secrets not found!")
-        return
-    
-    config = toml.load(secrets_path)
-    db_config = config['connections']['tidb']
-    
-    # Connection details
-    user = db_config['username']
-    pw = db_config['password']
-    host = db_config['host']
-    port = db_config['port']
-    db = db_config['database']
-    # Resolve SSL CA path relative to the app root
-    ssl_ca = os.path.abspath(db_config.get('ssl_ca', 'isrgrootx1.pem'))
-
-    print(f"Connecting to {host}...")
-    
-    connection = pymysql.connect(
-        host=host,
-        port=port,
-        user=user,
-        password=pw,
-        database=db,
-        ssl={'ca': ssl_ca}
-    )
+"""Versioned schema migrations.
 
-    try:
-        with connection.cursor() as cursor:
-            # 1. Create users table
-            print("Creating users table...")
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    username VARCHAR(255) PRIMARY KEY,
-                    password VARCHAR(255) NOT NULL,
-                    is_superuser BOOLEAN DEFAULT FALSE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # 2. Add username column to scraped_results
+Each migration runs once, in order, and is recorded in `schema_migrations`.
+Add new ones to the end of MIGRATIONS; never edit one that has shipped.
+
+    python migrate.py            # apply pending migrations
+    python migrate.py --status   # list applied / pending
+    python migrate.py --rebuild-rollup   # recompute results_rollup from scratch
+    python migrate.py --rebuild-search   # recompute the results_terms search index
+"""
+import argparse
+
+import pandas as pd
+from sqlalchemy import MetaData, inspect, text
+
+import db
+import geo
+
+# Rows copied per transaction while backfilling the typed table
+BACKFILL_CHUNK_SIZE = 5000
+
+
+def _create_users(engine):
+    with engine.begin() as connection:
+        # 1. Create users table
+        print("Creating users table...")
+        connection.execute(text("""
+            CREATE TABLE IF NOT EXISTS users (
+                username VARCHAR(255) PRIMARY KEY,
+                password VARCHAR(255) NOT NULL,
+                is_superuser BOOLEAN DEFAULT FALSE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """))
+
+        # 2. Add username column to scraped_results
+        if inspect(connection).has_table(db.RESULTS_TABLE):
             print("Checking scraped_results columns...")
-            cursor.execute("DESCRIBE scraped_results")
-            columns = [col[0] for col in cursor.fetchall()]
-            
-            if 'username' not in columns:
+            if 'username' not in db.table_columns(connection):
                 print("Adding username column to scraped_results...")
-                cursor.execute("ALTER TABLE scraped_results ADD COLUMN username VARCHAR(255) DEFAULT 'system'")
+                connection.execute(text("ALTER TABLE scraped_results ADD COLUMN username VARCHAR(255) DEFAULT 'system'"))
             else:
                 print("Username column already exists.")
-            
-            # 3. Create default superuser 'jodi'
-            print("Checking if user 'jodi' exists...")
-            cursor.execute("SELECT * FROM users WHERE username = 'jodi'")
-            if not cursor.fetchone():
-                print("Creating superuser 'jodi'...")
-                cursor.execute("INSERT INTO users (username, password, is_superuser) VALUES ('jodi', 'jodi', TRUE)")
-            else:
-                print("User 'jodi' already exists.")
-                
-        connection.commit()
-        print("Migration successful!")
-        
+
+        # 3. Create default superuser 'jodi'
+        print("Checking if user 'jodi' exists...")
+        if not connection.execute(text("SELECT * FROM users WHERE username = 'jodi'")).fetchone():
+            print("Creating superuser 'jodi'...")
+            connection.execute(text("INSERT INTO users (username, password, is_superuser) VALUES ('jodi', 'jodi', TRUE)"))
+        else:
+            print("User 'jodi' already exists.")
+
+
+def _typed_results(engine):
+    """Move scraped_results from to_sql-inferred TEXT columns to the typed, indexed schema.
+
+    TiDB cannot add an AUTO_INCREMENT primary key to an existing table, so
+    rows are copied in chunks into a new table which is then swapped in.
+    The old table is kept as scraped_results_legacy.
+    """
+    staging, legacy = f"{db.RESULTS_TABLE}_new", f"{db.RESULTS_TABLE}_legacy"
+    with engine.begin() as connection:
+        insp = inspect(connection)
+        if not insp.has_table(db.RESULTS_TABLE):
+            print("Creating typed scraped_results table...")
+            db.ensure_results_table(connection)
+            return
+        columns = db.table_columns(connection)
+        if "id" in columns and "place_key" in columns:
+            print("scraped_results already typed.")
+            return
+        # A previous attempt may have died mid-backfill; start that copy over
+        if insp.has_table(staging):
+            connection.execute(text(f"DROP TABLE {staging}"))
+        staging_table = db.build_results_table(MetaData(), staging)
+        staging_table.create(connection)
+        rid = db.row_id_column(connection)
+
+    dropped = [c for c in columns if c not in db.results_table.columns]
+    if dropped:
+        print(f"Columns not in the typed schema are left in {legacy}: {dropped}")
+
+    def copy_after(connection, last, lock=False):
+        """Copy one chunk of rows past `last`; returns (rows copied, new watermark)."""
+        where = f"WHERE {rid} > :last" if last is not None else ""
+        # FOR UPDATE gap-locks the range on InnoDB, so no insert lands between this read and the swap
+        suffix = " FOR UPDATE" if lock and connection.dialect.name != "sqlite" else ""
+        chunk = pd.read_sql(
+            text(f"SELECT {rid} AS _rid, t.* FROM {db.RESULTS_TABLE} t {where} "
+                 f"ORDER BY {rid} LIMIT {BACKFILL_CHUNK_SIZE}{suffix}"),
+            connection, params={"last": last},
+        )
+        if chunk.empty:
+            return 0, last
+        frame = db.prepare_results_frame(chunk.drop(columns=["_rid"]), table=staging_table)
+        return db.insert_frame(connection, frame, table=staging), int(chunk["_rid"].max())
+
+    copied, last = 0, None
+    while True:
+        with engine.begin() as connection:
+            n, last = copy_after(connection, last)
+        if not n:
+            break
+        copied += n
+        print(f"Backfilled {copied} rows...")
+
+    with engine.begin() as connection:
+        # Rows saved while the backfill ran; copied in the swap transaction so none are lost
+        while True:
+            n, last = copy_after(connection, last, lock=True)
+            if not n:
+                break
+            copied += n
+        if connection.dialect.name == "sqlite":
+            connection.execute(text(f"ALTER TABLE {db.RESULTS_TABLE} RENAME TO {legacy}"))
+            connection.execute(text(f"ALTER TABLE {staging} RENAME TO {db.RESULTS_TABLE}"))
+        else:
+            connection.execute(text(f"RENAME TABLE {db.RESULTS_TABLE} TO {legacy}, {staging} TO {db.RESULTS_TABLE}"))
+    print(f"Swapped in typed scraped_results ({copied} rows).")
+
+
+def _results_rollup(engine):
+    print("Building results_rollup from scraped_results...")
+    print(f"{db.rebuild_rollup(engine)} rollup groups.")
+
+
+def _geohash(engine):
+    """Indexed geohash column for radius / bounding-box lookups, backfilled by id."""
+    with engine.begin() as connection:
+        if "geohash" not in db.table_columns(connection):
+            print("Adding geohash column to scraped_results...")
+            connection.execute(text("ALTER TABLE scraped_results ADD COLUMN geohash VARCHAR(12)"))
+        index = next(i for i in db.results_table.indexes if i.name == f"ix_{db.RESULTS_TABLE}_geohash")
+        index.create(connection, checkfirst=True)
+
+    filled, last = 0, 0
+    while True:
+        with engine.connect() as connection:
+            chunk = pd.read_sql(
+                text(f"SELECT id, Latitude, Longitude FROM {db.RESULTS_TABLE} "
+                     "WHERE id > :last AND geohash IS NULL AND Latitude IS NOT NULL AND Longitude IS NOT NULL "
+                     f"ORDER BY id LIMIT {BACKFILL_CHUNK_SIZE}"),
+                connection, params={"last": last},
+            )
+        if chunk.empty:
+            break
+        last = int(chunk["id"].max())
+        hashes = geo.encode_geohash(chunk["Latitude"], chunk["Longitude"])
+        rows = [{"h": h, "id": int(i)} for i, h in zip(chunk["id"], hashes) if h]
+        # A derived column: no change log rows (every analytics copy would re-sync
+        # the table) and no rollup update, since no counted column changes
+        with engine.begin() as connection:
+            for batch in db.chunked(rows, db.BULK_CHUNK_SIZE):
+                connection.execute(text(f"UPDATE {db.RESULTS_TABLE} SET geohash = :h WHERE id = :id"), batch)
+        filled += len(rows)
+        print(f"Geohashed {filled} rows...")
+
+
+def _change_log(engine):
+    with engine.begin() as connection:
+        print("Creating results_changes log...")
+        db.metadata.create_all(connection, tables=[db.changes_table], checkfirst=True)
+
+
+def _search_index(engine):
+    """results_terms inverted index on every database, in place of MySQL FULLTEXT."""
+    print("Building results_terms search index...")
+    print(f"{db.rebuild_search_index(engine)} terms indexed.")
+
+
+MIGRATIONS = [
+    (1, "users table, username column, default superuser", _create_users),
+    (2, "typed and indexed scraped_results with id and place_key", _typed_results),
+    (3, "results_rollup counts per user, region and KBLI division", _results_rollup),
+    (4, "geohash column and index on scraped_results", _geohash),
+    (5, "results_changes log of deleted and updated rows", _change_log),
+    (6, "results_terms search index over names and addresses", _search_index),
+]
+
+
+def _ensure_version_table(engine):
+    with engine.begin() as connection:
+        connection.execute(text("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                description VARCHAR(255),
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """))
+
+
+def applied_versions(engine):
+    _ensure_version_table(engine)
+    with engine.connect() as connection:
+        return {row[0] for row in connection.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def migrate(engine=None):
+    # Same pooled engine (and TLS setup) the app uses, configured from the secrets
+    try:
+        engine = engine or db.get_engine()
     except Exception as e:
-        print(f"Migration failed: {e}")
-    finally:
-        connection.close()
+        print(f"Secrets not found or invalid: {e}")
+        return False
+
+    print(f"Connecting to {engine.url.host or engine.url.database}...")
+    done = applied_versions(engine)
+    for version, description, step in MIGRATIONS:
+        if version in done:
+            continue
+        print(f"Applying migration {version}: {description}")
+        try:
+            step(engine)
+        except Exception as e:
+            print(f"Migration {version} failed: {e}")
+            return False
+        with engine.begin() as connection:
+            connection.execute(
+                text("INSERT INTO schema_migrations (version, description) VALUES (:v, :d)"),
+                {"v": version, "d": description},
+            )
+    print("Migration successful!")
+    return True
+
+
+def status(engine=None):
+    engine = engine or db.get_engine()
+    done = applied_versions(engine)
+    for version, description, _ in MIGRATIONS:
+        print(f"[{'x' if version in done else ' '}] {version:03d} {description}")
+
 
 if __name__ == "__main__":
-    migrate()
+    parser = argparse.ArgumentParser(description="Apply database migrations")
+    parser.add_argument("--status", action="store_true", help="List applied and pending migrations")
+    parser.add_argument("--rebuild-rollup", action="store_true", help="Recompute the dashboard rollup table")
+    parser.add_argument("--rebuild-search", action="store_true", help="Recompute the results_terms search index")
+    args = parser.parse_args()
+
+    if args.status:
+        status()
+    elif args.rebuild_rollup:
+        print(f"Rebuilt results_rollup: {db.rebuild_rollup()} groups.")
+    elif args.rebuild_search:
+        print(f"Rebuilt results_terms: {db.rebuild_search_index()} terms.")
+    else:
+        migrate()
@@ -0,0 +1,133 @@
+"""Typed columns for scraped values, parsed once per batch.
+
+The scraper collects everything as text ("4,5", "1.234", "0812-3456-7890",
+"-6.19"). `normalize_frame` turns a whole batch into typed columns with
+vectorized pandas string operations, so the table, map, exports and the
+database save read floats, integers and ready-made links instead of
+reparsing strings per row on every rerun.
+"""
+import pandas as pd
+
+# Google shows large review counts abbreviated: "1,2 rb", "3.4K", "2 jt"
+COUNT_MULTIPLIERS = {"k": 1_000, "rb": 1_000, "ribu": 1_000, "m": 1_000_000, "jt": 1_000_000, "juta": 1_000_000}
+COUNT_PATTERN = r"(?P<number>\d[\d.,\s  ]*)\s*(?P<suffix>k|rb|ribu|m|jt|juta)?\b"
+
+COUNTRY_CODE = "62"
+# Digits of an E.164 number, country code included
+PHONE_MIN_DIGITS = 10
+PHONE_MAX_DIGITS = 15
+WA_URL = "https://wa.me/"
+
+MAX_RATING = 5.0
+
+
+def _text(series):
+    """Stripped strings with missing values as NaN."""
+    series = pd.Series(series)
+    return series.astype(object).where(series.notna()).astype(str).str.strip().where(series.notna())
+
+
+def parse_decimal(series):
+    """'4,5' / '4.5' / '-6.19' -> float; anything else -> NaN. Numeric input is returned as float."""
+    series = pd.Series(series)
+    if pd.api.types.is_numeric_dtype(series):
+        return series.astype("float64")
+    number = _text(series).str.replace(",", ".", regex=False).str.extract(r"(-?\d+(?:\.\d+)?)", expand=False)
+    return pd.to_numeric(number, errors="coerce").astype("float64")
+
+
+def parse_rating(series):
+    """Star rating as float in [0, 5], else NaN."""
+    rating = parse_decimal(series)
+    return rating.where(rating.between(0, MAX_RATING))
+
+
+def parse_count(series):
+    """Counts with locale separators or abbreviations -> Int64.
+
+    '1,234', '1.234' and '1 234' are 1234; with a suffix the separator is a
+    decimal point, so '1,2 rb' and '1.2K' are 1200.
+    """
+    series = pd.Series(series)
+    if pd.api.types.is_integer_dtype(series):
+        return series.astype("Int64")
+    if pd.api.types.is_float_dtype(series):
+        return series.round().astype("Int64")
+    parts = _text(series).str.lower().str.extract(COUNT_PATTERN)
+    number = parts["number"].str.strip()
+    plain = number.str.replace(r"[^\d]", "", regex=True)
+    scaled = number.str.replace(r"[\s  ]", "", regex=True).str.replace(",", ".", regex=False)
+    multiplier = parts["suffix"].map(COUNT_MULTIPLIERS)
+    has_suffix = multiplier.notna()
+    value = pd.to_numeric(plain, errors="coerce")
+    value[has_suffix] = pd.to_numeric(scaled[has_suffix], errors="coerce") * multiplier[has_suffix]
+    return value.round().astype("Int64")
+
+
+def parse_phone(series):
+    """Phone numbers as E.164 ('+628123456789'). National '0...' and bare '8...' numbers get +62."""
+    digits = _text(series).str.replace(r"\D", "", regex=True)
+    national = digits.str.startswith("0", na=False)
+    bare = digits.str.startswith("8", na=False)
+    international = digits.where(digits.str.startswith(COUNTRY_CODE, na=False))
+    international[national] = COUNTRY_CODE + digits[national].str.slice(1)
+    international[bare] = COUNTRY_CODE + digits[bare]
+    valid = international.str.len().between(PHONE_MIN_DIGITS, PHONE_MAX_DIGITS)
+    return ("+" + international).where(valid)
+
+
+def _chat_links(e164):
+    return (WA_URL + e164.str.slice(1)).where(e164.str.startswith(f"+{COUNTRY_CODE}8", na=False))
+
+
+def whatsapp_links(series):
+    """wa.me links for the mobile numbers (+628...) among raw or E.164 phones."""
+    return _chat_links(parse_phone(series))
+
+
+def format_wa_link(phone):
+    """WhatsApp link for one phone number, or None."""
+    link = whatsapp_links(pd.Series([phone], dtype=object)).iloc[0]
+    return None if pd.isna(link) else link
+
+
+def parse_timestamp(series):
+    """Stored datetimes -> datetime64, missing values -> NaT.
+
+    SQLite hands them back as text, with fractional seconds on some rows
+    only ('2024-05-01 10:00:00' / '2024-05-01 10:00:00.123456'). Each value
+    is parsed as ISO 8601 on its own, and anything else raises instead of
+    silently becoming NaT.
+    """
+    series = pd.Series(series)
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    text = _text(series)
+    return pd.to_datetime(text.where(~text.isin(["", "N/A", "NaT", "None"])), format="ISO8601")
+
+
+def parse_coordinate(series, limit):
+    """Latitude (limit 90) or longitude (limit 180) as float, NaN when unparseable or out of range."""
+    value = parse_decimal(series)
+    return value.where(value.abs() <= limit)
+
+
+def normalize_frame(df):
+    """Copy of a results frame with typed Rating, Reviews, Phone, WhatsApp Link, Latitude and Longitude.
+
+    Phones that can't be written as E.164 keep their scraped text.
+    """
+    out = df.copy()
+    if "Rating" in out.columns:
+        out["Rating"] = parse_rating(out["Rating"])
+    if "Reviews" in out.columns:
+        out["Reviews"] = parse_count(out["Reviews"])
+    if "Phone" in out.columns:
+        phone = parse_phone(out["Phone"])
+        out["WhatsApp Link"] = _chat_links(phone)
+        out["Phone"] = phone.where(phone.notna(), out["Phone"].where(out["Phone"].ne("N/A")))
+    if "Latitude" in out.columns:
+        out["Latitude"] = parse_coordinate(out["Latitude"], 90)
+    if "Longitude" in out.columns:
+        out["Longitude"] = parse_coordinate(out["Longitude"], 180)
+    return out
@@ -1,11 +1,10 @@
 import streamlit as st
 import pandas as pd
-from sqlalchemy import text
-import io
 import time
-import os
-from streamlit_folium import st_folium
-import folium
+import analytics
+import db
+import exports
+import normalize
 
 # --- CUSTOM CSS ---
 st.markdown("""
@@ -53,80 +52,130 @@ st.markdown("""
 st.markdown('<p class="subtitle">Search and manage your collected business data.</p>', unsafe_allow_html=True)
 
 # --- DATABASE CONNECTION ---
-cert_path = "isrgrootx1.pem"
-connect_args = {}
-if os.path.exists(cert_path):
-    connect_args = {"ssl": {"ca": os.path.abspath(cert_path)}}
-
 try:
-    conn = st.connection('tidb', type='sql', connect_args=connect_args)
+    legacy_table = db.needs_migration()
 except Exception as e:
     st.error(f"Gagal menghubungkan ke database: {e}")
     st.stop()
+if legacy_table:
+    # Paging, delta refresh and deletes all address rows by id
+    st.error("❌ Tabel scraped_results belum dimigrasi ke skema baru. Jalankan `python migrate.py` terlebih dahulu.")
+    st.stop()
+
+# Cached query results are keyed by the data version, so they never go stale
+# and nothing has to be cleared after a save, delete or dedup
+CACHE_TTL_SECONDS = 600
+
+SEARCH_RESULT_COLUMNS = ["Name", "Address", "Kelurahan", "Kabupaten", "KBLI", "Nama Resmi KBLI", "URL"]
 
 # --- HELPER FUNCTIONS ---
-@st.cache_data(ttl=0)
-def fetch_db_data(username, is_superuser):
+def scope_user():
+    """Superusers see every workspace, everyone else only their own rows."""
+    return None if st.session_state.get('is_superuser', False) else st.session_state.get('username')
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS)
+def fetch_db_page(username, filters, columns, sort, descending, after, version, snapshot=None):
+    # `snapshot` (the local store's sync watermark) routes the query to the local DuckDB copy
     try:
-        query = "SELECT * FROM scraped_results"
-        params = {}
-        if not is_superuser:
-            query += " WHERE username = :user"
-            params['user'] = username
-        return conn.query(query, params=params, ttl=0)
+        fetch = analytics.AnalyticsStore().fetch_page if snapshot else db.fetch_results_page
+        return fetch(username=username, filters=filters, columns=columns,
+                     sort=sort, descending=descending, after=after)
     except Exception as e:
         st.warning(f"Error fetching data: {e}")
+        return None, None
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS)
+def fetch_summary(username, filters, version, snapshot=None):
+    if snapshot:
+        return analytics.AnalyticsStore().summarize(username=username, filters=filters)
+    return db.summarize_results(username=username, filters=filters)
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS)
+def fetch_breakdown(dimension, username, filters, version, snapshot=None):
+    if snapshot:
+        return analytics.AnalyticsStore().breakdown(dimension, username=username, filters=filters)
+    return db.breakdown_results(dimension, username=username, filters=filters)
+
+def local_snapshot_panel():
+    """Toggle + staleness line for the local analytical copy. Returns its sync version or None."""
+    if not (st.session_state.get('is_superuser') and analytics.available()):
+        return None
+    store = analytics.AnalyticsStore()
+    l1, l2 = st.columns([3, 1])
+    with l1:
+        use_local = st.toggle("⚡ Analitik lokal (DuckDB)", value=st.session_state.get('use_local_analytics', False),
+                              help="Filter, metrik dan tabel dibaca dari salinan Parquet lokal, bukan dari TiDB.")
+        st.session_state.use_local_analytics = use_local
+    if not use_local:
         return None
+    state = store.state()
+    with l2:
+        sync_now = st.button("🔄 Sinkronkan", use_container_width=True)
+    if sync_now or state["synced_at"] is None:
+        with st.spinner("Menyinkronkan salinan lokal..."):
+            store.sync()
+        state = store.state()
+    age = store.age_seconds()
+    stale = "⚠️ perlu sinkron" if store.is_stale() else "✅ terkini"
+    with l1:
+        st.caption(f"Salinan lokal: {state['rows']:,} baris s.d. perubahan #{state['change_seq']:,}, "
+                   f"disinkronkan {age / 60:.0f} menit lalu · {stale}")
+    return state["change_seq"], state["rows"], state["synced_at"]
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS)
+def fetch_search(query, username, filters, page, version):
+    try:
+        return db.search_results(query, username=username, filters=filters, columns=SEARCH_RESULT_COLUMNS,
+                                 offset=page * db.SEARCH_PAGE_SIZE)
+    except Exception as e:
+        st.warning(f"Error searching: {e}")
+        return pd.DataFrame(), 0
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS)
+def fetch_map_extent(username, filters, version):
+    return db.fetch_map_extent(username=username, filters=filters)
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS)
+def fetch_map_points(username, filters, bbox, version):
+    return db.fetch_map_points(username=username, filters=filters, bbox=bbox)
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS)
+def fetch_options(column, username, version, filters=None):
+    try:
+        return db.distinct_values(column, username=username, filters=filters)
+    except Exception:
+        return []
+
+@st.cache_data(ttl=3600, max_entries=4, show_spinner=False)
+def build_export(fmt, username, filters, columns, version):
+    """Export file for the filtered rows. `version` only keys the cache to the data."""
+    return exports.export_bytes(fmt, db.iter_results(username=username, filters=filters, columns=columns),
+                                table=db.results_table)
 
 def delete_records(values, column_name="id"):
     try:
-        with conn.session as session:
-            for val in values:
-                query_str = f"DELETE FROM scraped_results WHERE `{column_name}` = :val"
-                params = {"val": val}
-                
-                if not st.session_state.get('is_superuser', False):
-                    query_str += " AND username = :user"
-                    params["user"] = st.session_state.get('username')
-                
-                session.execute(text(query_str), params)
-            session.commit()
-        st.cache_data.clear()
+        db.delete_results(values, column=column_name, username=scope_user())
         return True
     except Exception as e:
         st.error(f"Error deleting: {e}")
         return False
 
-def deduplicate_db(df):
-    if df is None or df.empty: return True
+def deduplicate_db():
+    """Remove duplicate rows in the database, keeping the newest per place. Returns rows removed or None."""
     try:
-        df_unique = df.sort_values('scraped_at', ascending=False).drop_duplicates(
-            subset=['Name', 'Latitude', 'Longitude'], keep='first'
-        )
-        if 'Select' in df_unique.columns:
-            df_unique = df_unique.drop(columns=['Select'])
-        with conn.session as session:
-            if st.session_state.get('is_superuser', False):
-                session.execute(text("DELETE FROM scraped_results"))
-            else:
-                session.execute(text("DELETE FROM scraped_results WHERE username = :user"), 
-                                {"user": st.session_state.get('username')})
-            session.commit()
-        df_unique.to_sql('scraped_results', con=conn.engine, if_exists='append', index=False)
-        st.cache_data.clear()
-        return True
+        removed = db.deduplicate_results(username=scope_user())
+        return removed
     except Exception as e:
         st.error(f"Error: {e}")
-        return False
+        return None
 
-def format_wa_link(phone):
-    if pd.isna(phone): return None
-    clean_phone = "".join(filter(str.isdigit, str(phone)))
-    if not clean_phone: return None
-    if clean_phone.startswith('08'): return f"https://wa.me/62{clean_phone[1:]}"
-    elif clean_phone.startswith('62'): return f"https://wa.me/{clean_phone}"
-    elif clean_phone.startswith('8'): return f"https://wa.me/62{clean_phone}"
-    return None
+def find_near_duplicates():
+    """Near-duplicate suggestions in the user's scope, or None on error."""
+    try:
+        return db.find_near_duplicates(username=scope_user())
+    except Exception as e:
+        st.error(f"Error: {e}")
+        return None
 
 # --- DIALOGS (POPUP) ---
 
@@ -202,7 +251,6 @@ def confirm_delete_dialog(selected_values, target_col):
             
             if delete_records(selected_values, column_name=target_col):
                 progress_bar.progress(100, text="Selesai!")
-                st.session_state.refresh_needed = True
                 st.success("Berhasil dihapus!")
                 time.sleep(0.5)
                 st.rerun()
@@ -212,25 +260,159 @@ def confirm_delete_dialog(selected_values, target_col):
         if st.button("Batal", use_container_width=True):
             st.rerun()
 
+@st.dialog("Duplikat Mirip", width="large")
+def near_duplicates_dialog():
+    """Usaha yang sama dengan titik atau ejaan nama sedikit berbeda; baris terbaru dipertahankan."""
+    # Computed once when the dialog opens: confirming deletes exactly the rows shown, not a fresh search
+    if 'near_duplicates' not in st.session_state:
+        with st.spinner("Mencari duplikat mirip..."):
+            st.session_state.near_duplicates = find_near_duplicates()
+    suggestions = st.session_state.near_duplicates
+    if suggestions is None:
+        del st.session_state.near_duplicates
+        return
+    if suggestions.empty:
+        st.success("Tidak ada duplikat mirip.")
+        return
+    st.warning(f"⚠️ Ditemukan **{len(suggestions):,}** baris yang tampaknya usaha yang sama dengan baris lain.")
+    st.dataframe(suggestions.rename(columns={
+        "keep_name": "Dipertahankan", "drop_name": "Dihapus", "distance_m": "Jarak (m)", "similarity": "Kemiripan",
+    }), hide_index=True, use_container_width=True)
+
+    col_yes, col_no = st.columns(2)
+    with col_yes:
+        if st.button("Ya, Gabungkan", type="primary", use_container_width=True):
+            if delete_records(suggestions["drop_id"].astype(int).tolist(), column_name="id"):
+                del st.session_state.near_duplicates
+                st.success(f"Selesai! {len(suggestions):,} duplikat mirip dihapus.")
+                time.sleep(1)
+                st.rerun()
+    with col_no:
+        if st.button("Batal", use_container_width=True):
+            del st.session_state.near_duplicates
+            st.rerun()
+
 # --- MAIN APP LOGIC ---
 
 if 'username' not in st.session_state: st.session_state.username = 'demo_user' 
 if 'is_superuser' not in st.session_state: st.session_state.is_superuser = False
 if 'refresh_needed' not in st.session_state: st.session_state.refresh_needed = False
+if 'page_cursors' not in st.session_state: st.session_state.page_cursors = [None]
 
-# Load Data
-if 'df_db_v5' not in st.session_state or st.session_state.refresh_needed:
-    raw_data = fetch_db_data(st.session_state.username, st.session_state.is_superuser)
-    if raw_data is not None and not raw_data.empty:
-        df_init = raw_data.copy()
-        if "Select" not in df_init.columns:
-            df_init.insert(0, "Select", False)
-        else:
-            df_init["Select"] = False
-        st.session_state.df_db_v5 = df_init
+user = scope_user()
+try:
+    version = db.change_version(user)
+except Exception as e:
+    st.error(f"Gagal membaca data: {e}")
+    st.stop()
+
+# Filters (applied by the database, not pandas)
+SORT_LABELS = {"scraped_at": "Waktu Scrape", "Name": "Nama", "Rating": "Rating", "Reviews": "Ulasan", "id": "Urutan Simpan"}
+snapshot = local_snapshot_panel()
+search_query = st.text_input("🔍 Cari Usaha", placeholder="Nama, alamat, jalan, kelurahan atau nama KBLI",
+                             label_visibility="collapsed").strip()
+with st.expander("🔎 Filter & Urutan", expanded=False):
+    f1, f2, f3 = st.columns(3)
+    with f1:
+        provinsi = st.selectbox("Provinsi", ["Semua"] + fetch_options("Provinsi", user, version))
+        provinsi = None if provinsi == "Semua" else provinsi
+    with f2:
+        kab_options = fetch_options("Kabupaten", user, version, {"provinsi": provinsi})
+        kabupaten = st.selectbox("Kota/Kab", ["Semua"] + kab_options)
+        kabupaten = None if kabupaten == "Semua" else kabupaten
+    with f3:
+        kbli_prefix = st.text_input("Awalan KBLI", placeholder="mis. 47 atau 5610").strip()
+    f4, f5, f6 = st.columns(3)
+    with f4:
+        rating_range = st.slider("Rating", 0.0, 5.0, (0.0, 5.0), step=0.1)
+    with f5:
+        date_range = st.date_input("Tanggal Scrape", value=())
+    with f6:
+        sort = st.selectbox("Urutkan", list(SORT_LABELS), format_func=SORT_LABELS.get)
+        descending = st.toggle("Terbaru/terbesar dulu", value=True)
+    columns = st.multiselect("Kolom", db.RESULTS_COLUMNS, placeholder="Semua kolom")
+
+filters = {
+    "provinsi": provinsi,
+    "kabupaten": kabupaten,
+    "kbli_prefix": kbli_prefix if kbli_prefix.isdigit() else None,
+    "rating_min": rating_range[0] if rating_range[0] > 0 else None,
+    "rating_max": rating_range[1] if rating_range[1] < 5 else None,
+    "date_from": date_range[0] if len(date_range) > 0 else None,
+    "date_to": date_range[-1] if len(date_range) > 0 else None,
+}
+view = (user, tuple(sorted(filters.items())), tuple(columns), sort, descending, snapshot)
+
+# Any change of filter, sort or projection starts again at page 1
+if st.session_state.get('explorer_view') != view:
+    st.session_state.explorer_view = view
+    st.session_state.page_cursors = [None]
+    st.session_state.refresh_needed = True
+
+# Local snapshot queries are versioned by the snapshot itself
+data_version = snapshot or version
+
+# Full-text search (index-backed, ranked), within the current filters
+if search_query:
+    search_key = (search_query, view)
+    if st.session_state.get('search_key') != search_key:
+        st.session_state.search_key = search_key
+        st.session_state.search_page = 0
+    search_page = st.session_state.search_page
+    hits, hit_count = fetch_search(search_query, user, filters, search_page, version)
+    st.markdown(f"#### 🔍 Hasil Pencarian · {hit_count:,} usaha")
+    if hits.empty:
+        st.info("Tidak ada usaha yang cocok dengan pencarian.")
+    else:
+        st.dataframe(hits.drop(columns=["id", "score"]),
+                     column_config={"URL": st.column_config.LinkColumn("Maps")},
+                     hide_index=True, use_container_width=True)
+        last_page = (hit_count - 1) // db.SEARCH_PAGE_SIZE
+        s_prev, s_info, s_next = st.columns([1, 2, 1])
+        with s_prev:
+            if st.button("◀", key="search_prev", disabled=search_page == 0, use_container_width=True):
+                st.session_state.search_page -= 1
+                st.rerun()
+        with s_info:
+            st.caption(f"Halaman {search_page + 1} dari {last_page + 1}")
+        with s_next:
+            if st.button("▶", key="search_next", disabled=search_page >= last_page, use_container_width=True):
+                st.session_state.search_page += 1
+                st.rerun()
+    st.markdown("---")
+
+def store_page(frame, next_cursor):
+    if frame is not None and not frame.empty:
+        frame = frame.drop(columns=["Select"], errors="ignore")
+        frame.insert(0, "Select", False)
+        st.session_state.df_db_v5 = frame
     else:
         st.session_state.df_db_v5 = pd.DataFrame()
+    st.session_state.next_cursor = next_cursor
+    st.session_state.page_version = data_version
+
+# Load the current page only
+if 'df_db_v5' not in st.session_state or st.session_state.refresh_needed:
+    raw_data, next_cursor = fetch_db_page(user, filters, columns or None, sort, descending,
+                                          st.session_state.page_cursors[-1], data_version, snapshot)
+    store_page(raw_data, next_cursor)
     st.session_state.refresh_needed = False
+elif st.session_state.get('page_version') != data_version:
+    # Rows were saved, deleted or updated since the page was read: fetch only those changes
+    if snapshot or st.session_state.df_db_v5.empty:
+        raw_data, next_cursor = fetch_db_page(user, filters, columns or None, sort, descending,
+                                              st.session_state.page_cursors[-1], data_version, snapshot)
+    else:
+        try:
+            raw_data, next_cursor = db.refresh_page(
+                st.session_state.df_db_v5.drop(columns=["Select"]), st.session_state.page_version,
+                after=st.session_state.page_cursors[-1], has_next=st.session_state.next_cursor is not None,
+                username=user, filters=filters, columns=columns or None, sort=sort, descending=descending,
+            )
+        except Exception as e:
+            st.warning(f"Error fetching data: {e}")
+            raw_data, next_cursor = None, None
+    store_page(raw_data, next_cursor)
 
 df_db = st.session_state.df_db_v5
 
@@ -243,24 +425,28 @@ if not df_db.empty:
     </div>
     """, unsafe_allow_html=True)
     
-    # 2. Metrics
+    # 2. Metrics (over all filtered rows, not just this page)
+    summary = fetch_summary(user, filters, data_version, snapshot)
     m1, m2, m3, m4 = st.columns(4)
-    m1.metric("Total Data", f"{len(df_db):,}")
-    m2.metric("Kota/Kab", df_db['Kabupaten'].nunique() if 'Kabupaten' in df_db.columns else 0)
-    m3.metric("Provinsi", df_db['Provinsi'].nunique() if 'Provinsi' in df_db.columns else 0)
-    kbli_count = df_db['KBLI'].astype(str).str[:2].nunique() if 'KBLI' in df_db.columns else 0
-    m4.metric("Kategori (KBLI)", kbli_count)
+    m1.metric("Total Data", f"{summary['total']:,}")
+    m2.metric("Kota/Kab", summary['kabupaten'])
+    m3.metric("Provinsi", summary['provinsi'])
+    m4.metric("Kategori (KBLI)", summary['kbli'])
+
+    with st.expander("📈 Rincian", expanded=False):
+        tab_kab, tab_prov, tab_kbli = st.tabs(["Kota/Kab", "Provinsi", "Kategori (KBLI)"])
+        for tab, dimension in ((tab_kab, "kabupaten"), (tab_prov, "provinsi"), (tab_kbli, "kbli")):
+            with tab:
+                breakdown = fetch_breakdown(dimension, user, filters, data_version, snapshot)
+                if breakdown.empty:
+                    st.caption("Belum ada data.")
+                else:
+                    st.bar_chart(breakdown.set_index(dimension)["total"], horizontal=True)
 
     st.write("") 
 
-    # 3. Table Editor
-    
+    # 3. Table Editor (current page)
     target_delete_col = "id"
-    if "id" not in df_db.columns:
-        if "URL" in df_db.columns:
-            target_delete_col = "URL"
-        elif "Name" in df_db.columns:
-            target_delete_col = "Name"
 
     config = {
         "Select": st.column_config.CheckboxColumn("✅", width="small", default=False),
@@ -270,14 +456,7 @@ if not df_db.empty:
         "Rating": st.column_config.NumberColumn("⭐", format="%.1f"),
     }
     
-    all_cols = df_db.columns.tolist()
-    if "Select" in all_cols:
-        all_cols.remove("Select")
-        all_cols.insert(0, "Select")
-    
-    display_cols = all_cols.copy()
-    if target_delete_col == "id" and "id" in display_cols:
-        display_cols.remove("id")
+    display_cols = [c for c in df_db.columns if c not in ("id", "place_key")]
     
     edited_df = st.data_editor(
         df_db,
@@ -290,15 +469,26 @@ if not df_db.empty:
         key="main_editor_fixed_v4"
     )
 
+    # Pagination
+    page_no = len(st.session_state.page_cursors)
+    p_prev, p_info, p_next = st.columns([1, 2, 1])
+    with p_prev:
+        if st.button("◀ Sebelumnya", disabled=page_no == 1, use_container_width=True):
+            st.session_state.page_cursors.pop()
+            st.session_state.refresh_needed = True
+            st.rerun()
+    with p_info:
+        first = (page_no - 1) * db.PAGE_SIZE + 1
+        st.caption(f"Halaman {page_no} · baris {first:,}–{first + len(df_db) - 1:,} dari {summary['total']:,}")
+    with p_next:
+        if st.button("Berikutnya ▶", disabled=st.session_state.next_cursor is None, use_container_width=True):
+            st.session_state.page_cursors.append(st.session_state.next_cursor)
+            st.session_state.refresh_needed = True
+            st.rerun()
+
     st.write("") 
 
     # 4. Action Buttons (4 Kolom)
-    excel_buffer = io.BytesIO()
-    with pd.ExcelWriter(excel_buffer, engine='openpyxl') as wr:
-        output_df = edited_df.drop(columns=['Select']) if 'Select' in edited_df.columns else edited_df
-        output_df.to_excel(wr, index=False)
-    excel_data = excel_buffer.getvalue()
-
     c_act1, c_act2, c_act3, c_act4 = st.columns(4)
 
     # TOMBOL DETAIL
@@ -330,74 +520,85 @@ if not df_db.empty:
     with c_act3:
         if st.button("♻️ Hapus Duplikat", use_container_width=True):
             with st.spinner("Membersihkan duplikat..."):
-                if deduplicate_db(df_db):
-                    st.session_state.refresh_needed = True
-                    st.success("Selesai!")
+                removed = deduplicate_db()
+                if removed is not None:
+                    st.success(f"Selesai! {removed:,} duplikat dihapus.")
                     time.sleep(1)
                     st.rerun()
+        if st.button("🔍 Duplikat Mirip", use_container_width=True):
+            # Suggestions left over from a dialog closed with its X are stale
+            st.session_state.pop('near_duplicates', None)
+            near_duplicates_dialog()
 
-    # TOMBOL EXPORT
+    # TOMBOL EXPORT (built only on request, streamed from the database, cached per data version)
     with c_act4:
-        st.download_button(
-            label="📥 Export Excel",
-            data=excel_data,
-            file_name=f"data_export_{int(time.time())}.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            use_container_width=True
-        )
+        with st.popover("📥 Export", use_container_width=True):
+            fmt = st.radio("Format", exports.available_formats(), horizontal=True,
+                           format_func=lambda f: exports.EXPORT_FORMATS[f][0])
+            export_key = (fmt, view, version)
+            export = st.session_state.get('export_file')
+            if not (export and export[0] == export_key) and st.button("📦 Siapkan File", use_container_width=True):
+                with st.spinner("Menyiapkan file..."):
+                    export = (export_key, build_export(fmt, user, filters, columns or None, export_key[2]))
+                st.session_state.export_file = export
+            if export and export[0] == export_key:
+                st.download_button(
+                    label=f"⬇️ Unduh {exports.EXPORT_FORMATS[fmt][0]}",
+                    data=export[1],
+                    file_name=exports.export_file_name("data_export", fmt),
+                    mime=exports.EXPORT_FORMATS[fmt][2],
+                    use_container_width=True
+                )
 
     st.markdown("---")
 
-    # 5. Map Section
+    # 5. Nearby lookup (geohash index, exact distance checked in numpy)
+    with st.expander("📍 Cari Sekitar Lokasi", expanded=False):
+        with st.form("nearby_form", border=False):
+            n1, n2, n3 = st.columns(3)
+            near_lat = n1.number_input("Latitude", value=-6.2, format="%.6f", min_value=-90.0, max_value=90.0)
+            near_lng = n2.number_input("Longitude", value=106.816666, format="%.6f", min_value=-180.0, max_value=180.0)
+            radius_km = n3.number_input("Radius (km)", value=2.0, min_value=0.1, max_value=50.0, step=0.5)
+            searched = st.form_submit_button("Cari", use_container_width=True)
+        if searched:
+            nearby = db.fetch_nearby(near_lat, near_lng, radius_km * 1000, username=user, filters=filters,
+                                     columns=["Name", "Address", "Kabupaten", "KBLI", "URL"])
+            st.caption(f"{len(nearby):,} tempat dalam radius {radius_km:g} km.")
+            st.dataframe(nearby.drop(columns=["id"]),
+                         column_config={"URL": st.column_config.LinkColumn("Maps"),
+                                        "distance_m": st.column_config.NumberColumn("Jarak (m)", format="%.0f")},
+                         hide_index=True, use_container_width=True)
+
+    # 6. Map Section (all filtered rows, only those inside the current viewport are sent)
     st.markdown("### 🗺️ Peta Sebaran")
-    map_df = df_db.copy()
-    map_df['lat'] = pd.to_numeric(map_df['Latitude'], errors='coerce')
-    map_df['lng'] = pd.to_numeric(map_df['Longitude'], errors='coerce')
-    map_df = map_df.dropna(subset=['lat', 'lng'])
-
-    if not map_df.empty:
-        avg_lat = map_df['lat'].mean()
-        avg_lng = map_df['lng'].mean()
-        m = folium.Map(location=[avg_lat, avg_lng], zoom_start=10, tiles='CartoDB positron')
-        
-        from folium.plugins import MarkerCluster
-        marker_cluster = MarkerCluster().add_to(m)
-
-        for _, row in map_df.iterrows():
-            name = row.get('Name', 'Tanpa Nama')
-            alamat = row.get('Address', row.get('Alamat', '-'))
-            if pd.isna(alamat): alamat = "-"
-            
-            wa_link = row.get('WhatsApp Link')
-            if pd.isna(wa_link): 
-                wa_link = format_wa_link(row.get('Phone', ''))
-            
-            gmap_link = row.get('URL', '')
-
-            # Tombol HTML
-            wa_btn = ""
-            if wa_link:
-                wa_btn = f'<a href="{wa_link}" target="_blank" style="display:inline-block; margin-top:5px; text-decoration:none; color:white; background:#25D366; padding:4px 8px; border-radius:4px; font-size:0.8em;">💬 WhatsApp</a>'
-            
-            map_btn = ""
-            if gmap_link:
-                 map_btn = f'<a href="{gmap_link}" target="_blank" style="display:inline-block; margin-top:5px; margin-left:5px; text-decoration:none; color:white; background:#4285F4; padding:4px 8px; border-radius:4px; font-size:0.8em;">📍 G-Maps</a>'
-
-            popup_content = f"""
-            <div style="font-family:sans-serif; min-width:200px;">
-                <b style="font-size:1.1em; color:#333;">{name}</b><br>
-                <div style="color:#666; font-size:0.85em; margin: 4px 0 8px 0; line-height:1.2;">{alamat}</div>
-                <div>{wa_btn} {map_btn}</div>
-            </div>
-            """
-            
-            folium.Marker(
-                [row['lat'], row['lng']],
-                popup=folium.Popup(popup_content, max_width=300),
-                icon=folium.Icon(color="blue", icon="info-sign")
-            ).add_to(marker_cluster)
-            
-        st_folium(m, width="100%", height=500, returned_objects=[])
-
+    extent = fetch_map_extent(user, filters, version)
+    if extent:
+        # folium is only imported once there is something to map
+        import maps
+        from streamlit_folium import st_folium
+        map_key = f"explorer_map_{abs(hash(st.session_state.explorer_view))}"
+        bbox = maps.viewport_bbox(st.session_state.get(map_key)) or extent
+        points, in_view = fetch_map_points(user, filters, bbox, version)
+        map_state = st_folium(
+            maps.base_map(extent),
+            feature_group_to_add=maps.point_layer(maps.coordinate_frame(points)),
+            width="100%", height=maps.MAP_HEIGHT,
+            returned_objects=["bounds", "last_active_drawing"],
+            key=map_key,
+        )
+        if in_view > len(points):
+            st.caption(f"Menampilkan {len(points):,} dari {in_view:,} lokasi di area ini. Perbesar peta untuk melihat semuanya.")
+
+        # Popup content is fetched only for the clicked point
+        clicked = maps.clicked_id(map_state)
+        if clicked is not None:
+            place = db.fetch_result(clicked, username=user)
+            if place:
+                wa_link = place.get('WhatsApp Link') or normalize.format_wa_link(place.get('Phone'))
+                st.markdown(maps.detail_html(place.get('Name'), place.get('Address'), wa_link, place.get('URL')),
+                            unsafe_allow_html=True)
+
+elif st.session_state.page_cursors != [None] or any(v is not None for v in filters.values()):
+    st.info("Tidak ada data yang cocok dengan filter.")
 else:
     st.info("Belum ada data yang tersimpan.")
\ No newline at end of file
@@ -1,8 +1,7 @@
 import streamlit as st
 import pandas as pd
-from sqlalchemy import text
-import os
 import time
+import db
 
 # --- ACCESS CONTROL ---
 if not st.session_state.get('is_superuser', False):
@@ -12,24 +11,18 @@ if not st.session_state.get('is_superuser', False):
 # Admin UI Layout
 
 # Connection Fix
-cert_path = os.path.abspath("isrgrootx1.pem")
 try:
-    conn = st.connection('tidb', type='sql', connect_args={"ssl": {"ca": cert_path}})
+    db.get_engine()
 except Exception as e:
     st.error(f"Database error: {e}")
     st.stop()
 
 def get_users():
-    return conn.query("SELECT username, is_superuser, created_at FROM users", ttl=0)
+    return db.list_users()
 
 def add_user(u, p, is_admin):
     try:
-        with conn.session as session:
-            session.execute(
-                text("INSERT INTO users (username, password, is_superuser) VALUES (:u, :p, :is_a)"),
-                {"u": u, "p": p, "is_a": is_admin}
-            )
-            session.commit()
+        db.add_user(u, p, is_admin)
         return True
     except Exception as e:
         st.error(f"Error adding user: {e}")
@@ -40,9 +33,7 @@ def delete_user(u):
         st.error("You cannot delete yourself!")
         return False
     try:
-        with conn.session as session:
-            session.execute(text("DELETE FROM users WHERE username = :u"), {"u": u})
-            session.commit()
+        db.delete_user(u)
         return True
     except Exception as e:
         st.error(f"Error deleting user: {e}")
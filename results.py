@@ -0,0 +1,237 @@
+"""Compact storage for scrape results.
+
+ResultBuffer keeps records column-wise, one list per field, instead of one
+dict per record. Short strings are interned, so repeated values like "N/A"
+or a province name are stored once. Past `spill_rows` records in memory
+the rows move to a temporary SQLite file, so memory stays bounded however
+large the job is.
+
+It still behaves like the list of dicts callers used before: len(),
+indexing, slicing, iteration and append() work. The dicts it hands out
+write item assignment and update() back to the buffer. A field is present
+in a record when its value is not None.
+"""
+import os
+import sys
+import sqlite3
+import tempfile
+import threading
+
+import pandas as pd
+
+# Records kept in memory before they are moved to disk
+SPILL_ROWS = int(os.environ.get("RESULTS_SPILL_ROWS", 5000))
+
+# Rows read from disk per query while iterating
+READ_CHUNK_ROWS = 1000
+
+# Strings up to this length are interned
+INTERN_MAX_LENGTH = 64
+
+
+def _compact(value):
+    if isinstance(value, str) and len(value) <= INTERN_MAX_LENGTH:
+        return sys.intern(value)
+    return value
+
+
+def _storable(value):
+    """Value SQLite can hold as-is; anything else is stored as text."""
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    return str(value)
+
+
+class Record(dict):
+    """One result row. Item assignment, update(), setdefault() and pop() write back to the buffer."""
+
+    __slots__ = ("_buffer", "_index")
+
+    def __init__(self, buffer, index, values):
+        super().__init__(values)
+        self._buffer = buffer
+        self._index = index
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._buffer.set(self._index, {key: value})
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._buffer.set(self._index, {key: None})
+
+    def update(self, *args, **kwargs):
+        changes = dict(*args, **kwargs)
+        super().update(changes)
+        self._buffer.set(self._index, changes)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *default):
+        had = key in self
+        value = super().pop(key, *default)
+        if had:
+            self._buffer.set(self._index, {key: None})
+        return value
+
+
+class ResultBuffer:
+    """List-like, column-wise store of result records that spills to a temporary SQLite file."""
+
+    def __init__(self, records=None, spill_rows=SPILL_ROWS, directory=None):
+        self.spill_rows = spill_rows
+        self.directory = directory
+        self.columns = []
+        self._memory = {}
+        self._memory_rows = 0
+        self._spilled = 0
+        self._db = None
+        self._path = None
+        self._lock = threading.RLock()
+        if records:
+            self.extend(records)
+
+    # --- list protocol ---
+
+    def __len__(self):
+        return self._spilled + self._memory_rows
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __repr__(self):
+        return f"<ResultBuffer {len(self)} records, {self._spilled} on disk>"
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("ResultBuffer index out of range")
+        return Record(self, index, self._row(index))
+
+    def __iter__(self):
+        for start in range(0, self._spilled, READ_CHUNK_ROWS):
+            for index, values in self._disk_rows(start, min(start + READ_CHUNK_ROWS, self._spilled)):
+                yield Record(self, index, values)
+        index = self._spilled
+        while index < len(self):
+            yield self[index]
+            index += 1
+
+    def append(self, record):
+        with self._lock:
+            for key in record:
+                if key not in self._memory:
+                    self._add_column(key)
+            for column in self.columns:
+                self._memory[column].append(_compact(record.get(column)))
+            self._memory_rows += 1
+            if self._memory_rows >= self.spill_rows:
+                self._spill()
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+
+    def clear(self):
+        self.close()
+        self.columns, self._memory, self._memory_rows, self._spilled = [], {}, 0, 0
+
+    # --- storage ---
+
+    def _add_column(self, name):
+        self.columns.append(name)
+        self._memory[name] = [None] * self._memory_rows
+        if self._db is not None:
+            self._db.execute(f'ALTER TABLE records ADD COLUMN "{name}"')
+
+    def _connect(self):
+        fd, self._path = tempfile.mkstemp(prefix="sbrgo-results-", suffix=".sqlite", dir=self.directory)
+        os.close(fd)
+        self._db = sqlite3.connect(self._path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode = OFF")
+        self._db.execute("PRAGMA synchronous = OFF")
+        columns = "".join(f', "{c}"' for c in self.columns)
+        self._db.execute(f"CREATE TABLE records (idx INTEGER PRIMARY KEY{columns})")
+
+    def _spill(self):
+        """Move the in-memory rows to disk."""
+        if self._db is None:
+            self._connect()
+        names = ", ".join(f'"{c}"' for c in self.columns)
+        marks = ", ".join("?" for _ in range(len(self.columns) + 1))
+        rows = zip(range(self._spilled, self._spilled + self._memory_rows),
+                   *([_storable(v) for v in self._memory[c]] for c in self.columns))
+        self._db.executemany(f"INSERT INTO records (idx, {names}) VALUES ({marks})", rows)
+        self._db.commit()
+        self._spilled += self._memory_rows
+        self._memory = {c: [] for c in self.columns}
+        self._memory_rows = 0
+
+    def _disk_rows(self, start, stop):
+        names = ", ".join(f'"{c}"' for c in self.columns)
+        with self._lock:
+            rows = self._db.execute(f"SELECT idx, {names} FROM records WHERE idx >= ? AND idx < ? ORDER BY idx",
+                                    (start, stop)).fetchall()
+        for row in rows:
+            yield row[0], {c: v for c, v in zip(self.columns, row[1:]) if v is not None}
+
+    def _row(self, index):
+        if index >= self._spilled:
+            i = index - self._spilled
+            return {c: values[i] for c, values in self._memory.items() if values[i] is not None}
+        return next(self._disk_rows(index, index + 1))[1]
+
+    def set(self, index, changes):
+        """Write `changes` ({field: value}) into record `index`."""
+        with self._lock:
+            for key in changes:
+                if key not in self._memory:
+                    self._add_column(key)
+            if index >= self._spilled:
+                for key, value in changes.items():
+                    self._memory[key][index - self._spilled] = _compact(value)
+            else:
+                assignments = ", ".join(f'"{k}" = ?' for k in changes)
+                self._db.execute(f"UPDATE records SET {assignments} WHERE idx = ?",
+                                 [_storable(v) for v in changes.values()] + [index])
+
+    # --- frames ---
+
+    def iter_frames(self, chunksize=READ_CHUNK_ROWS * 10):
+        """Yield the records as DataFrames of at most `chunksize` rows, in order."""
+        if self._spilled:
+            names = ", ".join(f'"{c}"' for c in self.columns)
+            with self._lock:
+                self._db.commit()
+                for chunk in pd.read_sql(f"SELECT {names} FROM records ORDER BY idx", self._db, chunksize=chunksize):
+                    yield chunk
+        if self._memory_rows:
+            yield pd.DataFrame(self._memory, columns=self.columns)
+
+    def to_frame(self):
+        """All records as one DataFrame."""
+        frames = list(self.iter_frames())
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+    def close(self):
+        """Drop the disk file, if any."""
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+        if self._path and os.path.exists(self._path):
+            os.remove(self._path)
+        self._path = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
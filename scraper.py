@@ -1,29 +1,170 @@
+import os
 import re
 import math
 import argparse
-from playwright.sync_api import sync_playwright
+from collections import deque
+from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
 import pandas as pd
 import time
 import json
+import threading
 import requests
-from openai import OpenAI
+from openai import APIConnectionError, InternalServerError, OpenAI, RateLimitError
+from kbli import classify_records, lookup_kbli, KBLIClassifier, KBLI_LOCAL_THRESHOLD
+import browser
+import concurrency
+import dedup
+import gazetteer
+import metrics
+import normalize
+from results import ResultBuffer
+
+# Endpoints, overridable so the offline benchmark (bench/) can point them at local mocks.
+# The OpenAI client reads OPENAI_BASE_URL itself.
+MAPS_URL = os.environ.get("MAPS_URL", "https://www.google.com/maps")
+PUBLIC_NOMINATIM_URL = "https://nominatim.openstreetmap.org"
+NOMINATIM_URL = os.environ.get("NOMINATIM_URL", PUBLIC_NOMINATIM_URL)
+
+# Seconds between Nominatim calls (their usage policy allows one per second)
+NOMINATIM_DELAY_S = 1.0
+
+# Multiplier for the fixed page waits
+WAIT_SCALE = float(os.environ.get("SCRAPER_WAIT_SCALE", 1))
+
+# Upper bounds for the adaptive concurrency limits. The public Nominatim allows one
+# request at a time whatever this says; a self-hosted one can take more.
+GEOCODE_MAX_CONCURRENCY = int(os.environ.get("GEOCODE_MAX_CONCURRENCY", 8))
+GPT_MAX_CONCURRENCY = int(os.environ.get("GPT_MAX_CONCURRENCY", 8))
+# Tries per call when the service throttles us
+THROTTLE_ATTEMPTS = 3
+# Dropped connections and 5xx answers, retried by us since the GPT client's own retries are off
+GPT_TRANSIENT_ERRORS = (APIConnectionError, InternalServerError)
+# First wait before retrying one of those, doubled on every further attempt
+GPT_RETRY_BACKOFF_S = 0.5
+# Google redirects suspected bots to /sorry/index
+CAPTCHA_URL_MARKER = "/sorry/"
+# Geocoding fields the gazetteer can't fill. Records it resolves skip Nominatim unless
+# their name alone can't settle the KBLI code, since the OSM category feeds that.
+GAZETTEER_DEFAULTS = {"Hamlet/Quarter": "N/A", "Jalan": "N/A", "Nomor": "N/A", "Kode Pos": "N/A", "Kategori OSM": "N/A"}
+
+GPT_MODEL = "gpt-4o-mini"
+GPT_SYSTEM_PROMPT = "You are a helpful assistant that extracts structured business data and identifies official KBLI 2020 categories as defined by the OSS (Online Single Submission) Indonesia system. ALWAYS return a valid JSON object."
+
+# (prompt key, record column, description) for the administrative fields GPT can fill in
+GPT_ADMIN_FIELDS = [
+    ("negara", "Negara", "The Country (Negara)."),
+    ("provinsi", "Provinsi", "The Province (Provinsi)."),
+    ("kabupaten", "Kabupaten", "The Regency/City (Kabupaten/Kota)."),
+    ("kecamatan", "Kecamatan", "The District (Kecamatan)."),
+    ("kelurahan", "Kelurahan", "The Sub-district/Village (Kelurahan/Desa)."),
+    ("hamlet_quarter", "Hamlet/Quarter", "Neighbourhood/Environment details (Dusun/Blok/RW)."),
+    ("kode_pos", "Kode Pos", "The Postal Code."),
+]
+
+def pause(page, ms, deadline=None):
+    """Fixed wait, scaled by WAIT_SCALE and capped by what is left of `deadline`."""
+    ms = ms * WAIT_SCALE
+    if deadline is not None:
+        deadline.check()
+        ms = min(ms, deadline.remaining_ms())
+    page.wait_for_timeout(ms)
+
+def is_missing(value):
+    return value is None or str(value).strip() in ("", "N/A")
+
+def missing_admin_fields(item):
+    """Admin fields geocoding did not fill, the only ones worth asking GPT for."""
+    return [f for f in GPT_ADMIN_FIELDS if is_missing(item.get(f[1]))]
+
+def build_gpt_request(item):
+    """Chat completion arguments for one record, shared by the live and batch paths."""
+    field_lines = "\n".join(f"    - {key}: {desc}" for key, _, desc in missing_admin_fields(item))
+    # GPT for KBLI and fallback for missing geo fields
+    prompt = f"""
+    Analyze the following business information from Google Maps and provide structured data in JSON format.
+    Business Name: {item['Name']}
+    Address: {item['Address']}
+    Position: {item.get('Negara')}/{item.get('Provinsi')}/{item.get('Kabupaten')}/{item.get('Kecamatan')}/{item.get('Kelurahan')}
+    
+    Return the following fields:
+    - kbli: Predict the 5-digit KBLI 2020 code (Indonesian Standard Industrial Classification).
+{field_lines}
+
+    Format the output as a clean JSON object.
+    """
+    return {
+        "model": GPT_MODEL,
+        "messages": [
+            {"role": "system", "content": GPT_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+        "response_format": {"type": "json_object"}
+    }
+
+def apply_gpt_result(item, gpt_data):
+    """Merge a parsed GPT JSON answer into a result record."""
+    # Official titles come from the local reference table, never from the model
+    item.update(lookup_kbli(gpt_data.get("kbli")))
+    # Geocoding data wins, GPT only fills the gaps it was asked about
+    for key, column, _ in GPT_ADMIN_FIELDS:
+        if is_missing(item.get(column)):
+            item[column] = gpt_data.get(key) or "N/A"
+
+def new_usage_totals():
+    return {"calls": 0, "errors": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "latency_s": 0.0}
+
+def add_usage(totals, usage, latency_s=0.0):
+    """Add one response's `usage` (SDK object or batch dict) to per-job totals."""
+    get = usage.get if isinstance(usage, dict) else (lambda k, d=0: getattr(usage, k, d))
+    totals["calls"] += 1
+    totals["latency_s"] += latency_s
+    if usage is not None:
+        for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+            totals[key] += get(key, 0) or 0
+    return totals
+
+def apply_gpt_error(item, error):
+    item.update({
+        "KBLI": f"Error: {str(error).split('(')[0]}",
+        "Nama Resmi KBLI": "N/A",
+        "Keterangan KBLI": "N/A"
+    })
 
 class GoogleMapsScraper:
     def __init__(self, api_key=None):
-        self.results = []
+        self.results = ResultBuffer()
         self.api_key = api_key
         self.client = OpenAI(api_key=api_key) if api_key else None
+        self.kbli_local_ratio = 0.0
+        self.gpt_usage = new_usage_totals()
+        self.gpt_calls = []
+        # gpt_usage and gpt_calls are updated from the GPT worker threads
+        self._usage_lock = threading.Lock()
+        self.metrics = metrics.JobMetrics()
+        # Places sharing coordinates (branches in one mall, re-listed pins) share one Nominatim call
+        self.geocode_cache = {}
 
-    def reverse_geocode(self, lat, lng):
-        """Fetch administrative data from Nominatim (OpenStreetMap)."""
+    def reverse_geocode(self, lat, lng, outcome=None):
+        """Fetch administrative data from Nominatim (OpenStreetMap).
+
+        Failures return {}; they are also flagged on `outcome` (concurrency.Outcome) when given,
+        and HTTP 429 raises concurrency.Throttled.
+        """
         if lat == "N/A" or lng == "N/A":
             return {}
         
         try:
             # Respect OSM usage policy: Custom User-Agent and delay
             headers = {'User-Agent': 'sbrGO-Scraper/1.0 (contact@example.com)'}
-            url = f"https://nominatim.openstreetmap.org/reverse?format=json&lat={lat}&lon={lng}&zoom=18&addressdetails=1"
-            response = requests.get(url, headers=headers, timeout=10)
+            url = f"{NOMINATIM_URL}/reverse?format=json&lat={lat}&lon={lng}&zoom=18&addressdetails=1"
+            with self.metrics.span("nominatim"):
+                response = requests.get(url, headers=headers, timeout=10)
+            if response.status_code == 429:
+                raise concurrency.Throttled("Nominatim answered 429")
+            if response.status_code != 200:
+                self.metrics.count("error", stage="geocode", status=response.status_code)
+                if outcome is not None:
+                    outcome.error = True
             if response.status_code == 200:
                 data = response.json()
                 address = data.get('address', {})
@@ -39,45 +180,52 @@ class GoogleMapsScraper:
                     "Kode Pos": address.get('postcode') or "N/A",
                     "Kategori OSM": data.get('type') or address.get('amenity') or address.get('shop') or address.get('office') or "N/A"
                 }
+        except concurrency.Throttled:
+            raise
         except Exception as e:
             print(f"Geocoding error: {e}")
+            self.metrics.count("error", stage="geocode", status=type(e).__name__)
+            if outcome is not None:
+                outcome.error = True
         return {}
 
     def run(self, search_term, total_results=10, headless=False, progress_callback=None, user_lat=None, user_lng=None):
         print(f"Starting scraper for query: '{search_term}' target: {total_results} results")
         with sync_playwright() as p:
-            browser = p.chromium.launch(headless=headless)
-            context = browser.new_context()
-            page = context.new_page()
+            with self.metrics.span("launch"):
+                session = browser.BrowserSession(p, headless=headless, metrics=self.metrics).open()
+                page = session.page
 
             # 1. Search and Scroll
             # Construct URL. We still go to Maps first, but we'll use the query.
             # Using the @lat,lng in URL can sometimes force Google to a specific (and wrong) context.
             # We prefer searching with the injected text location for maximum accuracy.
-            page.goto("https://www.google.com/maps", timeout=60000)
-            page.wait_for_timeout(2000)
+            with self.metrics.span("navigate"):
+                page.goto(MAPS_URL, timeout=60000)
+                pause(page, 2000)
 
-            # Accept cookies if any
-            try:
-                page.locator('form[action^="https://consent.google.com"] button').first.click(timeout=3000)
-            except:
-                pass
+                # Accept cookies if any
+                try:
+                    page.locator('form[action^="https://consent.google.com"] button').first.click(timeout=3000)
+                except:
+                    pass
 
-            print(f"Searching for: {search_term}")
-            try:
-                page.wait_for_selector('input#searchboxinput', timeout=10000)
-                page.fill('input#searchboxinput', search_term)
-                page.wait_for_timeout(500)
-                page.keyboard.press("Enter")
-            except:
-                print("Standard selector failed, trying fallback...")
-                page.wait_for_selector('input[name="q"]', timeout=10000)
-                page.fill('input[name="q"]', search_term)
-                page.keyboard.press("Enter")
+                print(f"Searching for: {search_term}")
+                try:
+                    page.wait_for_selector('input#searchboxinput', timeout=10000)
+                    page.fill('input#searchboxinput', search_term)
+                    pause(page, 500)
+                    page.keyboard.press("Enter")
+                except:
+                    print("Standard selector failed, trying fallback...")
+                    self.metrics.count("fallback", field="search_input", source="q")
+                    page.wait_for_selector('input[name="q"]', timeout=10000)
+                    page.fill('input[name="q"]', search_term)
+                    page.keyboard.press("Enter")
             
-            # Wait for results to load
-            print("Waiting for results...")
-            page.wait_for_selector('div[role="feed"]', timeout=20000)
+                # Wait for results to load
+                print("Waiting for results...")
+                page.wait_for_selector('div[role="feed"]', timeout=20000)
             
             # Scroll to load results
             urls = set()
@@ -87,149 +235,277 @@ class GoogleMapsScraper:
             # Usually results are in 'a' tags with href containing /maps/place/
             # But sometimes they are just in the feed.
             # We want the 'a' tag that links to the place.
-            link_selector = 'a[href^="https://www.google.com/maps/place/"]'
-
-            print("Scrolling to load results...")
-            while len(urls) < total_results:
-                # Scroll the feed
-                page.locator('div[role="feed"]').hover()
-                page.mouse.wheel(0, 5000)
-                page.wait_for_timeout(2000)
+            link_selector = f'a[href^="{MAPS_URL}/place/"]'
+
+            with self.metrics.span("scroll"):
+                print("Scrolling to load results...")
+                while len(urls) < total_results:
+                    # Scroll the feed
+                    page.locator('div[role="feed"]').hover()
+                    page.mouse.wheel(0, 5000)
+                    pause(page, 2000)
                 
-                # Extract links
-                elements = page.locator(link_selector).all()
-                current_urls = {el.get_attribute('href') for el in elements}
-                urls.update(current_urls)
+                    # Extract links
+                    elements = page.locator(link_selector).all()
+                    current_urls = {el.get_attribute('href') for el in elements}
+                    urls.update(current_urls)
                 
-                print(f"Found {len(urls)} unique URLs so far...")
+                    print(f"Found {len(urls)} unique URLs so far...")
                 
-                if len(elements) == previous_count:
-                    # Try one more time with a bigger scroll or check for end of list
-                    page.mouse.wheel(0, 5000)
-                    page.wait_for_timeout(3000)
-                    # Use a separate check to break if truly stuck?
-                    # For now, simplistic break
-                    new_elements = page.locator(link_selector).all()
-                    if len(new_elements) == previous_count:
-                         print("No more results loading.")
-                         break
+                    if len(elements) == previous_count:
+                        # Try one more time with a bigger scroll or check for end of list
+                        self.metrics.count("retry", stage="scroll")
+                        page.mouse.wheel(0, 5000)
+                        pause(page, 3000)
+                        # Use a separate check to break if truly stuck?
+                        # For now, simplistic break
+                        new_elements = page.locator(link_selector).all()
+                        if len(new_elements) == previous_count:
+                             print("No more results loading.")
+                             break
                 
-                previous_count = len(elements)
+                    previous_count = len(elements)
                 
-                if len(urls) >= total_results:
-                    break
+                    if len(urls) >= total_results:
+                        break
 
             # Limit to requested total
             urls = list(urls)[:total_results]
             print(f"Collected {len(urls)} URLs. Starting detail extraction...")
 
             # 2. Extract Details for each URL
-            for i, url in enumerate(urls):
-                print(f"[{i+1}/{len(urls)}] Scraping: {url}")
+            try:
+                self.extract_all(session, urls, progress_callback)
+            finally:
+                session.close()
+
+        return self.results
+
+    def extract_all(self, session, urls, progress_callback=None):
+        """Extract every URL under a per-record budget. Stuck or crashed records are retried at the end of the queue."""
+        queue = deque((url, 1) for url in urls)
+        watchdog = browser.Watchdog(session).start()
+        # Playwright's sync API drives one page at a time, so this limiter's maximum is 1: here AIMD
+        # only backs off (the cooldown) when Google starts answering with CAPTCHA pages
+        limiter = concurrency.AdaptiveLimiter("extract", initial=1, maximum=1, metrics=self.metrics)
+        done = 0
+        try:
+            while queue:
+                url, attempt = queue.popleft()
+                print(f"[{done+1}/{len(urls)}] Scraping: {url}")
+                session.check()
                 try:
-                    self.extract_details(page, url)
-                    if progress_callback:
-                        progress_callback(i + 1, len(urls), f"Scraping: {i+1}/{len(urls)}")
+                    with limiter.slot():
+                        deadline = browser.Deadline()
+                        watchdog.arm(deadline)
+                        with self.metrics.span("extract"):
+                            self.extract_details(session.page, url, deadline)
                 except Exception as e:
+                    throttled = isinstance(e, concurrency.Throttled)
+                    timed_out = throttled or isinstance(e, (browser.RecordTimeout, PlaywrightTimeoutError))
+                    crashed = not session.healthy()
                     print(f"Error scraping {url}: {e}")
-                
-            browser.close()
-        
-        return self.results
+                    self.metrics.count("error", stage="extract",
+                                       status="crash" if crashed else "throttled" if throttled
+                                       else "timeout" if timed_out else type(e).__name__)
+                    if crashed:
+                        session.relaunch("crash")
+                    elif timed_out:
+                        # The abandoned page may still be loading; a CAPTCHA is tied to the context's cookies
+                        session.recycle("throttled" if throttled else "timeout")
+                    if (crashed or timed_out) and attempt < browser.MAX_ATTEMPTS:
+                        self.metrics.count("requeue", stage="extract")
+                        queue.append((url, attempt + 1))
+                        continue
+                finally:
+                    watchdog.disarm()
+                    session.navigated()
+                done += 1
+                if progress_callback:
+                    progress_callback(done, len(urls), f"Scraping: {done}/{len(urls)}")
+        finally:
+            watchdog.stop()
+
+    def geocode_limiter(self):
+        maximum = 1 if NOMINATIM_URL.rstrip("/") == PUBLIC_NOMINATIM_URL else GEOCODE_MAX_CONCURRENCY
+        return concurrency.AdaptiveLimiter("geocode", initial=1, maximum=maximum, metrics=self.metrics)
+
+    def geocode_with_limit(self, key, limiter):
+        """Reverse geocode `key` holding a limiter slot; the Nominatim delay is taken inside the slot."""
+        for attempt in range(THROTTLE_ATTEMPTS):
+            try:
+                with limiter.slot() as outcome:
+                    with self.metrics.span("geocode"):
+                        geo_data = self.reverse_geocode(*key, outcome=outcome)
+                    # Rate limit protection for OSM
+                    with self.metrics.span("geocode.rate_limit"):
+                        time.sleep(NOMINATIM_DELAY_S)
+                return geo_data
+            except concurrency.Throttled:
+                self.metrics.count("throttled", stage="geocode")
+        return {}
+
+    def resolve_addresses(self):
+        """Fill admin fields from the address text via the gazetteer. Returns the indices resolved down to the kelurahan."""
+        parser = gazetteer.load_gazetteer()
+        if parser is None:
+            return set()
+        resolved = set()
+        with self.metrics.span("gazetteer"):
+            parsed = parser.parse_many(item.get('Address') for item in self.results)
+            for i, fields in enumerate(parsed):
+                if gazetteer.is_complete(fields):
+                    self.results[i].update({**GAZETTEER_DEFAULTS, **fields})
+                    resolved.add(i)
+        self.metrics.count("geocode", len(resolved), source="gazetteer")
+        print(f"Addresses resolved offline: {len(resolved)}/{len(self.results)}")
+        return resolved
+
+    def needs_osm_category(self, indices, threshold=KBLI_LOCAL_THRESHOLD):
+        """The records among `indices` whose name alone doesn't reach the local KBLI threshold."""
+        indices = sorted(indices)
+        if not indices:
+            return set()
+        names = [self.results[i].get("Name") or "" for i in indices]
+        local = KBLIClassifier(threshold=threshold).classify(names)["local"].to_numpy()
+        return {i for i, ok in zip(indices, local) if not ok}
 
     def enrich_results(self, progress_callback=None):
-        """Perform reverse geocoding for all results."""
+        """Fill admin fields from addresses where the gazetteer can, and reverse geocode the rest, one request per distinct coordinate pair.
+
+        Gazetteer-resolved records the KBLI pass can't settle from the name are geocoded too,
+        for their Kategori OSM; Nominatim then only fills the fields the gazetteer left empty.
+        """
         print(f"Enriching {len(self.results)} results with Geocoding...")
+        resolved = self.resolve_addresses()
+        # Still geocoded, for the OSM category
+        osm_only = self.needs_osm_category(resolved)
+        resolved -= osm_only
+        counts = {}
         for i, item in enumerate(self.results):
-            if progress_callback:
-                progress_callback(i + 1, len(self.results), f"Geocoding: {i+1}/{len(self.results)}")
-            
-            geo_data = self.reverse_geocode(item.get('Latitude'), item.get('Longitude'))
+            if i in resolved:
+                continue
+            key = (item.get('Latitude'), item.get('Longitude'))
+            counts[key] = counts.get(key, 0) + 1
+        todo = [key for key in counts if key not in self.geocode_cache and "N/A" not in key and None not in key]
+        hits = sum(n for key, n in counts.items() if key in self.geocode_cache) + sum(counts[key] - 1 for key in todo)
+        self.metrics.count("cache_hit", hits, cache="geocode")
+
+        limiter = self.geocode_limiter()
+        done = len(self.results) - sum(counts[key] for key in todo)
+        if progress_callback and resolved:
+            progress_callback(done, len(self.results), f"Geocoding: {done}/{len(self.results)}")
+        for key, geo_data, error in concurrency.imap_unordered(
+                lambda key: self.geocode_with_limit(key, limiter), todo, limiter.maximum, name="geocode"):
+            if error is not None:
+                print(f"Geocoding error: {error}")
             if geo_data:
+                self.geocode_cache[key] = geo_data
+            done += counts[key]
+            if progress_callback:
+                progress_callback(done, len(self.results), f"Geocoding: {done}/{len(self.results)}")
+
+        for i, item in enumerate(self.results):
+            if i in resolved:
+                continue
+            geo_data = self.geocode_cache.get((item.get('Latitude'), item.get('Longitude')))
+            if geo_data and i in osm_only:
+                # Admin fields the gazetteer read from the address win over the pin's
+                item.update({k: v for k, v in geo_data.items() if is_missing(item.get(k))})
+            elif geo_data:
                 item.update(geo_data)
-            
-            # Rate limit protection for OSM
-            time.sleep(1)
 
-    def process_with_gpt(self, api_key=None, progress_callback=None):
+    def classify_kbli_local(self, threshold=KBLI_LOCAL_THRESHOLD):
+        """Offline KBLI pass over the whole batch. Returns indices still needing GPT."""
+        with self.metrics.span("kbli_local"):
+            pending = classify_records(self.results, threshold=threshold)
+        resolved = len(self.results) - len(pending)
+        self.metrics.count("kbli", resolved, source="local")
+        self.kbli_local_ratio = resolved / len(self.results) if self.results else 0.0
+        print(f"KBLI resolved locally: {resolved}/{len(self.results)} ({self.kbli_local_ratio:.0%})")
+        return pending
+
+    def gpt_with_limit(self, client, item, limiter):
+        """One chat completion for `item` holding a limiter slot. Returns the parsed answer; raises on failure."""
+        for attempt in range(THROTTLE_ATTEMPTS):
+            try:
+                with limiter.slot():
+                    started = time.perf_counter()
+                    try:
+                        with self.metrics.span("gpt"):
+                            response = client.chat.completions.create(**build_gpt_request(item))
+                    except RateLimitError as e:
+                        raise concurrency.Throttled(str(e)) from e
+                latency = time.perf_counter() - started
+                break
+            except concurrency.Throttled:
+                self.metrics.count("throttled", stage="gpt")
+                if attempt == THROTTLE_ATTEMPTS - 1:
+                    raise
+            except GPT_TRANSIENT_ERRORS as e:
+                # The slot already reported it to the limiter as an error, not a throttle
+                self.metrics.count("retry", stage="gpt", status=type(e).__name__)
+                if attempt == THROTTLE_ATTEMPTS - 1:
+                    raise
+                time.sleep(GPT_RETRY_BACKOFF_S * 2 ** attempt)
+        self.metrics.count("kbli", source="gpt")
+        with self._usage_lock:
+            add_usage(self.gpt_usage, response.usage, latency)
+            self.gpt_calls.append({
+                "Name": item.get("Name"),
+                "prompt_tokens": getattr(response.usage, "prompt_tokens", 0),
+                "completion_tokens": getattr(response.usage, "completion_tokens", 0),
+                "latency_s": round(latency, 3)
+            })
+
+        content = response.choices[0].message.content
+        if not content:
+            raise ValueError("Empty response from GPT")
+        return json.loads(content)
+
+    def process_with_gpt(self, api_key=None, progress_callback=None, local_threshold=KBLI_LOCAL_THRESHOLD):
         if api_key:
             self.api_key = api_key
             self.client = OpenAI(api_key=api_key)
+
+        # Confident local matches never reach the LLM
+        pending = self.classify_kbli_local(threshold=local_threshold)
         
         if not self.client:
             print("OpenAI client not initialized. Skipping GPT enhancement.")
             return
 
-        print(f"Enhancing {len(self.results)} results with GPT...")
-        for i, item in enumerate(self.results):
-            print(f"[{i+1}/{len(self.results)}] Processing: {item['Name']}")
-
-            # 2. GPT for KBLI and fallback for missing geo fields
-            prompt = f"""
-            Analyze the following business information from Google Maps and provide structured data in JSON format.
-            Business Name: {item['Name']}
-            Address: {item['Address']}
-            Position: {item.get('Negara')}/{item.get('Provinsi')}/{item.get('Kabupaten')}/{item.get('Kecamatan')}/{item.get('Kelurahan')}
-            
-            Return the following fields:
-            - kbli: Predict the 5-digit KBLI 2020 code (Indonesian Standard Industrial Classification).
-            - nama_kbli: The official title (Nama Resmi) for this KBLI code exactly as it appears in the OSS (Online Single Submission) system / KBLI 2020.
-            - keterangan_kbli: Brief description/scope of the KBLI category based on OSS regulations.
-            - negara: The Country (Negara).
-            - provinsi: The Province (Provinsi).
-            - kabupaten: The Regency/City (Kabupaten/Kota).
-            - kecamatan: The District (Kecamatan).
-            - kelurahan: The Sub-district/Village (Kelurahan/Desa).
-            - hamlet_quarter: Neighbourhood/Environment details (Dusun/Blok/RW).
-            - kode_pos: The Postal Code.
-
-            Format the output as a clean JSON object.
-            """
-            
-            try:
-                response = self.client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=[
-                        {"role": "system", "content": "You are a helpful assistant that extracts structured business data and identifies official KBLI 2020 categories as defined by the OSS (Online Single Submission) Indonesia system. ALWAYS return a valid JSON object."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    response_format={ "type": "json_object" }
-                )
-                
-                content = response.choices[0].message.content
-                if not content:
-                    raise ValueError("Empty response from GPT")
-                    
-                gpt_data = json.loads(content)
-                
-                # Update with GPT data, prioritizing Geocoding data for position
-                item.update({
-                    "KBLI": gpt_data.get("kbli", "N/A"),
-                    "Nama Resmi KBLI": gpt_data.get("nama_kbli", "N/A"),
-                    "Keterangan KBLI": gpt_data.get("keterangan_kbli", "N/A"),
-                    "Negara": gpt_data.get("negara", item.get("Negara", "N/A")),
-                    "Provinsi": gpt_data.get("provinsi", item.get("Provinsi", "N/A")),
-                    "Kabupaten": gpt_data.get("kabupaten", item.get("Kabupaten", "N/A")),
-                    "Kecamatan": gpt_data.get("kecamatan", item.get("Kecamatan", "N/A")),
-                    "Kelurahan": gpt_data.get("kelurahan", item.get("Kelurahan", "N/A")),
-                    "Hamlet/Quarter": gpt_data.get("hamlet_quarter", item.get("Hamlet/Quarter", "N/A")),
-                    "Kode Pos": gpt_data.get("kode_pos", item.get("Kode Pos", "N/A"))
-                })
-                
-                if progress_callback:
-                    progress_callback(i + 1, len(self.results), f"AI Analysis: {i+1}/{len(self.results)}")
-            except Exception as e:
-                error_msg = f"Error processing {item['Name']}: {str(e)}"
-                print(error_msg)
-                item.update({
-                    "KBLI": f"Error: {str(e).split('(')[0]}",
-                    "Nama Resmi KBLI": "N/A",
-                    "Keterangan KBLI": "N/A"
-                })
-
-    def extract_details(self, page, url):
-        page.goto(url, timeout=60000)
-        page.wait_for_timeout(2000) # Wait for static render
+        print(f"Enhancing {len(pending)} low-confidence results with GPT...")
+        limiter = concurrency.AdaptiveLimiter("gpt", initial=2, maximum=GPT_MAX_CONCURRENCY, metrics=self.metrics)
+        # 429s, dropped connections and 5xx come back to the limiter instead of being retried inside the SDK
+        client = self.client.with_options(max_retries=0)
+        for n, (i, gpt_data, error) in enumerate(concurrency.imap_unordered(
+                lambda i: self.gpt_with_limit(client, self.results[i], limiter), pending, limiter.maximum, name="gpt")):
+            item = self.results[i]
+            print(f"[{n+1}/{len(pending)}] Processed: {item['Name']}")
+            if error is None:
+                apply_gpt_result(item, gpt_data)
+            else:
+                print(f"Error processing {item['Name']}: {str(error)}")
+                with self._usage_lock:
+                    self.gpt_usage["errors"] += 1
+                self.metrics.count("error", stage="gpt")
+                apply_gpt_error(item, error)
+            if progress_callback:
+                progress_callback(n + 1, len(pending), f"AI Analysis: {n+1}/{len(pending)}")
+
+        u = self.gpt_usage
+        print(f"GPT usage: {u['calls']} calls, {u['prompt_tokens']} prompt + {u['completion_tokens']} completion tokens, {u['latency_s']:.1f}s")
+
+    def extract_details(self, page, url, deadline=None):
+        # Every wait below is capped by what is left of the record's budget
+        deadline = deadline or browser.Deadline()
+        left = deadline.remaining_ms
+        with self.metrics.span("extract.goto"):
+            page.goto(url, timeout=left())
+            if CAPTCHA_URL_MARKER in page.url:
+                raise concurrency.Throttled("Google answered with a CAPTCHA page")
+            pause(page, 2000, deadline) # Wait for static render
 
         try:
             # Name
@@ -238,11 +514,13 @@ class GoogleMapsScraper:
             if page.locator(name_selector).count() == 0:
                  # Try finding h1 generically
                  name_selector = 'h1'
+                 self.metrics.count("fallback", field="name", source="h1")
             
-            name = page.locator(name_selector).first.text_content()
+            name = page.locator(name_selector).first.text_content(timeout=left())
         except:
             name = "N/A"
 
+        deadline.check()
         # Rating & Reviews
         try:
             # More robust selector for rating and review count
@@ -250,19 +528,20 @@ class GoogleMapsScraper:
             # Or in div.F7nice
             rating_element = page.locator('div.F7nice').first
             if rating_element.count() > 0:
-                request_text = rating_element.text_content()
-                # Parse "4.5 (200)"
+                request_text = rating_element.text_content(timeout=left())
+                # Split "4.5 (1,234)"; numbers are parsed per batch by normalize
                 if '(' in request_text:
                     rating = request_text.split('(')[0].strip()
-                    review_count = request_text.split('(')[1].replace(')', '').replace(',', '').strip()
+                    review_count = request_text.split('(')[1].replace(')', '').strip()
                 else:
                     rating = request_text.strip()
                     review_count = "0"
             else:
                 # Try aria-label fallback for hidden elements
+                self.metrics.count("fallback", field="rating", source="aria_label")
                 stars_label = page.locator('span[aria-label*="stars"]').first
                 if stars_label.count() > 0:
-                    label = stars_label.get_attribute("aria-label")
+                    label = stars_label.get_attribute("aria-label", timeout=left())
                     # "4.5 stars 100 reviews"
                     rating = label.split(' ')[0]
                     review_count = label.split('stars ')[1].split(' ')[0] if 'stars ' in label else "0"
@@ -273,6 +552,7 @@ class GoogleMapsScraper:
             rating = "N/A"
             review_count = "N/A"
 
+        deadline.check()
         # Address, Website, Phone
         address = "N/A"
         website = "N/A"
@@ -281,21 +561,22 @@ class GoogleMapsScraper:
         try:
             address_btn = page.locator('button[data-item-id="address"]')
             if address_btn.count() > 0:
-                address = address_btn.first.get_attribute("aria-label").replace("Address: ", "")
+                address = address_btn.first.get_attribute("aria-label", timeout=left()).replace("Address: ", "")
         except: pass
 
         try:
              phone_btn = page.locator('button[data-item-id^="phone"]')
              if phone_btn.count() > 0:
-                 phone = phone_btn.first.get_attribute("aria-label").replace("Phone: ", "")
+                 phone = phone_btn.first.get_attribute("aria-label", timeout=left()).replace("Phone: ", "")
         except: pass
 
         try:
             website_btn = page.locator('a[data-item-id="authority"]')
             if website_btn.count() > 0:
-                website = website_btn.first.get_attribute("href")
+                website = website_btn.first.get_attribute("href", timeout=left())
         except: pass
 
+        deadline.check()
         # Extract Operation Hours (New)
         operation_hours = "N/A"
         try:
@@ -303,11 +584,12 @@ class GoogleMapsScraper:
             hours_btn = page.locator('div[aria-label*="hours"], button[aria-label*="hours"]').first
             if hours_btn.count() > 0:
                 # Try to get the raw text first (often says "Open now · 08.00–17.00")
-                operation_hours = hours_btn.text_content().strip()
+                operation_hours = hours_btn.text_content(timeout=left()).strip()
                 # If it's just a summary, we could potentially click to get more, 
                 # but let's start with the visible text which is usually what users want.
         except: pass
 
+        deadline.check()
         # Extract Latest Review Time (New)
         latest_review_time = "N/A"
         try:
@@ -318,19 +600,22 @@ class GoogleMapsScraper:
                 # The relative time is usually in a span or specific class like .rS69Wb
                 time_el = review_snippet.locator('span.rS69Wb').first
                 if time_el.count() > 0:
-                    latest_review_time = time_el.text_content().strip()
+                    latest_review_time = time_el.text_content(timeout=left()).strip()
         except: pass
 
+        deadline.check()
         # Extract Latitude and Longitude from URL
         latitude = "N/A"
         longitude = "N/A"
+        coord_source = "none"
         try:
-            page.wait_for_timeout(1000)
+            pause(page, 1000, deadline)
             current_url = page.url
             match = re.search(r'@(-?\d+\.\d+),(-?\d+\.\d+)', current_url)
             if match:
                 latitude = match.group(1)
                 longitude = match.group(2)
+                coord_source = "url"
             
             if latitude == "N/A":
                 html = page.content()
@@ -338,16 +623,21 @@ class GoogleMapsScraper:
                 if match:
                     latitude = match.group(1)
                     longitude = match.group(2)
+                    coord_source = "html"
 
             if latitude == "N/A":
                 directions_btn = page.locator('a[href*="/dir/"]').first
                 if directions_btn.count() > 0:
-                    dir_url = directions_btn.get_attribute("href")
+                    dir_url = directions_btn.get_attribute("href", timeout=left())
                     match = re.search(r'/(-?\d+\.\d+),(-?\d+\.\d+)/', dir_url)
                     if match:
                         latitude = match.group(1)
                         longitude = match.group(2)
+                        coord_source = "directions"
         except: pass
+        self.metrics.count("coordinates", source=coord_source)
+        # Fields read after the budget ran out may have been cut short; the record is retried instead
+        deadline.check()
 
         self.results.append({
             "Name": name,
@@ -368,10 +658,14 @@ class GoogleMapsScraper:
             print("No data to save.")
             return
 
-        df = pd.DataFrame(self.results)
+        df = normalize.normalize_frame(self.results.to_frame())
         
         # Clean data
         df = df.drop_duplicates()
+        unique = len(df)
+        df = dedup.drop_near_duplicates(df)
+        if len(df) < unique:
+            print(f"Merged {unique - len(df)} near-duplicate places")
         
         # Save CSV
         df.to_csv(f"{filename}.csv", index=False)
@@ -395,3 +689,6 @@ if __name__ == "__main__":
     scraper = GoogleMapsScraper()
     scraper.run(args.search, args.total, args.headless)
     scraper.save_data(f"gmaps_{args.search.replace(' ', '_')}")
+    metrics.publish(scraper.metrics)
+    for row in scraper.metrics.summary():
+        print(f"{row['stage']:<20} {row['calls']:>4} calls {row['total_s']:>8.2f}s (p95 {row['p95_s']:.2f}s)")
@@ -0,0 +1,86 @@
+"""Tokenization for full-text search over stored places.
+
+Names and addresses are folded to lowercase ASCII words. Indonesian address
+abbreviations are expanded ("Jl." and "Jln" both become "jalan"),
+reduplicated words are reduced ("toko-toko" -> "toko") and common function
+words are dropped, so the indexed terms and the query terms agree. Query
+terms match any indexed term they are a prefix of.
+"""
+import re
+import unicodedata
+
+import pandas as pd
+
+# Searchable columns and the weight of a match in each
+SEARCH_COLUMNS = {"Name": 5, "Nama Resmi KBLI": 2, "Jalan": 2, "Kelurahan": 2, "Address": 1}
+
+# Longer terms are cut to the indexed column width
+MAX_TERM_LENGTH = 64
+MIN_TERM_LENGTH = 2
+
+ABBREVIATIONS = {
+    "jl": "jalan", "jln": "jalan", "gg": "gang", "kel": "kelurahan", "kec": "kecamatan",
+    "kab": "kabupaten", "prov": "provinsi", "ds": "desa", "dsn": "dusun",
+    "komp": "kompleks", "perum": "perumahan", "blk": "blok", "no": "nomor", "rm": "rumah makan",
+    "kav": "kavling", "sdn": "sd negeri", "smpn": "smp negeri", "sman": "sma negeri",
+}
+
+STOPWORDS = {"dan", "di", "ke", "dari", "yang", "untuk", "dengan", "atau", "the", "of", "and"}
+
+_WORD = re.compile(r"[a-z0-9]+(?:-[a-z0-9]+)*")
+
+
+def fold(value):
+    """Lowercase ASCII form of a text value ('' for missing values)."""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return ""
+    value = unicodedata.normalize("NFKD", str(value))
+    return value.encode("ascii", "ignore").decode("ascii").lower()
+
+
+def tokenize(value):
+    """Search terms of a text value, in order, with repeats."""
+    terms = []
+    for word in _WORD.findall(fold(value)):
+        parts = word.split("-")
+        # Reduplication ("toko-toko", "kue-kue") indexes the base word once
+        if len(set(parts)) == 1:
+            parts = parts[:1]
+        for part in parts:
+            for term in ABBREVIATIONS.get(part, part).split():
+                if len(term) >= MIN_TERM_LENGTH and term not in STOPWORDS:
+                    terms.append(term[:MAX_TERM_LENGTH])
+    return terms
+
+
+def query_terms(query):
+    """Distinct terms of a search box query, in order."""
+    return list(dict.fromkeys(tokenize(query)))
+
+
+def query_variants(term):
+    """`term` plus the abbreviations that expand to it, for matching raw (unexpanded) text."""
+    return [term] + sorted(a for a, full in ABBREVIATIONS.items() if full == term and a != term)
+
+
+def prefix_range(term):
+    """[low, high) bounds of the terms starting with `term`, usable as an index range scan."""
+    return term, term[:-1] + chr(ord(term[-1]) + 1)
+
+
+def document_terms(frame, id_column="id"):
+    """(term, row_id, weight) rows for the searchable columns of `frame`.
+
+    A term's weight is the sum of its column weights over every occurrence
+    in the row.
+    """
+    rows = []
+    for column, weight in SEARCH_COLUMNS.items():
+        if column not in frame.columns:
+            continue
+        for row_id, value in zip(frame[id_column], frame[column]):
+            rows.extend((term, int(row_id), weight) for term in tokenize(value))
+    if not rows:
+        return pd.DataFrame(columns=["term", "row_id", "weight"])
+    terms = pd.DataFrame(rows, columns=["term", "row_id", "weight"])
+    return terms.groupby(["term", "row_id"], as_index=False, sort=False)["weight"].sum()
@@ -0,0 +1,129 @@
+"""Cold start bookkeeping: phase timings and the Playwright browser check.
+
+Only the standard library is imported here, so app.py can import it first;
+phases are timed from that first import. The browser check looks for an
+installed Chromium on disk; only when none is found does a background
+thread run `playwright install chromium`, so no page waits on it.
+
+    python startup.py    # cold import time of each heavy module
+"""
+import os
+import sys
+import glob
+import time
+import threading
+import subprocess
+
+PROCESS_START = time.perf_counter()
+
+# Modules app.py and its pages pull in, for the import-time report
+HEAVY_MODULES = [
+    "streamlit", "pandas", "sqlalchemy", "db", "requests", "folium", "streamlit_folium",
+    "streamlit_js_eval", "openai", "playwright.sync_api", "scraper", "pyarrow", "duckdb",
+]
+
+# Seconds `playwright install chromium` may take before it is abandoned
+BROWSER_INSTALL_TIMEOUT = 600
+
+_timings = {}
+_reported = False
+_browser = {"status": "unknown", "error": None}
+_browser_lock = threading.Lock()
+
+
+def mark(phase):
+    """Record seconds since PROCESS_START for `phase` (first time only)."""
+    _timings.setdefault(phase, time.perf_counter() - PROCESS_START)
+
+
+def timings():
+    """{phase: seconds since PROCESS_START}, in the order the phases were reached."""
+    return dict(_timings)
+
+
+def report_once():
+    """Print the startup phases to the server log, once per process."""
+    global _reported
+    if _reported or not _timings:
+        return
+    _reported = True
+    print("Startup: " + ", ".join(f"{phase} {seconds * 1000:.0f} ms" for phase, seconds in _timings.items()))
+
+
+# --- PLAYWRIGHT BROWSER ---
+
+def browsers_path():
+    """Directory Playwright installs browsers into on this platform."""
+    custom = os.environ.get("PLAYWRIGHT_BROWSERS_PATH")
+    if custom and custom != "0":
+        return custom
+    if sys.platform == "win32":
+        return os.path.join(os.environ.get("LOCALAPPDATA", os.path.expanduser("~")), "ms-playwright")
+    if sys.platform == "darwin":
+        return os.path.expanduser("~/Library/Caches/ms-playwright")
+    return os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "ms-playwright")
+
+
+def browser_installed():
+    """True when a Chromium build (full or headless shell) is already installed. A directory listing, no subprocess."""
+    if os.environ.get("PLAYWRIGHT_BROWSERS_PATH") == "0":
+        # Browsers installed inside the playwright package itself
+        try:
+            import playwright
+        except ImportError:
+            return False
+        root = os.path.join(os.path.dirname(playwright.__file__), "driver", "package", ".local-browsers")
+    else:
+        root = browsers_path()
+    return bool(glob.glob(os.path.join(root, "chromium*-*")))
+
+
+def _install_browser():
+    try:
+        result = subprocess.run([sys.executable, "-m", "playwright", "install", "chromium"],
+                                capture_output=True, text=True, timeout=BROWSER_INSTALL_TIMEOUT)
+        if result.returncode == 0:
+            _browser.update(status="ready", error=None)
+        else:
+            _browser.update(status="failed", error=(result.stderr or result.stdout).strip()[-500:])
+    except Exception as e:
+        _browser.update(status="failed", error=str(e))
+    print(f"Playwright chromium install: {_browser['status']}")
+
+
+def ensure_browser():
+    """Start the browser check once per process. Returns browser_status()."""
+    with _browser_lock:
+        if _browser["status"] == "unknown":
+            if browser_installed():
+                _browser["status"] = "ready"
+            else:
+                _browser["status"] = "installing"
+                threading.Thread(target=_install_browser, name="playwright-install", daemon=True).start()
+    return browser_status()
+
+
+def browser_status():
+    """'ready', 'installing', 'failed' (see browser_error()) or 'unknown' before ensure_browser()."""
+    return _browser["status"]
+
+
+def browser_error():
+    return _browser["error"]
+
+
+# --- IMPORT TIME REPORT ---
+
+def import_seconds(module):
+    """Cold import time of `module` in a fresh interpreter, or None when it fails to import."""
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    return float(result.stdout.strip()) if result.returncode == 0 else None
+
+
+if __name__ == "__main__":
+    for module in HEAVY_MODULES:
+        seconds = import_seconds(module)
+        print(f"{module:<22} {'not importable' if seconds is None else f'{seconds * 1000:7.0f} ms'}")
+    print(f"Playwright chromium installed: {browser_installed()} ({browsers_path()})")